@@ -0,0 +1,214 @@
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import pandas as pd
+import contextlib
+import json
+import os
+import re
+import sys
+import traceback
+
+from ingestion import CRED_PATH, COLLECTION_NAME, USER_ID_FIELD, fetch_and_preprocess_data, fetch_and_preprocess_chunked
+from pipeline import run_stages
+from rollup import UNASSIGNED_USER_ID, aggregate_cells
+from savings_suggestions import suggest_savings_batch, suggest_savings_cells
+from result_store import write_results
+import result_cache
+from data_sources import source_from_argv
+from instrumentation import add_count, configure_from_argv, write_run_summary
+
+# --- Configuration ---
+MAX_WORKERS = os.cpu_count() or 1 # Worker processes in the pool
+USERS_PER_TASK = 64 # Users shipped to a worker per task; amortizes pickling and scheduling overhead
+TASKS_IN_FLIGHT_PER_WORKER = 2 # Bounds queued work so pending partitions are not all pickled at once
+USER_RESULTS_DIR = "ML/results/users"
+USER_RESULT_FORMAT = "orjson" # Compact per-user files; see result_store for the other formats
+
+# --- Helper Functions ---
+
+def user_results_path(user_id, output_dir=USER_RESULTS_DIR):
+    """Path of a user's results file; the user ID is sanitized for use as a file name."""
+    safe_id = re.sub(r"[^A-Za-z0-9_.-]", "_", str(user_id))
+    return os.path.join(output_dir, f"{safe_id}.json")
+
+def partition_by_user(df):
+    """Yields (user_id, transactions) for every user in the preprocessed DataFrame."""
+    if USER_ID_FIELD not in df.columns:
+        print(f"No '{USER_ID_FIELD}' field found; analyzing all transactions as user '{UNASSIGNED_USER_ID}'.")
+        yield UNASSIGNED_USER_ID, df
+        return
+
+    user_ids = df[USER_ID_FIELD]
+    if user_ids.isna().any():
+        user_ids = user_ids.cat.add_categories([UNASSIGNED_USER_ID]).fillna(UNASSIGNED_USER_ID)
+    for user_id, user_df in df.groupby(user_ids, observed=True, sort=False):
+        yield user_id, user_df
+
+def _chunked(iterable, size):
+    """Groups an iterable into lists of at most size items."""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _cached_savings(user_cells):
+    """Splits users into those with cached savings results and those still to compute.
+
+    Returns ({user_id: cached result}, {user_id: cache key or None}); the keys are the ones
+    suggest_savings_cells uses, so per-user and batched runs share entries.
+    """
+    if not result_cache.RESULT_CACHE_ENABLED:
+        return {}, dict.fromkeys(user_cells)
+    cached, pending = {}, {}
+    for user_id, cells in user_cells.items():
+        key = suggest_savings_cells.cache_key(cells)
+        result = result_cache.get_cache().get(key)
+        if result is None:
+            pending[user_id] = key
+        else:
+            cached[user_id] = result
+    add_count("result_cache_hits", len(cached))
+    add_count("result_cache_misses", len(pending))
+    return cached, pending
+
+# --- Worker ---
+
+def analyze_users(partitions, output_dir=USER_RESULTS_DIR, fmt=USER_RESULT_FORMAT, use_result_cache=False):
+    """Runs every stage for a chunk of users and writes one results file per user.
+
+    Runs inside a worker process. A failing user is recorded and skipped so it cannot
+    take the rest of its chunk down. Returns ((user_id, error or None) pairs, the batched
+    savings error or None).
+    """
+    # Passed explicitly: workers started with spawn do not inherit the parent's setting
+    result_cache.RESULT_CACHE_ENABLED = use_result_cache
+    # Savings suggestions for the whole chunk in one vectorized pass, except for users whose
+    # cells are unchanged since a previous run (see result_cache)
+    savings_error = None
+    try:
+        user_cells = {str(user_id): aggregate_cells(user_df) for user_id, user_df in partitions if not user_df.empty}
+        savings_by_user, pending_keys = _cached_savings(user_cells)
+        pending_cells = [user_cells[user_id].assign(**{USER_ID_FIELD: user_id}) for user_id in pending_keys]
+        if pending_cells:
+            computed = suggest_savings_batch(pd.concat(pending_cells, ignore_index=True))
+            for user_id, key in pending_keys.items():
+                if user_id in computed and key is not None:
+                    result_cache.get_cache().put(key, computed[user_id])
+            savings_by_user.update(computed)
+    except Exception as e:
+        # Every user's savings are then computed on its own by run_stages below
+        savings_error = f"{type(e).__name__}: {e}"
+        print(f"Warning: Batched savings suggestions failed, falling back to per-user savings: {savings_error}", file=sys.stderr)
+        add_count("batch_savings_fallbacks")
+        savings_by_user = {}
+
+    statuses = []
+    for user_id, user_df in partitions:
+        try:
+            # Per-user stage progress would flood the log at this scale
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                results = run_stages(user_df, savings_by_user.get(str(user_id)), str(user_id))
+            write_results(results, user_results_path(user_id, output_dir), fmt)
+            statuses.append((user_id, None))
+        except Exception as e:
+            statuses.append((user_id, f"{type(e).__name__}: {e}"))
+    return statuses, savings_error
+
+# --- Batch Engine ---
+
+def run_batch(df, max_workers=MAX_WORKERS, users_per_task=USERS_PER_TASK, output_dir=USER_RESULTS_DIR, fmt=USER_RESULT_FORMAT,
+              use_result_cache=None):
+    """Partitions transactions by user and analyzes the partitions across a process pool.
+
+    Per-user results are written in the given result format (see result_store). Workers use
+    the result cache if use_result_cache is set, by default when it is enabled in this process.
+    Returns a summary with the number of users processed, the users that failed and the
+    chunks whose batched savings pass failed (their users fell back to per-user savings).
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    chunks = _chunked(partition_by_user(df), users_per_task)
+    max_in_flight = max_workers * TASKS_IN_FLIGHT_PER_WORKER
+    if use_result_cache is None:
+        use_result_cache = result_cache.RESULT_CACHE_ENABLED
+
+    succeeded = 0
+    failed = {}
+    savings_fallbacks = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        in_flight = {}
+
+        def submit_next():
+            chunk = next(chunks, None)
+            if chunk is None:
+                return False
+            future = executor.submit(analyze_users, chunk, output_dir, fmt, use_result_cache)
+            in_flight[future] = [user_id for user_id, _ in chunk]
+            return True
+
+        while len(in_flight) < max_in_flight and submit_next():
+            pass
+
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                user_ids = in_flight.pop(future)
+                try:
+                    statuses, savings_error = future.result()
+                    if savings_error is not None:
+                        savings_fallbacks.append({"users": [str(user_id) for user_id in user_ids], "error": savings_error})
+                    for user_id, error in statuses:
+                        if error is None:
+                            succeeded += 1
+                        else:
+                            failed[str(user_id)] = error
+                except Exception as e:
+                    # The worker itself died (e.g. killed for memory); only its chunk is lost
+                    for user_id in user_ids:
+                        failed[str(user_id)] = f"Worker failed: {type(e).__name__}: {e}"
+                submit_next()
+
+    print(f"Batch complete: {succeeded} users analyzed, {len(failed)} failed.")
+    if savings_fallbacks:
+        print(f"Warning: The batched savings pass failed for {len(savings_fallbacks)} chunk(s); their users used per-user savings.")
+    return {"users_analyzed": succeeded, "users_failed": len(failed), "failures": failed,
+            "savings_fallbacks": savings_fallbacks, "output_dir": output_dir}
+
+# --- Main Execution ---
+if __name__ == "__main__":
+    prometheus_path = configure_from_argv() # --profile=<stage>[:tracemalloc], --prometheus=<path>
+    result_cache.enable_from_argv() # Reuses stored stage results for unchanged data; --no-result-cache recomputes everything
+    summary = {}
+    try:
+        print("Starting data fetching and preprocessing for the per-user batch...")
+        source = source_from_argv(sys.argv)
+        if "--chunked" in sys.argv:
+            df_processed = fetch_and_preprocess_chunked(CRED_PATH, COLLECTION_NAME, source=source)
+        else:
+            df_processed = fetch_and_preprocess_data(CRED_PATH, COLLECTION_NAME, source=source)
+
+        if not df_processed.empty:
+            result_format = next((arg.split("=", 1)[1] for arg in sys.argv if arg.startswith("--format=")), USER_RESULT_FORMAT)
+            summary = run_batch(df_processed, fmt=result_format)
+        else:
+            summary["error"] = "No valid expense data found for analysis."
+    except FileNotFoundError as e:
+        print(f"Error: {e}")
+        summary["error"] = str(e)
+    except ValueError as e:
+        print(f"Data Error: {e}")
+        summary["error"] = f"Data Error: {e}"
+    except Exception as e:
+        print(f"An unexpected error occurred: {e}")
+        print(f"Traceback: {traceback.format_exc()}")
+        summary["error"] = f"An unexpected error occurred: {e}"
+
+    summary_path = os.path.join(USER_RESULTS_DIR, "_summary.json")
+    os.makedirs(USER_RESULTS_DIR, exist_ok=True)
+    print(f"Saving batch summary to {summary_path}...")
+    with open(summary_path, "w") as f:
+        json.dump(summary, f, indent=2, default=str)
+
+    write_run_summary(prometheus_path=prometheus_path)
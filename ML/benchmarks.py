@@ -0,0 +1,164 @@
+import pandas as pd
+import numpy as np
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from ingestion import preprocess_transactions
+from spending_analysis import analyze_spending_patterns, detect_anomalies_iqr
+from expense_forecasting import forecast_expenses
+from savings_suggestions import suggest_savings
+from personalized_tips import generate_tips, usable_result
+from data_sources import SYNTHETIC_CATEGORY_MEANS, SyntheticSource
+from instrumentation import count_rows
+from result_cache import bypass
+
+# --- Configuration ---
+BENCHMARK_SIZES = [10_000, 1_000_000, 10_000_000] # Raw transactions per benchmark run
+ROWS_PER_USER = 200 # Users scale with the data set: rows // ROWS_PER_USER
+BENCHMARK_CATEGORIES = 40 # Categories in the generated data (the synthetic defaults plus generated ones)
+BENCHMARK_SEED = 0
+REPEATS = 1 # Timed runs per stage; the fastest is reported
+MEASURE_MEMORY = True # Extra tracemalloc pass per stage for peak memory (kept out of the timed runs)
+BENCHMARK_DIR = "ML/results/benchmarks"
+REGRESSION_THRESHOLD = 1.2 # Slowdowns beyond this ratio are flagged when comparing to a baseline
+
+# --- Helper Functions ---
+
+def benchmark_categories(count=BENCHMARK_CATEGORIES, seed=BENCHMARK_SEED):
+    """Category -> mean amount: the synthetic defaults, extended with generated categories up to count."""
+    categories = dict(list(SYNTHETIC_CATEGORY_MEANS.items())[:count])
+    rng = np.random.default_rng(seed)
+    for i in range(len(categories), count):
+        categories[f"Category {i:02d}"] = round(float(rng.lognormal(3.5, 0.8)), 2)
+    return categories
+
+def git_revision():
+    """Current commit of the working tree, or None outside a git checkout."""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def measure(func, *args):
+    """Runs a stage REPEATS times with its output silenced; returns (result, seconds, peak_mb).
+
+    The result cache is bypassed so every run does the full computation.
+    """
+    timings = []
+    for _ in range(REPEATS):
+        with bypass(), contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            result = func(*args)
+            timings.append(time.perf_counter() - start)
+
+    peak_mb = None
+    if MEASURE_MEMORY:
+        tracemalloc.start()
+        try:
+            with bypass(), contextlib.redirect_stdout(io.StringIO()):
+                func(*args)
+            peak_mb = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+        finally:
+            tracemalloc.stop()
+    return result, min(timings), peak_mb
+
+# --- Core Functions ---
+
+def benchmark_size(rows, categories=None, seed=BENCHMARK_SEED):
+    """Times every ML stage on one synthetic data set; returns the per-stage measurements."""
+    categories = categories or benchmark_categories(seed=seed)
+    users = max(1, rows // ROWS_PER_USER)
+    raw = pd.DataFrame(SyntheticSource(rows, users=users, seed=seed, categories=categories).fetch_columns())
+
+    stages = {}
+    def run(name, func, *args):
+        result, seconds, peak_mb = measure(func, *args)
+        stages[name] = {
+            "seconds": round(seconds, 6),
+            "peak_mb": None if peak_mb is None else round(peak_mb, 3),
+            "rows_in": count_rows(args[0]),
+            "rows_out": count_rows(result),
+        }
+        print(f"  {name}: {seconds:.3f}s" + (f", peak {peak_mb:.1f} MB" if peak_mb is not None else ""))
+        return result
+
+    print(f"Benchmarking {rows} transactions ({users} users, {len(categories)} categories)...")
+    df = run("preprocessing", preprocess_transactions, raw)
+    del raw
+    spending = {
+        "spending_patterns": run("analyze_spending_patterns", analyze_spending_patterns, df),
+        "anomalies": run("detect_anomalies_iqr", detect_anomalies_iqr, df),
+    }
+    forecast = run("forecast_expenses", forecast_expenses, df)
+    savings = run("suggest_savings", suggest_savings, df)
+    run("generate_tips", generate_tips, usable_result(spending), usable_result(forecast), usable_result(savings))
+    return {"rows": rows, "users": users, "categories": len(categories), "expense_rows": len(df), "stages": stages}
+
+def run_benchmarks(sizes=BENCHMARK_SIZES, categories=BENCHMARK_CATEGORIES, seed=BENCHMARK_SEED):
+    """Benchmarks every size; returns a report with the environment needed to compare runs."""
+    category_means = benchmark_categories(categories, seed)
+    return {
+        "created_at": pd.Timestamp.now(tz="UTC").isoformat(),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "repeats": REPEATS,
+        "seed": seed,
+        "results": [benchmark_size(rows, category_means, seed) for rows in sizes],
+    }
+
+def compare_reports(baseline, current, threshold=REGRESSION_THRESHOLD):
+    """Per-stage time ratios (current / baseline) for sizes present in both reports.
+
+    Returns a list of {rows, stage, baseline_seconds, seconds, ratio, regression} records.
+    """
+    baseline_by_rows = {result["rows"]: result["stages"] for result in baseline["results"]}
+    comparison = []
+    for result in current["results"]:
+        previous = baseline_by_rows.get(result["rows"])
+        if previous is None:
+            continue
+        for stage, measured in result["stages"].items():
+            if stage not in previous or not previous[stage]["seconds"]:
+                continue
+            ratio = measured["seconds"] / previous[stage]["seconds"]
+            comparison.append({
+                "rows": result["rows"],
+                "stage": stage,
+                "baseline_seconds": previous[stage]["seconds"],
+                "seconds": measured["seconds"],
+                "ratio": round(ratio, 3),
+                "regression": ratio > threshold,
+            })
+    return comparison
+
+# --- Main Execution ---
+if __name__ == "__main__":
+    sizes = next(([int(size) for size in arg.split("=", 1)[1].split(",")] for arg in sys.argv if arg.startswith("--sizes=")), BENCHMARK_SIZES)
+    baseline_path = next((arg.split("=", 1)[1] for arg in sys.argv if arg.startswith("--compare=")), None)
+
+    report = run_benchmarks(sizes)
+    os.makedirs(BENCHMARK_DIR, exist_ok=True)
+    output_path = os.path.join(BENCHMARK_DIR, f"benchmark_{pd.Timestamp.now():%Y%m%d_%H%M%S}.json")
+
+    if baseline_path:
+        with open(baseline_path, "r") as f:
+            report["comparison"] = compare_reports(json.load(f), report)
+        for entry in report["comparison"]:
+            flag = "  <-- regression" if entry["regression"] else ""
+            print(f"{entry['rows']:>10} {entry['stage']:<26} {entry['baseline_seconds']:.3f}s -> {entry['seconds']:.3f}s ({entry['ratio']:.2f}x){flag}")
+
+    print(f"Saving benchmark results to {output_path}...")
+    with open(output_path, "w") as f:
+        json.dump(report, f, indent=2, default=str)
+    print("Results saved successfully.")
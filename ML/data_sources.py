@@ -0,0 +1,220 @@
+import pandas as pd
+import numpy as np
+import os
+import sys
+
+from ingestion import (CRED_PATH, COLLECTION_NAME, DATE_FORMAT, INGEST_FIELDS, PAGE_SIZE, USER_ID_FIELD, MAX_FETCH_WORKERS,
+                       EMULATOR_HOST_ENV, fetch_documents, iter_document_pages, shard_queries, iter_shards, fetch_shards,
+                       parse_date_range)
+
+# --- Configuration ---
+DATA_SOURCE = "firestore" # "firestore", "file" (CSV/Parquet) or "synthetic"
+DATA_SOURCES = ("firestore", "file", "synthetic")
+DATA_PATH = "ML/data/transactions.parquet" # File read by the "file" source (.csv or .parquet)
+SYNTHETIC_ROWS = 100_000 # Transactions generated by the "synthetic" source
+SYNTHETIC_USERS = 1_000
+SYNTHETIC_SEED = 0
+SYNTHETIC_START = "2022-01-01" # First day of generated history; it runs to yesterday
+SYNTHETIC_EXPENSE_SHARE = 0.8 # The rest are income rows the preprocessing filters out
+SYNTHETIC_BLOCK_ROWS = 100_000 # Rows generated per RNG block, so paging never changes the data
+SYNTHETIC_CATEGORY_MEANS = { # Mean expense amount per category
+    "Groceries": 55.0,
+    "Restaurants": 35.0,
+    "Fast Food": 12.0,
+    "Utilities": 90.0,
+    "Gas & Fuel": 45.0,
+    "Shopping": 60.0,
+    "Entertainment": 25.0,
+    "Alcohol": 20.0,
+    "Travel": 250.0,
+    "Health": 70.0,
+}
+
+# A data source hands raw transaction columns to ingestion, which applies the same preprocessing
+# to every source:
+#   fetch_columns(fields) -> {field: values} for the fields present in the data
+#   iter_pages(page_size, fields) -> yields (columns, seen_fields) per page of at most page_size rows
+
+# --- Helper Functions ---
+
+def _present_columns(frame, fields):
+    """Requested fields of a raw frame as column arrays, leaving out fields the data does not carry."""
+    return {field: frame[field].to_numpy() for field in fields if field in frame.columns}
+
+def generate_transactions(rows, users=SYNTHETIC_USERS, seed=SYNTHETIC_SEED, start=SYNTHETIC_START, end=None,
+                          expense_share=SYNTHETIC_EXPENSE_SHARE, categories=SYNTHETIC_CATEGORY_MEANS, first_id=0):
+    """Generates raw transaction columns shaped like the app's documents (dates as MM/DD/YYYY strings).
+
+    Amounts are gamma-distributed around each category's mean and scaled per user, so users differ
+    in level and categories differ in size.
+    """
+    rng = np.random.default_rng([seed, first_id])
+    days = pd.date_range(start, end or pd.Timestamp.now().normalize() - pd.Timedelta(days=1))
+    date_strings = np.asarray(days.strftime(DATE_FORMAT), dtype=object)
+    names = np.array(list(categories), dtype=object)
+    means = np.array(list(categories.values()))
+    user_ids = np.array([f"user{i}" for i in range(users)], dtype=object)
+    user_scale = np.random.default_rng([seed, users]).lognormal(0.0, 0.4, users) # Same per user in every block
+
+    user_index = rng.integers(users, size=rows)
+    category_index = rng.integers(len(names), size=rows)
+    amounts = rng.gamma(2.0, 0.5, size=rows) * means[category_index] * user_scale[user_index]
+    return {
+        "id": np.char.add("txn", np.arange(first_id, first_id + rows).astype(str)).astype(object),
+        USER_ID_FIELD: user_ids[user_index],
+        "isExpense": rng.random(rows) < expense_share,
+        "amount": np.round(amounts, 2),
+        "date": date_strings[rng.integers(len(days), size=rows)],
+        "category": names[category_index],
+    }
+
+# --- Data Sources ---
+
+class FirestoreSource:
+    """Reads the collection from Firestore, or from the local emulator when emulator_host is given.
+
+    A date_range is pushed into the queries (see ingestion.filtered_queries).
+    """
+
+    def __init__(self, cred_path=CRED_PATH, collection_name=COLLECTION_NAME, emulator_host=None, date_range=None):
+        self.cred_path = cred_path
+        self.collection_name = collection_name
+        self.date_range = date_range
+        if emulator_host:
+            os.environ[EMULATOR_HOST_ENV] = emulator_host
+
+    def fetch_columns(self, fields=INGEST_FIELDS):
+        return fetch_documents(self.cred_path, self.collection_name, fields, self.date_range)
+
+    def iter_pages(self, page_size=PAGE_SIZE, fields=INGEST_FIELDS):
+        return iter_document_pages(self.cred_path, self.collection_name, page_size, fields, self.date_range)
+
+class ShardedFirestoreSource:
+    """Reads many collections (e.g. per-user subcollections) and/or the partitions of a collection
+    group concurrently on a bounded thread pool sharing one client.
+
+    Every shard query carries the same filters, projection and date_range pushdown as FirestoreSource.
+    """
+
+    def __init__(self, cred_path=CRED_PATH, collection_names=(), collection_group=None,
+                 partition_count=MAX_FETCH_WORKERS, max_workers=MAX_FETCH_WORKERS, date_range=None):
+        self.cred_path = cred_path
+        self.collection_names = list(collection_names)
+        self.collection_group = collection_group
+        self.partition_count = partition_count
+        self.max_workers = max_workers
+        self.date_range = date_range
+
+    def _queries(self, fields):
+        return shard_queries(self.cred_path, self.collection_names, self.collection_group, self.partition_count,
+                             fields, self.date_range)
+
+    def fetch_columns(self, fields=INGEST_FIELDS):
+        return fetch_shards(self._queries(fields), fields, self.max_workers)
+
+    def iter_pages(self, page_size=PAGE_SIZE, fields=INGEST_FIELDS):
+        # Pages follow shard completion order; each shard is split into pages of at most page_size
+        for _, columns, seen in iter_shards(self._queries(fields), fields, self.max_workers):
+            present = {field: values for field, values in columns.items() if field in seen}
+            rows = len(next(iter(columns.values()), []))
+            for offset in range(0, rows, page_size):
+                yield {field: values[offset:offset + page_size] for field, values in present.items()}, seen
+
+class FileSource:
+    """Reads raw transactions from a local CSV or Parquet file (e.g. an export or the snapshot cache)."""
+
+    def __init__(self, path=DATA_PATH):
+        self.path = path
+        self.is_csv = path.lower().endswith(".csv")
+
+    def _read_csv(self, fields, chunksize=None):
+        # Every field stays a string like Firestore string fields; only empty cells are missing
+        return pd.read_csv(self.path, usecols=lambda column: column in fields, dtype=str,
+                           keep_default_na=False, na_values=[""], chunksize=chunksize)
+
+    def _parquet_fields(self, fields):
+        import pyarrow.parquet as pq
+        return [field for field in fields if field in pq.read_schema(self.path).names]
+
+    def fetch_columns(self, fields=INGEST_FIELDS):
+        if self.is_csv:
+            frame = self._read_csv(fields)
+        else:
+            frame = pd.read_parquet(self.path, columns=self._parquet_fields(fields))
+        return _present_columns(frame, fields)
+
+    def iter_pages(self, page_size=PAGE_SIZE, fields=INGEST_FIELDS):
+        if self.is_csv:
+            frames = self._read_csv(fields, chunksize=page_size)
+        else:
+            import pyarrow.parquet as pq
+            batches = pq.ParquetFile(self.path).iter_batches(batch_size=page_size, columns=self._parquet_fields(fields))
+            frames = (batch.to_pandas() for batch in batches)
+        for frame in frames:
+            columns = _present_columns(frame, fields)
+            yield columns, set(columns)
+
+class SyntheticSource:
+    """Generates transactions in memory (see generate_transactions); paging does not change the data."""
+
+    def __init__(self, rows=SYNTHETIC_ROWS, users=SYNTHETIC_USERS, seed=SYNTHETIC_SEED, start=SYNTHETIC_START, end=None,
+                 categories=SYNTHETIC_CATEGORY_MEANS):
+        self.rows = rows
+        self.users = users
+        self.seed = seed
+        self.start = start
+        self.end = end
+        self.categories = categories
+
+    def _blocks(self, fields):
+        for first_id in range(0, self.rows, SYNTHETIC_BLOCK_ROWS):
+            block = generate_transactions(min(SYNTHETIC_BLOCK_ROWS, self.rows - first_id), self.users,
+                                          self.seed, self.start, self.end, categories=self.categories, first_id=first_id)
+            yield {field: values for field, values in block.items() if field in fields}
+
+    def fetch_columns(self, fields=INGEST_FIELDS):
+        blocks = list(self._blocks(fields))
+        if not blocks:
+            return {}
+        return {field: np.concatenate([block[field] for block in blocks]) for field in blocks[0]}
+
+    def iter_pages(self, page_size=PAGE_SIZE, fields=INGEST_FIELDS):
+        pending = None
+        for block in self._blocks(fields):
+            if pending is not None:
+                block = {field: np.concatenate([pending[field], values]) for field, values in block.items()}
+            rows = len(next(iter(block.values())))
+            full_pages = rows // page_size * page_size
+            for offset in range(0, full_pages, page_size):
+                page = {field: values[offset:offset + page_size] for field, values in block.items()}
+                yield page, set(page)
+            pending = {field: values[full_pages:] for field, values in block.items()}
+        if pending is not None and len(next(iter(pending.values()), [])):
+            yield pending, set(pending)
+
+def get_data_source(kind=DATA_SOURCE, cred_path=CRED_PATH, collection_name=COLLECTION_NAME, path=DATA_PATH, rows=SYNTHETIC_ROWS,
+                    collection_names=(), collection_group=None, date_range=None):
+    """Builds the configured data source; several collections or a collection group read concurrently."""
+    if kind == "firestore" and (collection_names or collection_group):
+        return ShardedFirestoreSource(cred_path, collection_names, collection_group, date_range=date_range)
+    if kind == "firestore":
+        return FirestoreSource(cred_path, collection_name, date_range=date_range)
+    if kind == "file":
+        return FileSource(path)
+    if kind == "synthetic":
+        return SyntheticSource(rows)
+    raise ValueError(f"Unknown data source '{kind}'. Expected one of {DATA_SOURCES}.")
+
+def source_from_argv(argv=sys.argv, cred_path=CRED_PATH, collection_name=COLLECTION_NAME):
+    """Data source selected with --source=<kind> (and --data-path=/--rows=), defaulting to DATA_SOURCE.
+
+    --collections=a,b,... and --collection-group=<name> read Firestore shards concurrently;
+    --date-range=START:END pushes a date filter into the Firestore query.
+    """
+    kind = next((arg.split("=", 1)[1] for arg in argv if arg.startswith("--source=")), DATA_SOURCE)
+    path = next((arg.split("=", 1)[1] for arg in argv if arg.startswith("--data-path=")), DATA_PATH)
+    rows = next((int(arg.split("=", 1)[1]) for arg in argv if arg.startswith("--rows=")), SYNTHETIC_ROWS)
+    collection_names = next((arg.split("=", 1)[1].split(",") for arg in argv if arg.startswith("--collections=")), ())
+    collection_group = next((arg.split("=", 1)[1] for arg in argv if arg.startswith("--collection-group=")), None)
+    date_range = parse_date_range(next((arg.split("=", 1)[1] for arg in argv if arg.startswith("--date-range=")), None))
+    return get_data_source(kind, cred_path, collection_name, path, rows, collection_names, collection_group, date_range)
@@ -1,14 +1,18 @@
-import firebase_admin
-from firebase_admin import credentials, firestore
 import pandas as pd
-import numpy as np
-from datetime import datetime
 import json
-import os
+import sys
 import warnings
 from statsmodels.tsa.arima.model import ARIMA
 from statsmodels.tools.sm_exceptions import ConvergenceWarning
 
+from ingestion import fetch_and_preprocess_data
+from fast_forecast import FAST_METHODS, forecast_fast
+from hierarchical_forecast import forecast_hierarchy
+from order_search import load_order_cache, save_order_cache, select_order
+from rollup import aggregate_cells
+from instrumentation import configure_from_argv, instrumented, write_run_summary
+from result_cache import cached_stage, enable_from_argv
+
 # Suppress specific warnings from statsmodels
 warnings.simplefilter("ignore", ConvergenceWarning)
 warnings.simplefilter("ignore", UserWarning) # Often related to frequency inference
@@ -19,120 +23,136 @@ COLLECTION_NAME = "transactions"
 FORECAST_STEPS = 6 # Number of months to forecast
 MIN_MONTHS_FOR_FORECAST = 24 # Minimum months of data required
 
-# --- Helper Functions (Copied from spending_analysis.py for consistency) ---
-
-def initialize_firebase(cred_path):
-    """Initializes Firebase Admin SDK if not already initialized."""
-    if not os.path.exists(cred_path):
-        raise FileNotFoundError(f"Credentials file not found at {cred_path}")
-    try:
-        firebase_admin.get_app()
-    except ValueError:
-        cred = credentials.Certificate(cred_path)
-        firebase_admin.initialize_app(cred)
-
-def safe_float_conversion(value):
-    """Safely converts a value to float, returning NaN on error."""
-    try:
-        return float(value)
-    except (ValueError, TypeError):
-        return np.nan
-
-def safe_date_conversion(value):
-    """Safely converts a string to datetime using expected format, returning NaT on error."""
-    try:
-        return pd.to_datetime(value, format="%m/%d/%Y", errors="coerce")
-    except (ValueError, TypeError):
-        return pd.NaT
-
-# --- Data Fetching and Preprocessing (Copied from spending_analysis.py) ---
-
-def fetch_and_preprocess_data(cred_path, collection_name):
-    """Fetches data from Firestore, preprocesses it, and returns a DataFrame."""
-    initialize_firebase(cred_path)
-    db = firestore.client()
-    docs = db.collection(collection_name).stream()
-
-    data = []
-    for doc in docs:
-        doc_data = doc.to_dict()
-        doc_data["id"] = doc.id
-        data.append(doc_data)
-
-    if not data:
-        print("No documents found in the collection.")
-        return pd.DataFrame()
-
-    df = pd.DataFrame(data)
-    print(f"Fetched {len(df)} documents.")
-
-    required_cols = ["isExpense", "amount", "date", "category"]
-    if not all(col in df.columns for col in required_cols):
-        missing = [col for col in required_cols if col not in df.columns]
-        raise ValueError(f"Missing required columns: {missing}")
-
-    df["isExpense"] = df["isExpense"].astype(str).str.lower().map({"true": True, "false": False, "1": True, "0": False}).fillna(False)
-    df_expenses = df[df["isExpense"] == True].copy()
-    print(f"Filtered down to {len(df_expenses)} expense transactions.")
-
-    if df_expenses.empty:
-        print("No expense transactions found after filtering.")
-        return pd.DataFrame()
-
-    df_expenses["amount"] = df_expenses["amount"].apply(safe_float_conversion)
-    df_expenses["date"] = df_expenses["date"].apply(safe_date_conversion)
-
-    original_len = len(df_expenses)
-    df_expenses.dropna(subset=["amount", "date", "category"], inplace=True)
-    if len(df_expenses) < original_len:
-        print(f"Dropped {original_len - len(df_expenses)} rows due to missing/invalid amount, date, or category.")
-
-    df_expenses["category"] = df_expenses["category"].astype(str)
-    df_expenses.sort_values("date", inplace=True)
+ARIMA_ORDER = (5, 1, 0)
+NO_SEASONAL_ORDER = (0, 0, 0, 0)
+AUTO_ORDER = False # Search the ARIMA order (see order_search) instead of using ARIMA_ORDER
+FORECAST_BACKEND = "arima" # "arima", or a lightweight NumPy method: "ses", "drift" or "snaive"
+TOTAL_SERIES_ID = "total" # Order cache key of the whole-dataset series; per-user series use the user ID
+HIERARCHICAL_FORECAST = None # Also add reconciled per-category forecasts: "mint" or "bottom_up" (opt-in, --hierarchical=<method>)
+
+# Constants the forecast depends on, here and in the modules it calls; all are part of its result cache key
+FORECAST_CACHE_CONFIG = (
+    "FORECAST_STEPS", "MIN_MONTHS_FOR_FORECAST", "ARIMA_ORDER", "NO_SEASONAL_ORDER",
+    "fast_forecast.SEASON_LENGTH", "fast_forecast.SES_ALPHAS", "fast_forecast.MIN_MONTHS_FAST",
+    "hierarchical_forecast.HIERARCHY_BASE_METHOD", "hierarchical_forecast.GROWTH_MONTHS", "hierarchical_forecast.MIN_VARIANCE",
+    "order_search.MAX_P", "order_search.MAX_Q", "order_search.MAX_D", "order_search.SEASONAL_PERIOD",
+    "order_search.MIN_MONTHS_FOR_SEASONAL", "order_search.CRITERION", "order_search.MIN_IMPROVEMENT",
+    "order_search.ORDER_MAX_AGE_DAYS", "order_search.ORDER_MAX_NEW_MONTHS",
+)
+
+# --- Forecasting Functions ---
+
+def monthly_totals(df):
+    """Aggregates expenses into a monthly series with a DatetimeIndex and monthly frequency."""
+    return df.set_index("date")["amount"].resample("ME").sum()
+
+def to_month_end_series(period_totals):
+    """Fills gaps in a Period-indexed series and re-indexes it on month ends with monthly frequency."""
+    full_range = pd.period_range(period_totals.index.min(), period_totals.index.max(), freq="M")
+    series = period_totals.reindex(full_range, fill_value=0.0)
+    series.index = pd.date_range(full_range[0].to_timestamp(how="end").normalize(), periods=len(full_range), freq="ME")
+    return series
+
+def monthly_totals_from_cells(cells):
+    """monthly_totals computed from (year_month, category) cells instead of transactions."""
+    return to_month_end_series(cells.groupby("year_month")["amount"].sum())
+
+def format_forecast(forecast_values, conf_int):
+    """Formats forecast means and confidence intervals into the forecast output records."""
+    forecast_output = []
+    for i in range(len(forecast_values)):
+        forecast_date = forecast_values.index[i].strftime("%Y-%m")
+        forecast_output.append({
+            "month": forecast_date,
+            "predicted_amount": forecast_values.iloc[i],
+            "conf_int_lower": conf_int.iloc[i, 0],
+            "conf_int_upper": conf_int.iloc[i, 1]
+        })
+    return forecast_output
+
+@instrumented("arima_fit")
+def fit_and_forecast(monthly_expenses, steps=FORECAST_STEPS, order=ARIMA_ORDER, start_params=None, seasonal_order=NO_SEASONAL_ORDER):
+    """Fits an ARIMA model and forecasts; returns (forecast records, fitted parameters).
+
+    start_params warm-starts the optimizer from a previous fit of the same series.
+    """
+    model = ARIMA(monthly_expenses, order=order, seasonal_order=seasonal_order, freq="ME")
+    model_fit = model.fit(start_params=start_params)
+
+    # Generate forecast
+    forecast_result = model_fit.get_forecast(steps=steps)
+    forecast_values = forecast_result.predicted_mean
+    conf_int = forecast_result.conf_int(alpha=0.05) # 95% confidence interval
+    return format_forecast(forecast_values, conf_int), model_fit.params.tolist()
+
+def with_hierarchy(results, cells, steps, hierarchical):
+    """Adds the reconciled per-category forecasts (see hierarchical_forecast) to a forecast result.
+
+    The model's total forecast is the hierarchy's top-level base forecast and stays published
+    under "forecast"; the reconciled total the categories sum to is hierarchical_forecast["total"].
+    Results without a forecast (errors) are returned unchanged.
+    """
+    if not hierarchical or "forecast" not in results:
+        return results
+    hierarchy = forecast_hierarchy(cells, steps, hierarchical, total_forecast=results["forecast"])
+    return dict(results, hierarchical_forecast=hierarchy)
+
+def forecast_expenses(df, steps=FORECAST_STEPS, backend=FORECAST_BACKEND, auto_order=AUTO_ORDER, hierarchical=HIERARCHICAL_FORECAST,
+                      series_id=None):
+    """Forecasts future expenses using ARIMA model (or a lightweight backend, see fast_forecast)."""
+    if df.empty:
+        return {"error": "No data available for forecasting."}
+    return forecast_expenses_cells(aggregate_cells(df), steps, backend, auto_order, hierarchical, series_id)
 
-    print(f"Preprocessing complete. {len(df_expenses)} valid expense transactions remaining.")
-    return df_expenses
+@instrumented("forecast_expenses")
+@cached_stage("forecast_expenses", config=FORECAST_CACHE_CONFIG)
+def forecast_expenses_cells(cells, steps=FORECAST_STEPS, backend=FORECAST_BACKEND, auto_order=AUTO_ORDER, hierarchical=HIERARCHICAL_FORECAST,
+                            series_id=None):
+    """Forecasts future expenses from (year_month, category) cells (see rollup).
 
-# --- Forecasting Function ---
+    series_id (e.g. the user ID) names the series in the ARIMA order cache; None is the whole-dataset total.
 
-def forecast_expenses(df, steps=FORECAST_STEPS):
-    """Forecasts future expenses using ARIMA model."""
-    if df.empty:
+    With hierarchical set to a reconciliation method the result also carries per-category
+    forecasts that sum to a reconciled total, under "hierarchical_forecast"; "forecast" is
+    the model's total either way.
+    """
+    if cells.empty:
         return {"error": "No data available for forecasting."}
 
+    if backend in FAST_METHODS:
+        # No 24-month minimum and no statsmodels fit; cells carry the same year_month/amount columns
+        return with_hierarchy(forecast_fast(cells, steps, method=backend)["forecasts"]["total"], cells, steps, hierarchical)
+    if backend != "arima":
+        return {"error": f"Unknown forecasting backend '{backend}'."}
+
     # Aggregate expenses by month
     # Ensure the index is DatetimeIndex and set frequency
-    monthly_expenses = df.set_index("date")["amount"].resample("M").sum()
+    monthly_expenses = monthly_totals_from_cells(cells)
 
     if len(monthly_expenses) < MIN_MONTHS_FOR_FORECAST:
-        return {"error": f"Insufficient data for forecasting. Need at least {MIN_MONTHS_FOR_FORECAST} months, but found {len(monthly_expenses)}."}
+        error = f"Insufficient data for forecasting. Need at least {MIN_MONTHS_FOR_FORECAST} months, but found {len(monthly_expenses)}."
+        return {"error": error}
 
     print(f"Aggregated data into {len(monthly_expenses)} monthly periods for forecasting.")
 
     try:
-        # Fit ARIMA model - Using a simple order (p=5, d=1, q=0) as a starting point.
-        # A more robust approach would involve order selection (e.g., auto_arima).
-        model = ARIMA(monthly_expenses, order=(5, 1, 0), freq="M")
-        model_fit = model.fit()
+        # Fit ARIMA model - Using a simple order (p=5, d=1, q=0) unless the order search is enabled
+        order, seasonal_order = ARIMA_ORDER, NO_SEASONAL_ORDER
+        if auto_order:
+            cache_key = TOTAL_SERIES_ID if series_id is None else str(series_id)
+            entry, searched = select_order(monthly_expenses, load_order_cache().get(cache_key))
+            if entry is not None:
+                order, seasonal_order = tuple(entry["order"]), tuple(entry["seasonal_order"])
+                if searched:
+                    try:
+                        save_order_cache({cache_key: entry})
+                    except OSError as e:
+                        print(f"Warning: Could not save the searched ARIMA order: {e}")
+            print(f"Using ARIMA order {order} with seasonal order {seasonal_order}.")
+
+        forecast_output, _ = fit_and_forecast(monthly_expenses, steps, order, seasonal_order=seasonal_order)
         print("ARIMA model fitted successfully.")
-
-        # Generate forecast
-        forecast_result = model_fit.get_forecast(steps=steps)
-        forecast_values = forecast_result.predicted_mean
-        conf_int = forecast_result.conf_int(alpha=0.05) # 95% confidence interval
-
-        # Format forecast output
-        forecast_output = []
-        for i in range(steps):
-            forecast_date = forecast_values.index[i].strftime("%Y-%m")
-            forecast_output.append({
-                "month": forecast_date,
-                "predicted_amount": forecast_values.iloc[i],
-                "conf_int_lower": conf_int.iloc[i, 0],
-                "conf_int_upper": conf_int.iloc[i, 1]
-            })
-
-        return {"forecast": forecast_output}
+        return with_hierarchy({"forecast": forecast_output}, cells, steps, hierarchical)
 
     except Exception as e:
         print(f"Error during forecasting: {e}")
@@ -140,6 +160,8 @@ def forecast_expenses(df, steps=FORECAST_STEPS):
 
 # --- Main Execution ---
 if __name__ == "__main__":
+    prometheus_path = configure_from_argv() # --profile=<stage>[:tracemalloc], --prometheus=<path>
+    enable_from_argv() # Reuses stored stage results for unchanged data; --no-result-cache recomputes everything
     results = {}
     try:
         print("Starting data fetching and preprocessing for forecasting...")
@@ -147,7 +169,8 @@ if __name__ == "__main__":
 
         if not df_processed.empty:
             print("Forecasting future expenses...")
-            forecast_results = forecast_expenses(df_processed)
+            hierarchical = next((arg.split("=", 1)[1] for arg in sys.argv if arg.startswith("--hierarchical=")), HIERARCHICAL_FORECAST)
+            forecast_results = forecast_expenses(df_processed, hierarchical=hierarchical)
             results = forecast_results # Store forecast results directly
         else:
             results["error"] = "No valid expense data found for forecasting."
@@ -173,3 +196,4 @@ if __name__ == "__main__":
         print(f"Error saving results to JSON: {e}")
         print("Results that failed to save:", json.dumps(results, indent=2, default=str))
 
+    write_run_summary(prometheus_path=prometheus_path)
@@ -0,0 +1,207 @@
+import pandas as pd
+import numpy as np
+
+# --- Configuration ---
+# These constants are part of the forecast result cache key (FORECAST_CACHE_CONFIG in expense_forecasting)
+SEASON_LENGTH = 12 # Months per season for the seasonal-naive method
+SES_ALPHAS = np.linspace(0.05, 0.95, 19) # Smoothing levels searched per series for exponential smoothing
+MIN_MONTHS_FAST = 2 # These methods only need two months of history
+Z_95 = 1.959963984540054 # Normal quantile for 95% prediction intervals
+FAST_METHODS = ("ses", "drift", "snaive")
+
+# Lightweight forecasting methods in pure NumPy, vectorized across a 2-D matrix of series
+# (one row per series, one column per month). Rows may start with NaN before a series'
+# first month; each method only uses the observed part of its row.
+
+# --- Helper Functions ---
+
+def series_matrix(df, series_by=()):
+    """Builds an aligned (series × month) matrix of monthly expense totals with a single groupby.
+
+    All rows share the month grid from the earliest to the latest month in df. Months before a
+    series' first expense are NaN; later months without expenses are 0.
+    Returns (series_ids, months, values).
+    """
+    series_by = list(series_by)
+    months = df["year_month"] if "year_month" in df.columns else df["date"].dt.to_period("M")
+    months = months.rename("year_month")
+    full_range = pd.period_range(months.min(), months.max(), freq="M")
+
+    if not series_by:
+        totals = df.groupby(months)["amount"].sum().reindex(full_range, fill_value=0.0)
+        return ["total"], full_range, totals.to_numpy(dtype="float64")[np.newaxis, :]
+
+    table = df.groupby(series_by + [months], observed=True)["amount"].sum().unstack("year_month")
+    table = table.reindex(columns=full_range)
+    values = table.to_numpy(dtype="float64")
+    started = np.cumsum(~np.isnan(values), axis=1) > 0
+    values = np.where(started, np.nan_to_num(values), np.nan)
+
+    keys = table.index
+    series_ids = ["/".join(str(part) for part in key) if isinstance(key, tuple) else str(key) for key in keys]
+    return series_ids, full_range, values
+
+def _observed_counts(values):
+    return np.sum(~np.isnan(values), axis=1)
+
+def _last_value(values):
+    return values[:, -1]
+
+def _first_value(values):
+    first_index = np.argmax(~np.isnan(values), axis=1)
+    return values[np.arange(len(values)), first_index]
+
+def _nanstd(residuals, ddof):
+    """Row-wise standard deviation of residuals, 0 where there are too few of them."""
+    counts = np.sum(~np.isnan(residuals), axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.nanmean(residuals, axis=1, keepdims=True) if ddof else 0.0
+        sigma = np.sqrt(np.nansum((residuals - mean) ** 2, axis=1) / (counts - ddof))
+    return np.where(counts > ddof, sigma, 0.0)
+
+# --- Methods ---
+
+def forecast_drift(values, steps):
+    """Random walk with drift; returns (mean, sigma) arrays of shape (series, steps)."""
+    n = _observed_counts(values)
+    last = _last_value(values)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        drift = np.where(n > 1, (last - _first_value(values)) / (n - 1), 0.0)
+    h = np.arange(1, steps + 1)
+    mean = last[:, np.newaxis] + drift[:, np.newaxis] * h
+
+    residuals = np.diff(values, axis=1) - drift[:, np.newaxis]
+    sigma_1 = _nanstd(residuals, ddof=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        scale = np.sqrt(h * (1 + h / np.maximum(n - 1, 1)[:, np.newaxis]))
+    return mean, sigma_1[:, np.newaxis] * scale
+
+def forecast_seasonal_naive(values, steps, season_length=SEASON_LENGTH):
+    """Repeats the last observed season; rows with less than one season fall back to drift."""
+    mean, sigma = forecast_drift(values, steps)
+    n = _observed_counts(values)
+    seasonal = n >= season_length
+    if not seasonal.any() or values.shape[1] < season_length:
+        return mean, sigma
+
+    h = np.arange(1, steps + 1)
+    # Month T+h repeats month T+h-m*(k+1) with k = floor((h-1)/m)
+    seasons_back = (h - 1) // season_length + 1
+    source = values.shape[1] - 1 + h - season_length * seasons_back
+    seasonal_mean = values[:, source]
+
+    residuals = values[:, season_length:] - values[:, :-season_length]
+    seasonal_sigma = _nanstd(residuals, ddof=0)[:, np.newaxis] * np.sqrt(seasons_back)
+
+    mean = np.where(seasonal[:, np.newaxis], seasonal_mean, mean)
+    sigma = np.where(seasonal[:, np.newaxis], seasonal_sigma, sigma)
+    return mean, sigma
+
+def _ses_pass(values, alphas, keep_errors=False):
+    """Runs exponential smoothing for a (alphas × series) array of levels, looping only over months.
+
+    Returns (final levels, one-step SSE, error counts, errors) where errors is a
+    (series × month) array for a single row of alphas when keep_errors is set, else None.
+    """
+    n_series, n_months = values.shape
+    level = np.full((len(alphas), n_series), np.nan)
+    sse = np.zeros((len(alphas), n_series))
+    error_counts = np.zeros(n_series)
+    errors = np.full(values.shape, np.nan) if keep_errors else None
+
+    for t in range(n_months):
+        y = values[:, t]
+        observed = ~np.isnan(y)
+        started = ~np.isnan(level)
+        error = np.where(started & observed, y - level, 0.0)
+        sse += error ** 2
+        error_counts += started[0] & observed
+        if keep_errors:
+            errors[:, t] = np.where(started[0] & observed, error[0], np.nan)
+        updated = np.where(started, level + alphas * error, y)
+        level = np.where(observed, updated, level)
+    return level, sse, error_counts, errors
+
+def _best_ses_alpha(values, alphas=SES_ALPHAS):
+    """Per-series smoothing level with the lowest one-step SSE; returns (best_alpha, final_level, sse, error_counts)."""
+    alphas = np.asarray(alphas, dtype="float64")[:, np.newaxis]
+    level, sse, error_counts, _ = _ses_pass(values, alphas)
+    best = np.argmin(sse, axis=0)
+    rows = np.arange(values.shape[0])
+    return alphas[best, 0], level[best, rows], sse[best, rows], error_counts
+
+def forecast_ses(values, steps, alphas=SES_ALPHAS):
+    """Simple exponential smoothing with the smoothing level chosen per series by one-step SSE.
+
+    All candidate levels are run together as a (alphas × series) array, looping only over months.
+    """
+    best_alpha, final_level, sse, error_counts = _best_ses_alpha(values, alphas)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        sigma_1 = np.where(error_counts > 0, np.sqrt(sse / error_counts), 0.0)
+
+    h = np.arange(1, steps + 1)
+    mean = np.repeat(final_level[:, np.newaxis], steps, axis=1)
+    sigma = sigma_1[:, np.newaxis] * np.sqrt(1 + (h - 1) * best_alpha[:, np.newaxis] ** 2)
+    return mean, sigma
+
+def one_step_residuals(values, method="ses"):
+    """In-sample one-step-ahead errors of a method, shaped like values (NaN where no forecast existed)."""
+    if method not in FAST_METHODS:
+        raise ValueError(f"Unknown forecasting method '{method}'. Expected one of {FAST_METHODS}.")
+    if method == "ses":
+        best_alpha, _, _, _ = _best_ses_alpha(values)
+        return _ses_pass(values, best_alpha[np.newaxis, :], keep_errors=True)[3]
+
+    n = _observed_counts(values)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        drift = np.where(n > 1, (_last_value(values) - _first_value(values)) / (n - 1), 0.0)
+    residuals = np.full(values.shape, np.nan)
+    residuals[:, 1:] = np.diff(values, axis=1) - drift[:, np.newaxis]
+    if method == "snaive" and values.shape[1] >= SEASON_LENGTH:
+        seasonal = n >= SEASON_LENGTH
+        seasonal_residuals = np.full(values.shape, np.nan)
+        seasonal_residuals[:, SEASON_LENGTH:] = values[:, SEASON_LENGTH:] - values[:, :-SEASON_LENGTH]
+        residuals = np.where(seasonal[:, np.newaxis], seasonal_residuals, residuals)
+    return residuals
+
+# --- Vectorized Forecasting ---
+
+def forecast_matrix(values, steps, method="ses"):
+    """Forecasts every row of a (series × month) matrix; returns (mean, lower, upper) arrays."""
+    if method == "ses":
+        mean, sigma = forecast_ses(values, steps)
+    elif method == "drift":
+        mean, sigma = forecast_drift(values, steps)
+    elif method == "snaive":
+        mean, sigma = forecast_seasonal_naive(values, steps)
+    else:
+        raise ValueError(f"Unknown forecasting method '{method}'. Expected one of {FAST_METHODS}.")
+    return mean, mean - Z_95 * sigma, mean + Z_95 * sigma
+
+def format_forecasts(series_ids, months, values, mean, lower, upper):
+    """Turns forecast arrays into {series_id: {"forecast": [...]}} with the ARIMA output shape."""
+    forecast_months = [(months[-1] + h).strftime("%Y-%m") for h in range(1, mean.shape[1] + 1)]
+    counts = _observed_counts(values)
+    results = {}
+    for row, series_id in enumerate(series_ids):
+        if counts[row] < MIN_MONTHS_FAST:
+            results[series_id] = {"error": f"Insufficient data for forecasting. Need at least {MIN_MONTHS_FAST} months, but found {counts[row]}."}
+            continue
+        results[series_id] = {"forecast": [
+            {
+                "month": month,
+                "predicted_amount": float(mean[row, i]),
+                "conf_int_lower": float(lower[row, i]),
+                "conf_int_upper": float(upper[row, i]),
+            }
+            for i, month in enumerate(forecast_months)
+        ]}
+    return results
+
+def forecast_fast(df, steps, series_by=(), method="ses"):
+    """Forecasts every series in df at once with a lightweight method; no minimum of 24 months."""
+    if df.empty:
+        return {"error": "No data available for forecasting."}
+    series_ids, months, values = series_matrix(df, series_by)
+    mean, lower, upper = forecast_matrix(values, steps, method)
+    return {"forecasts": format_forecasts(series_ids, months, values, mean, lower, upper)}
@@ -0,0 +1,212 @@
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import json
+import os
+import sys
+import traceback
+
+from ingestion import CRED_PATH, COLLECTION_NAME, USER_ID_FIELD, fetch_and_preprocess_data
+from expense_forecasting import FORECAST_STEPS, MIN_MONTHS_FOR_FORECAST, ARIMA_ORDER, NO_SEASONAL_ORDER, FORECAST_BACKEND, AUTO_ORDER, TOTAL_SERIES_ID, fit_and_forecast, to_month_end_series
+from order_search import ORDER_CACHE_PATH, load_order_cache, save_order_cache, select_order
+from fast_forecast import FAST_METHODS, forecast_fast
+
+# --- Configuration ---
+FIT_CACHE_PATH = "ML/cache/forecast_fits.json"
+OUTPUT_PATH = "ML/results/series_forecasts.json"
+MAX_WORKERS = os.cpu_count() or 1
+SERIES_PER_TASK = 16 # Series handed to a worker at a time
+
+# Forecasts many series (per user, per user and category) in one run for series_forecasts.json.
+# The per-user batch (batch_engine) does not go through here: its results carry the category
+# hierarchy and are served from the result cache by forecast_expenses_cells, and the fit cache
+# below is a single file rewritten per call, which concurrent batch workers would overwrite.
+
+# --- Helper Functions ---
+
+def series_id_for(key):
+    """Joins a group key (scalar or tuple) into a stable series ID such as 'user42/Restaurants'."""
+    if not isinstance(key, tuple):
+        key = (key,)
+    return "/".join(str(part) for part in key)
+
+def build_monthly_series(df, series_by=()):
+    """Builds one monthly expense series per group in a single groupby.
+
+    Each series covers its own first to last month with missing months filled with 0, like
+    resample("ME").sum() in forecast_expenses.
+    """
+    series_by = list(series_by)
+    months = df["year_month"] if "year_month" in df.columns else df["date"].dt.to_period("M")
+    totals = df.groupby(series_by + [months.rename("year_month")], observed=True)["amount"].sum()
+
+    if not series_by:
+        yield TOTAL_SERIES_ID, to_month_end_series(totals)
+        return
+    for key, series_totals in totals.groupby(level=series_by, observed=True, sort=False):
+        yield series_id_for(key), to_month_end_series(series_totals.droplevel(series_by))
+
+def series_fingerprint(series):
+    """Content hash of a monthly series, so backfilled or edited months invalidate a cached fit."""
+    digest = hashlib.sha1(series.index.strftime("%Y-%m").str.cat().encode())
+    digest.update(series.to_numpy(dtype="float64").tobytes())
+    return digest.hexdigest()
+
+def load_fit_cache(path=FIT_CACHE_PATH):
+    """Loads cached fits keyed by series ID, or an empty cache."""
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"Warning: Could not load forecast fit cache {path}: {e}")
+        return {}
+
+def save_fit_cache(cache, path=FIT_CACHE_PATH):
+    """Writes the fit cache atomically."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(cache, f, default=str)
+    os.replace(f"{path}.tmp", path)
+
+# --- Worker ---
+
+def forecast_series(task):
+    """Forecasts one monthly series, reusing or warm-starting from its cached fit.
+
+    With order set to "search" the ARIMA order is chosen (or reused from cached_order) by
+    order_search, sequentially since this already runs inside a worker.
+    Returns (series_id, result, fit cache entry or None, status, searched order entry or None)
+    where status is one of 'reused', 'warm_started', 'fitted', 'skipped' or 'failed'.
+    """
+    series_id, monthly, cached, steps, order, cached_order = task
+    if len(monthly) < MIN_MONTHS_FOR_FORECAST:
+        error = f"Insufficient data for forecasting. Need at least {MIN_MONTHS_FOR_FORECAST} months, but found {len(monthly)}."
+        return series_id, {"error": error}, None, "skipped", None
+
+    seasonal_order = NO_SEASONAL_ORDER
+    searched_order = None
+    if order == "search":
+        order_entry, searched = select_order(monthly, cached_order, max_workers=1)
+        order = ARIMA_ORDER
+        if order_entry is not None:
+            order, seasonal_order = tuple(order_entry["order"]), tuple(order_entry["seasonal_order"])
+            searched_order = order_entry if searched else None
+
+    fingerprint = series_fingerprint(monthly)
+    same_model = (
+        cached is not None
+        and cached.get("order") == list(order)
+        and cached.get("seasonal_order", list(NO_SEASONAL_ORDER)) == list(seasonal_order)
+    )
+    if same_model and cached.get("fingerprint") == fingerprint and cached.get("steps") == steps:
+        return series_id, cached["result"], cached, "reused", searched_order
+
+    status = "fitted"
+    forecast_output = None
+    if same_model and cached.get("params"):
+        try:
+            forecast_output, params = fit_and_forecast(monthly, steps, order, start_params=cached["params"], seasonal_order=seasonal_order)
+            status = "warm_started"
+        except Exception:
+            forecast_output = None # Previous parameters unusable (e.g. non-stationary); fit from scratch
+    try:
+        if forecast_output is None:
+            forecast_output, params = fit_and_forecast(monthly, steps, order, seasonal_order=seasonal_order)
+    except Exception as e:
+        return series_id, {"error": f"Forecasting failed: {e}"}, None, "failed", searched_order
+
+    result = {"forecast": forecast_output}
+    entry = {
+        "last_month": monthly.index[-1].strftime("%Y-%m"),
+        "fingerprint": fingerprint,
+        "order": list(order),
+        "seasonal_order": list(seasonal_order),
+        "steps": steps,
+        "params": params,
+        "result": json.loads(json.dumps(result, default=str)),
+    }
+    return series_id, result, entry, status, searched_order
+
+# --- Batch Forecasting ---
+
+def forecast_many(df, series_by=(), steps=FORECAST_STEPS, order=ARIMA_ORDER, max_workers=MAX_WORKERS,
+                  series_per_task=SERIES_PER_TASK, cache_path=FIT_CACHE_PATH, backend=FORECAST_BACKEND,
+                  auto_order=AUTO_ORDER, order_cache_path=ORDER_CACHE_PATH):
+    """Forecasts every series (per user and/or per category) in one call, fitting in parallel.
+
+    Fits are cached by series ID with their last observed month and a fingerprint of the series:
+    unchanged series reuse the cached forecast, changed ones warm-start from the cached parameters.
+    A lightweight backend forecasts all series at once as one NumPy matrix instead. With
+    auto_order each series gets its own searched ARIMA order, cached and re-searched periodically.
+    """
+    if df.empty:
+        return {"error": "No data available for forecasting."}
+
+    if backend in FAST_METHODS:
+        print(f"Forecasting all series grouped by {list(series_by) or 'nothing (total only)'} with the '{backend}' backend...")
+        return forecast_fast(df, steps, series_by, backend)
+
+    cache = load_fit_cache(cache_path) if cache_path else {}
+    order_cache = load_order_cache(order_cache_path) if auto_order and order_cache_path else {}
+    tasks = [
+        (series_id, monthly, cache.get(series_id), steps, "search" if auto_order else tuple(order), order_cache.get(series_id))
+        for series_id, monthly in build_monthly_series(df, series_by)
+    ]
+    print(f"Forecasting {len(tasks)} series grouped by {list(series_by) or 'nothing (total only)'}...")
+
+    if max_workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            outcomes = list(executor.map(forecast_series, tasks, chunksize=series_per_task))
+    else:
+        outcomes = [forecast_series(task) for task in tasks]
+
+    forecasts = {}
+    stats = {"reused": 0, "warm_started": 0, "fitted": 0, "skipped": 0, "failed": 0}
+    searched = {}
+    for series_id, result, entry, status, order_entry in outcomes:
+        forecasts[series_id] = result
+        stats[status] += 1
+        if entry is not None:
+            cache[series_id] = entry
+        if order_entry is not None:
+            searched[series_id] = order_entry
+    print(f"Forecasting complete: {stats}.")
+
+    if cache_path:
+        save_fit_cache(cache, cache_path)
+    if auto_order and order_cache_path:
+        print(f"Searched ARIMA orders for {len(searched)} series.")
+        save_order_cache(searched, order_cache_path)
+    return {"forecasts": forecasts, "stats": stats}
+
+# --- Main Execution ---
+if __name__ == "__main__":
+    results = {}
+    try:
+        print("Starting data fetching and preprocessing for batch forecasting...")
+        df_processed = fetch_and_preprocess_data(CRED_PATH, COLLECTION_NAME)
+
+        if not df_processed.empty:
+            series_by = [USER_ID_FIELD] if USER_ID_FIELD in df_processed.columns else []
+            if "--by-category" in sys.argv:
+                series_by.append("category")
+            backend = next((arg.split("=", 1)[1] for arg in sys.argv if arg.startswith("--backend=")), FORECAST_BACKEND)
+            results = forecast_many(df_processed, series_by, backend=backend, auto_order="--auto-order" in sys.argv or AUTO_ORDER)
+        else:
+            results["error"] = "No valid expense data found for forecasting."
+    except FileNotFoundError as e:
+        print(f"Error: {e}")
+        results["error"] = str(e)
+    except ValueError as e:
+        print(f"Data Error: {e}")
+        results["error"] = f"Data Error: {e}"
+    except Exception as e:
+        print(f"An unexpected error occurred: {e}")
+        print(f"Traceback: {traceback.format_exc()}")
+        results["error"] = f"An unexpected error occurred: {e}"
+
+    print(f"Saving batch forecast results to {OUTPUT_PATH}...")
+    os.makedirs(os.path.dirname(OUTPUT_PATH), exist_ok=True)
+    with open(OUTPUT_PATH, "w") as f:
+        json.dump(results, f, default=str)
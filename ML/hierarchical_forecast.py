@@ -0,0 +1,138 @@
+import numpy as np
+
+from fast_forecast import MIN_MONTHS_FAST, Z_95, format_forecasts, forecast_matrix, one_step_residuals, series_matrix
+from instrumentation import instrumented
+
+# --- Configuration ---
+# These constants are part of the forecast result cache key (FORECAST_CACHE_CONFIG in expense_forecasting)
+RECONCILIATION_METHODS = ("mint", "bottom_up")
+HIERARCHY_BASE_METHOD = "ses" # fast_forecast method producing the base forecast of every series in one matrix
+GROWTH_MONTHS = 3 # Recent months each category's forecast is compared against
+MIN_VARIANCE = 1e-6 # Floor on residual variances, relative to the largest, keeping the covariance invertible
+
+# Two-level hierarchy: the total and one series per category, with total = sum of categories.
+# Base forecasts for all series come from one vectorized fast_forecast call; the total's base can
+# be replaced by another model's forecast (e.g. the ARIMA total). Reconciliation maps them onto
+# coherent forecasts y~ = S G y^, where S is the summing matrix and G picks the bottom level
+# (bottom-up) or is the MinT projection G = (S' W^-1 S)^-1 S' W^-1. W combines the base one-step
+# variances with the shrinkage estimate of the residual correlation (Wickramasuriya,
+# Athanasopoulos & Hyndman, 2019).
+
+# --- Helper Functions ---
+
+def summing_matrix(n_categories):
+    """S of the two-level hierarchy: the total row of ones above the identity of the categories."""
+    return np.vstack([np.ones((1, n_categories)), np.eye(n_categories)])
+
+def _floored(variance):
+    return np.maximum(variance, MIN_VARIANCE * max(variance.max(initial=0.0), 1.0))
+
+def shrunk_correlation(residuals):
+    """Residual correlation shrunk towards the identity with the Schäfer-Strimmer intensity.
+
+    residuals is (series × months); months in which a series had no forecast count as zero error.
+    """
+    errors = np.nan_to_num(residuals[:, ~np.isnan(residuals).all(axis=0)]).T
+    n_obs = max(len(errors), 2)
+    errors = errors - errors.mean(axis=0)
+    variance = (errors ** 2).sum(axis=0) / (n_obs - 1)
+    standardized = errors / np.sqrt(_floored(variance))
+    products = standardized[:, :, np.newaxis] * standardized[:, np.newaxis, :]
+    correlation = products.sum(axis=0) / (n_obs - 1)
+    correlation_variance = n_obs / (n_obs - 1) ** 3 * ((products - products.mean(axis=0)) ** 2).sum(axis=0)
+    off_diagonal = ~np.eye(len(variance), dtype=bool)
+    denominator = (correlation[off_diagonal] ** 2).sum()
+    intensity = 1.0 if denominator == 0 else float(np.clip(correlation_variance[off_diagonal].sum() / denominator, 0.0, 1.0))
+
+    return np.where(off_diagonal, (1 - intensity) * correlation, 1.0)
+
+def reconciliation_matrix(covariance, method="mint"):
+    """P = S G mapping base forecasts of [total, categories...] onto coherent ones."""
+    n_categories = len(covariance) - 1
+    S = summing_matrix(n_categories)
+    if method == "bottom_up":
+        G = np.hstack([np.zeros((n_categories, 1)), np.eye(n_categories)])
+    elif method == "mint":
+        W_inv = np.linalg.pinv(covariance)
+        G = np.linalg.solve(S.T @ W_inv @ S, S.T @ W_inv)
+    else:
+        raise ValueError(f"Unknown reconciliation method '{method}'. Expected one of {RECONCILIATION_METHODS}.")
+    return S @ G
+
+def reconcile(mean, sigma, residuals, method="mint"):
+    """Reconciles (series × steps) base forecasts whose first row is the total.
+
+    Negative category forecasts are set to 0 and the total re-summed, so the result stays coherent.
+    MinT weighs the series by W = D R D, with D the base one-step standard deviations and R the
+    shrunk residual correlation. Prediction intervals come from the reconciled variance P W_h P',
+    with W_h the base forecast variances of each step combined with R.
+    """
+    correlation = shrunk_correlation(residuals)
+    one_step = np.sqrt(_floored(sigma[:, 0] ** 2))
+    P = reconciliation_matrix(correlation * np.outer(one_step, one_step), method)
+
+    categories = np.maximum((P @ mean)[1:], 0.0)
+    reconciled = np.vstack([categories.sum(axis=0, keepdims=True), categories])
+
+    scaled = P[np.newaxis, :, :] * sigma.T[:, np.newaxis, :] # (steps × series × series)
+    variance = np.einsum("hik,kl,hil->hi", scaled, correlation, scaled).T
+    half_width = Z_95 * np.sqrt(np.maximum(variance, 0.0))
+    return reconciled, reconciled - half_width, reconciled + half_width
+
+def category_growth(categories, values, mean, recent_months=GROWTH_MONTHS):
+    """Per category: recent monthly average vs. forecast monthly average, largest increase first."""
+    recent = np.nan_to_num(values[:, -recent_months:]).mean(axis=1)
+    forecast = mean.mean(axis=1)
+    growth = []
+    for category, recent_avg, forecast_avg in zip(categories, recent, forecast):
+        growth.append({
+            "category": category,
+            "recent_monthly_avg": float(recent_avg),
+            "forecast_monthly_avg": float(forecast_avg),
+            "change": float(forecast_avg - recent_avg),
+            "pct_change": float((forecast_avg - recent_avg) / recent_avg) if recent_avg > 0 else None,
+        })
+    return sorted(growth, key=lambda record: record["change"], reverse=True)
+
+# --- Core Functions ---
+
+@instrumented("hierarchical_forecast")
+def forecast_hierarchy(cells, steps, method="mint", base_method=HIERARCHY_BASE_METHOD, total_forecast=None):
+    """Forecasts the total and every category from (year_month, category) cells, reconciled so the
+    category forecasts sum to the total.
+
+    All series are forecast together as one (series × month) matrix with a fast_forecast method.
+    total_forecast (forecast records, e.g. the ARIMA total for the same months) replaces the
+    total's base forecast and is returned under "base_total".
+    """
+    if method not in RECONCILIATION_METHODS:
+        return {"error": f"Unknown reconciliation method '{method}'. Expected one of {RECONCILIATION_METHODS}."}
+    if cells.empty:
+        return {"error": "No data available for forecasting."}
+
+    categories, months, category_values = series_matrix(cells, ["category"])
+    if len(months) < MIN_MONTHS_FAST:
+        return {"error": f"Insufficient data for forecasting. Need at least {MIN_MONTHS_FAST} months, but found {len(months)}."}
+    # Months before a category's first expense are zero spend in the hierarchy
+    values = np.vstack([np.nansum(category_values, axis=0, keepdims=True), np.nan_to_num(category_values)])
+
+    base_mean, base_lower, _ = forecast_matrix(values, steps, base_method)
+    base_sigma = (base_mean - base_lower) / Z_95
+    forecast_months = [(months[-1] + h).strftime("%Y-%m") for h in range(1, steps + 1)]
+    if total_forecast is not None and [record["month"] for record in total_forecast] == forecast_months:
+        base_mean[0] = [record["predicted_amount"] for record in total_forecast]
+        base_sigma[0] = [(record["conf_int_upper"] - record["conf_int_lower"]) / (2 * Z_95) for record in total_forecast]
+    else:
+        total_forecast = None
+    mean, lower, upper = reconcile(base_mean, base_sigma, one_step_residuals(values, base_method), method)
+
+    # Rows are keyed by position: a category may itself be named "total"
+    forecasts = format_forecasts(range(len(values)), months, values, mean, lower, upper)
+    return {
+        "reconciliation": method,
+        "base_method": base_method,
+        "base_total": total_forecast,
+        "total": forecasts[0]["forecast"],
+        "categories": {category: forecasts[row]["forecast"] for row, category in enumerate(categories, start=1)},
+        "category_growth": category_growth(categories, values[1:], mean[1:]),
+    }
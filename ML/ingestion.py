@@ -0,0 +1,476 @@
+import firebase_admin
+from firebase_admin import credentials, firestore
+from google.api_core import exceptions as api_exceptions
+from google.cloud.firestore_v1.base_query import FieldFilter
+from google.cloud.firestore_v1.field_path import FieldPath
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pandas.api.types import union_categoricals
+from itertools import product
+import pandas as pd
+import numpy as np
+import os
+import random
+import threading
+import time
+
+from instrumentation import add_count, instrumented
+
+# --- Configuration ---
+CRED_PATH = "firebasecnx.json"
+COLLECTION_NAME = "transactions"
+REQUIRED_COLUMNS = ["isExpense", "amount", "date", "category"]
+DATE_FORMAT = "%m/%d/%Y" # Format the app writes dates in
+TRUTHY_VALUES = ("true", "1") # Lowercased string forms of isExpense treated as expenses
+USER_ID_FIELD = "userId" # Owner of a transaction (same field name as budgets); optional
+INGEST_FIELDS = ["id", USER_ID_FIELD] + REQUIRED_COLUMNS # Document fields kept at ingest; everything else is dropped
+PAGE_SIZE = 5000 # Documents per page in the chunked fetch
+AMOUNT_DTYPE = "float64" # Set to "float32" to halve the amount column at the cost of ~7 significant digits
+EMULATOR_HOST_ENV = "FIRESTORE_EMULATOR_HOST" # When set, the Firestore client talks to a local emulator
+EMULATOR_PROJECT_ID = "demo-transactions" # Project used against the emulator when no credentials file exists
+MAX_FETCH_WORKERS = 8 # Shards (collections or query partitions) read concurrently by the sharded fetch
+FETCH_ATTEMPTS = 4 # Tries per shard read or page on transient Firestore errors
+RETRY_BASE_DELAY = 0.5 # Seconds before the first retry; doubles on every further retry, with jitter
+SERVER_SIDE_FILTERS = True # Push the expense/date filters and the field projection into Firestore queries
+IN_FILTER_LIMIT = 30 # Most values Firestore accepts in one "in" filter
+MAX_DATE_QUERIES = 8 # Day-list queries sent for a date range at most (~2 months); longer ranges are filtered client-side
+SORTABLE_DATE_FIELD = None # e.g. "dateKey" (YYYY-MM-DD, written by the app) once every document carries it; ranges then become one range filter
+TRANSIENT_ERRORS = (
+    api_exceptions.ServiceUnavailable,
+    api_exceptions.DeadlineExceeded,
+    api_exceptions.InternalServerError,
+    api_exceptions.TooManyRequests,
+    api_exceptions.ResourceExhausted,
+    api_exceptions.Aborted,
+)
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+# --- Helper Functions ---
+
+def initialize_firebase(cred_path):
+    """Initializes Firebase Admin SDK if not already initialized."""
+    print(f"Attempting to initialize Firebase with credentials from: {cred_path}")
+    use_emulator = bool(os.environ.get(EMULATOR_HOST_ENV)) and not os.path.exists(cred_path)
+    if not os.path.exists(cred_path) and not use_emulator:
+        raise FileNotFoundError(f"Credentials file not found at {cred_path}")
+    try:
+        firebase_admin.get_app()
+        print("Firebase app already initialized.")
+    except ValueError:
+        print("Initializing Firebase app...")
+        if use_emulator:
+            # The emulator accepts any project and needs no service account
+            firebase_admin.initialize_app(options={"projectId": EMULATOR_PROJECT_ID})
+        else:
+            cred = credentials.Certificate(cred_path)
+            firebase_admin.initialize_app(cred)
+        print("Firebase app initialized successfully.")
+
+def get_client(cred_path):
+    """Firestore client shared by every fetch in this process, so all reads reuse one channel."""
+    with _clients_lock:
+        if cred_path not in _clients:
+            initialize_firebase(cred_path)
+            _clients[cred_path] = firestore.client()
+        return _clients[cred_path]
+
+def with_retries(func, *args, attempts=FETCH_ATTEMPTS, base_delay=RETRY_BASE_DELAY):
+    """Calls func(*args), retrying transient Firestore errors with exponential backoff and jitter."""
+    for attempt in range(1, attempts + 1):
+        try:
+            return func(*args)
+        except TRANSIENT_ERRORS as e:
+            if attempt == attempts:
+                raise
+            delay = base_delay * 2 ** (attempt - 1) * (0.5 + random.random())
+            print(f"Transient Firestore error ({type(e).__name__}: {e}); retrying in {delay:.1f}s (attempt {attempt + 1}/{attempts})...")
+            time.sleep(delay)
+
+def safe_float_conversion(value):
+    """Safely converts a value to float, returning NaN on error."""
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return np.nan
+
+def safe_date_conversion(value):
+    """Safely converts a string to datetime using expected format, returning NaT on error."""
+    try:
+        # Assuming MM/DD/YYYY format based on sample data
+        return pd.to_datetime(value, format=DATE_FORMAT, errors="coerce")
+    except (ValueError, TypeError):
+        return pd.NaT
+
+def frame_memory_mb(df):
+    """Deep memory footprint of a DataFrame in megabytes."""
+    return df.memory_usage(deep=True).sum() / 1024 ** 2
+
+def report_memory(df, stage):
+    """Prints the memory footprint of the frame at a given stage."""
+    print(f"Memory after {stage}: {frame_memory_mb(df):.2f} MB for {len(df)} rows.")
+
+def normalize_is_expense(series):
+    """Vectorized isExpense normalization: True for any value whose lowercased string form is 'true' or '1'."""
+    if pd.api.types.is_bool_dtype(series):
+        return series.fillna(False).astype(bool)
+    # Lowercase each distinct string form once instead of once per row
+    codes, uniques = pd.factorize(series.astype(str))
+    truthy = np.array([value.lower() in TRUTHY_VALUES for value in uniques], dtype=bool)
+    return pd.Series(truthy[codes], index=series.index)
+
+def coerce_amounts(series):
+    """Vectorized safe_float_conversion over a column, giving identical values (NaN on error)."""
+    amounts = pd.to_numeric(series, errors="coerce")
+    if pd.api.types.is_float_dtype(amounts) and amounts.notna().sum() == series.notna().sum():
+        return amounts
+    amounts = amounts.astype(float)
+    # Inputs float() accepts but to_numeric rejects (e.g. "1_000", bools) are retried one by one
+    retry = amounts.isna() & series.notna()
+    if retry.any():
+        amounts[retry] = series[retry].map(safe_float_conversion)
+    return amounts
+
+def coerce_dates(series):
+    """Vectorized safe_date_conversion over a column: one pd.to_datetime call instead of one per row."""
+    try:
+        dates = pd.to_datetime(series, format=DATE_FORMAT, errors="coerce")
+    except (ValueError, TypeError):
+        # Mixed naive/tz-aware timestamps cannot share one column; keep the per-value behaviour
+        return pd.to_datetime(series.map(safe_date_conversion), errors="coerce")
+    # Non-string values that did not parse (e.g. Firestore timestamps) are retried one by one
+    retry = dates.isna() & series.notna()
+    if retry.any():
+        dates = dates.astype(object)
+        dates[retry] = series[retry].map(safe_date_conversion)
+        dates = pd.to_datetime(dates, errors="coerce")
+    return dates
+
+def _case_variants(text):
+    """Every upper/lower-case spelling of a string."""
+    return ["".join(chars) for chars in product(*[sorted({ch.lower(), ch.upper()}) for ch in text])]
+
+def expense_filter_values():
+    """Every stored isExpense value normalize_is_expense keeps: True, the integer 1 and each casing of TRUTHY_VALUES."""
+    values = [True, 1]
+    for truthy in TRUTHY_VALUES:
+        values += _case_variants(truthy)
+    return values
+
+def date_filter_values(date_range):
+    """The DATE_FORMAT strings (zero-padded or not) of every day in an inclusive (start, end) range."""
+    values = []
+    for day in pd.date_range(pd.Timestamp(date_range[0]).normalize(), pd.Timestamp(date_range[1]).normalize()):
+        values += dict.fromkeys([
+            f"{day.month:02d}/{day.day:02d}/{day.year}",
+            f"{day.month}/{day.day:02d}/{day.year}",
+            f"{day.month:02d}/{day.day}/{day.year}",
+            f"{day.month}/{day.day}/{day.year}",
+        ])
+    return values
+
+def filtered_queries(query, fields=INGEST_FIELDS, date_range=None, range_filters=True):
+    """Queries that together return the documents the fetch would keep, projected to the fields.
+
+    With SORTABLE_DATE_FIELD set (and range_filters allowed), a date range is one range filter on
+    that field. Otherwise dates are MM/DD/YYYY strings, which do not sort chronologically, so a
+    range with a start is sent as "in" filters over every day's spellings (one query per
+    IN_FILTER_LIMIT values), as long as that takes at most MAX_DATE_QUERIES queries. Firestore
+    allows only one "in" filter per query, so isExpense is then filtered client-side. In every
+    other case the mixed-type isExpense filter is sent as one "in" filter and the date range is
+    applied client-side. Any rows the server lets through are still filtered by preprocessing.
+    range_filters=False is for queries that must keep their own ordering (partition queries).
+    """
+    query = query.select([field for field in fields if field != "id"])
+    if date_range is not None and SORTABLE_DATE_FIELD and range_filters and any(date_range):
+        start, end = date_range
+        if start is not None:
+            query = query.where(filter=FieldFilter(SORTABLE_DATE_FIELD, ">=", pd.Timestamp(start).strftime("%Y-%m-%d")))
+        if end is not None:
+            query = query.where(filter=FieldFilter(SORTABLE_DATE_FIELD, "<=", pd.Timestamp(end).strftime("%Y-%m-%d")))
+        return [query]
+    if date_range is not None and date_range[0] is not None:
+        dates = date_filter_values((date_range[0], date_range[1] if date_range[1] is not None else pd.Timestamp.now()))
+        if len(dates) <= MAX_DATE_QUERIES * IN_FILTER_LIMIT:
+            return [query.where(filter=FieldFilter("date", "in", dates[i:i + IN_FILTER_LIMIT])) for i in range(0, len(dates), IN_FILTER_LIMIT)]
+    values = expense_filter_values()
+    if len(values) > IN_FILTER_LIMIT:
+        return [query]
+    return [query.where(filter=FieldFilter("isExpense", "in", values))]
+
+def parse_date_range(text):
+    """Parses "START:END" (YYYY-MM-DD, either side may be empty) into a (start, end) tuple; None for no text."""
+    if not text:
+        return None
+    start, _, end = text.partition(":")
+    return (start or None, end or None)
+
+def filter_date_range(df, date_range):
+    """Expense rows whose date lies in an inclusive (start, end) range; either end may be None."""
+    if date_range is None or df.empty:
+        return df
+    start, end = date_range
+    keep = pd.Series(True, index=df.index)
+    if start is not None:
+        keep &= df["date"] >= pd.Timestamp(start).normalize()
+    if end is not None:
+        keep &= df["date"] < pd.Timestamp(end).normalize() + pd.Timedelta(days=1)
+    return df[keep]
+
+# --- Core Functions ---
+
+def _docs_to_columns(docs, fields):
+    """Collects the given fields of Firestore snapshots into column lists; also returns the fields actually present."""
+    columns = {field: [] for field in fields}
+    seen = set()
+    for doc in docs:
+        doc_data = doc.to_dict()
+        doc_data["id"] = doc.id # Keep track of document ID
+        seen.update(doc_data)
+        for field in fields:
+            columns[field].append(doc_data.get(field))
+    add_count("firestore_documents_read", len(columns[fields[0]]) if fields else 0)
+    return columns, seen
+
+def _check_required_columns(columns):
+    """Raises ValueError if any required field is absent from the fetched data."""
+    if not all(col in columns for col in REQUIRED_COLUMNS):
+        missing = [col for col in REQUIRED_COLUMNS if col not in columns]
+        raise ValueError(f"Missing required columns: {missing}")
+
+def _collection_queries(db, collection_name, fields, date_range):
+    collection = db.collection(collection_name)
+    return filtered_queries(collection, fields, date_range) if SERVER_SIDE_FILTERS else [collection]
+
+@instrumented("firestore_fetch")
+def fetch_documents(cred_path, collection_name, fields=INGEST_FIELDS, date_range=None):
+    """Streams a collection straight into per-field column lists, keeping only the given fields.
+
+    With SERVER_SIDE_FILTERS only expense documents (or documents in date_range) are read, and
+    only the given fields of them.
+    """
+    db = get_client(cred_path)
+    queries = _collection_queries(db, collection_name, fields, date_range)
+    if len(queries) > 1:
+        return fetch_shards(dict(enumerate(queries)), fields)
+    # A stream cannot resume mid-way, so a transient failure re-reads the collection
+    columns, seen = with_retries(lambda: _docs_to_columns(queries[0].stream(), fields))
+    # Fields no document carries are left out, so the required-column check still fires
+    return {field: values for field, values in columns.items() if field in seen}
+
+def iter_document_pages(cred_path, collection_name, page_size=PAGE_SIZE, fields=INGEST_FIELDS, date_range=None):
+    """Pages through a collection in document-ID order with a query cursor.
+
+    Yields (columns, seen_fields) per page, so only one page of raw documents is alive at a time.
+    """
+    db = get_client(cred_path)
+    for filtered in _collection_queries(db, collection_name, fields, date_range):
+        query = filtered.order_by(FieldPath.document_id()).limit(page_size)
+
+        last_doc = None
+        while True:
+            page_query = query.start_after(last_doc) if last_doc is not None else query
+            docs = with_retries(lambda: list(page_query.stream())) # The cursor makes a page safe to re-read
+            if not docs:
+                break
+            last_doc = docs[-1]
+            yield _docs_to_columns(docs, fields)
+            if len(docs) < page_size:
+                break
+
+def _shard_filtered(queries, name, query, fields, date_range, range_filters=True):
+    """Adds a shard's query, or its filtered queries (see filtered_queries) under "<name>#<i>" names."""
+    if not SERVER_SIDE_FILTERS:
+        queries[name] = query
+        return
+    filtered = filtered_queries(query, fields, date_range, range_filters)
+    if len(filtered) == 1:
+        queries[name] = filtered[0]
+    else:
+        queries.update((f"{name}#{i}", subquery) for i, subquery in enumerate(filtered))
+
+def shard_queries(cred_path, collection_names=(), collection_group=None, partition_count=MAX_FETCH_WORKERS,
+                  fields=INGEST_FIELDS, date_range=None):
+    """Queries to read concurrently: one per collection path (e.g. per-user "users/<id>/transactions"),
+    plus partitions of a collection group when one is given.
+
+    Each shard gets the same filters and projection as a single-collection fetch (see filtered_queries).
+    """
+    db = get_client(cred_path)
+    queries = {}
+    for name in collection_names:
+        _shard_filtered(queries, name, db.collection(name), fields, date_range)
+    if collection_group:
+        partitions = with_retries(lambda: list(db.collection_group(collection_group).get_partitions(partition_count)))
+        for i, partition in enumerate(partitions):
+            # Partition queries are ordered by document name, which a range filter on another field would break
+            _shard_filtered(queries, f"{collection_group}[{i}]", partition.query(), fields, date_range, range_filters=False)
+    return queries
+
+def iter_shards(queries, fields=INGEST_FIELDS, max_workers=MAX_FETCH_WORKERS):
+    """Reads every shard query on a bounded thread pool sharing one client.
+
+    Yields (shard_name, columns, seen_fields) as shards complete; each shard is retried as a whole
+    on transient errors. Wall time approaches that of the largest shard.
+    """
+    def read(query):
+        return with_retries(lambda: _docs_to_columns(query.stream(), fields))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(read, query): name for name, query in queries.items()}
+        for future in as_completed(futures):
+            columns, seen = future.result()
+            yield futures[future], columns, seen
+
+def fetch_shards(queries, fields=INGEST_FIELDS, max_workers=MAX_FETCH_WORKERS):
+    """Concurrent counterpart of fetch_documents over many shard queries, merged into one set of columns.
+
+    Shards are concatenated in the order given, so the result does not depend on completion order.
+    """
+    by_shard = {}
+    seen = set()
+    for name, columns, shard_seen in iter_shards(queries, fields, max_workers):
+        by_shard[name] = columns
+        seen |= shard_seen
+    merged = {field: [value for name in queries for value in by_shard[name][field]] for field in fields}
+    print(f"Fetched {len(queries)} shards concurrently.")
+    return {field: values for field, values in merged.items() if field in seen}
+
+@instrumented("filter_and_coerce")
+def filter_and_coerce(df):
+    """Expense filter, type coercion and invalid-row drop for one batch of raw rows.
+
+    Returns the typed expense rows and the number of expense rows before invalid ones were dropped.
+    """
+    # Handle potential variations in boolean representation
+    # Selecting the kept columns with the mask builds the one copy we need (no extra .copy())
+    is_expense = normalize_is_expense(df["isExpense"])
+    kept_columns = [col for col in INGEST_FIELDS if col in df.columns and col != "isExpense"]
+    df_expenses = df.loc[is_expense.to_numpy(), kept_columns]
+    expense_count = len(df_expenses)
+    if df_expenses.empty:
+        return df_expenses, expense_count
+
+    df_expenses["amount"] = coerce_amounts(df_expenses["amount"]).astype(AMOUNT_DTYPE)
+    df_expenses["date"] = coerce_dates(df_expenses["date"])
+    df_expenses.dropna(subset=["amount", "date", "category"], inplace=True)
+
+    # Ensure category is string, stored once per distinct value
+    df_expenses["category"] = df_expenses["category"].astype(str).astype("category")
+    if USER_ID_FIELD in df_expenses.columns:
+        df_expenses[USER_ID_FIELD] = df_expenses[USER_ID_FIELD].astype("category")
+    return df_expenses, expense_count
+
+def finalize_expenses(df_expenses):
+    """Sorts the typed expense rows and adds the derived time features."""
+    df_expenses.sort_values("date", inplace=True)
+
+    # Add the month feature used by the analysis stages (int64-backed Period, not objects)
+    df_expenses["year_month"] = df_expenses["date"].dt.to_period("M")
+
+    print(f"Preprocessing complete. {len(df_expenses)} valid expense transactions remaining.")
+    report_memory(df_expenses, "preprocessing")
+    return df_expenses
+
+@instrumented("preprocess")
+def preprocess_transactions(df):
+    """Normalizes raw transaction rows into the expense frame shared by all ML stages."""
+    if df.empty:
+        print("No documents found in the collection.")
+        return pd.DataFrame()
+
+    # Basic checks for required columns
+    _check_required_columns(df.columns)
+
+    # 1. Filter for expenses, 2. Type Conversion, 3. Handle Missing/Invalid Data
+    df_expenses, expense_count = filter_and_coerce(df)
+    print(f"Filtered down to {expense_count} expense transactions.")
+
+    if expense_count == 0:
+        print("No expense transactions found after filtering.")
+        return pd.DataFrame()
+
+    if len(df_expenses) < expense_count:
+        print(f"Dropped {expense_count - len(df_expenses)} rows due to missing/invalid amount, date, or category.")
+
+    return finalize_expenses(df_expenses)
+
+@instrumented("fetch_and_preprocess")
+def fetch_and_preprocess_data(cred_path, collection_name, source=None, date_range=None):
+    """Fetches data from Firestore, preprocesses it, and returns a DataFrame.
+
+    A data source (see data_sources) can be passed to read from somewhere other than Firestore.
+    date_range keeps only expenses dated within an inclusive (start, end) range.
+    """
+    if source is None:
+        columns = fetch_documents(cred_path, collection_name, date_range=date_range)
+    else:
+        columns = source.fetch_columns(INGEST_FIELDS)
+    df = pd.DataFrame(columns)
+    del columns # Release the column lists before preprocessing allocates its own copy
+    if df.empty:
+        print("No documents found in the collection.")
+        return pd.DataFrame() # Return empty DataFrame
+
+    print(f"Fetched {len(df)} documents.")
+    report_memory(df, "fetch")
+    return filter_date_range(preprocess_transactions(df), date_range)
+
+@instrumented("fetch_and_preprocess_chunked")
+def fetch_and_preprocess_chunked(cred_path, collection_name, page_size=PAGE_SIZE, source=None, date_range=None):
+    """Bounded-memory variant of fetch_and_preprocess_data.
+
+    Each page of documents is converted to typed expense rows as soon as it arrives and the raw
+    page is discarded, so raw-document memory is bounded by page_size. Pages without any valid
+    expense rows are not kept at all.
+    """
+    if source is None:
+        page_iter = iter_document_pages(cred_path, collection_name, page_size, date_range=date_range)
+    else:
+        page_iter = source.iter_pages(page_size, INGEST_FIELDS)
+
+    pages = []
+    seen = set()
+    fetched = expense_count = 0
+    for columns, page_seen in page_iter:
+        seen |= page_seen
+        page = pd.DataFrame(columns)
+        page.index += fetched # Keep row labels identical to a single full fetch
+        fetched += len(page)
+
+        page_expenses, page_expense_count = filter_and_coerce(page)
+        if date_range is not None:
+            in_range = filter_date_range(page_expenses, date_range)
+            page_expense_count -= len(page_expenses) - len(in_range) # Out-of-range rows are not "dropped"
+            page_expenses = in_range
+        expense_count += page_expense_count
+        if not page_expenses.empty:
+            pages.append(page_expenses)
+
+    if fetched == 0:
+        print("No documents found in the collection.")
+        return pd.DataFrame()
+
+    print(f"Fetched {fetched} documents in pages of {page_size}.")
+    _check_required_columns(seen)
+    print(f"Filtered down to {expense_count} expense transactions.")
+
+    if expense_count == 0:
+        print("No expense transactions found after filtering.")
+        return pd.DataFrame()
+
+    kept_count = sum(len(page) for page in pages)
+    if kept_count < expense_count:
+        print(f"Dropped {expense_count - kept_count} rows due to missing/invalid amount, date, or category.")
+    if not pages:
+        return pd.DataFrame()
+
+    # Pages carry their own category sets; merge them into one categorical column each
+    categorical_columns = [col for col in ("category", USER_ID_FIELD) if col in pages[0].columns]
+    merged = {col: union_categoricals([page[col] for page in pages], sort_categories=True) for col in categorical_columns}
+    column_order = list(pages[0].columns)
+    df_expenses = pd.concat([page.drop(columns=categorical_columns) for page in pages])
+    pages.clear()
+    for col, values in merged.items():
+        df_expenses[col] = pd.Categorical(values, categories=values.categories)
+    return finalize_expenses(df_expenses[column_order])
@@ -0,0 +1,239 @@
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from urllib.parse import unquote, urlsplit
+import asyncio
+import json
+import os
+import sys
+import time
+import traceback
+
+from ingestion import CRED_PATH, COLLECTION_NAME
+from rollup import sync_rollup
+from pipeline import run_stages_from_rollup
+from result_cache import fingerprint
+
+# --- Configuration ---
+HOST = "127.0.0.1"
+PORT = 8080
+CACHE_MAX_ENTRIES = 4096 # Users whose insights are kept in memory (LRU beyond that)
+CACHE_TTL_SECONDS = 600 # Insights are recomputed after this long even without new data
+REFRESH_INTERVAL_SECONDS = 60 # How often new transactions are pulled into the warm rollup
+MAX_WORKERS = os.cpu_count() or 1 # Threads computing insights off the event loop
+MAX_REQUEST_LINE = 8192
+
+# Insight views served per user: GET /users/<user_id>/<view>
+VIEWS = {
+    "insights": lambda results: results,
+    "spending": lambda results: results["spending_analysis"].get("spending_patterns", results["spending_analysis"]),
+    "anomalies": lambda results: results["spending_analysis"].get("anomalies", results["spending_analysis"]),
+    "forecast": lambda results: results["forecast"],
+    "savings": lambda results: results["savings"],
+    "tips": lambda results: results["tips"],
+}
+
+# --- Cache ---
+
+class InsightsCache:
+    """LRU cache with a TTL, keyed by (user_id, data_version)."""
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None or time.monotonic() - entry[0] > self.ttl:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, value):
+        self.entries[key] = (time.monotonic(), value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def users(self):
+        """Users with a cached entry, most recently used last."""
+        return list(dict.fromkeys(user_id for user_id, _ in self.entries))
+
+    def drop_versions_except(self, version):
+        for key in [key for key in self.entries if key[1] != version]:
+            del self.entries[key]
+
+# --- Service ---
+
+class InsightsService:
+    """Keeps the spending rollup warm and serves per-user insights from an LRU/TTL cache.
+
+    refresh_rollup is called (in a worker thread) to bring the rollup up to date; by default it
+    is the incremental Firestore sync, tests can pass a fixture. When a refresh brings a new data
+    version, the insights of recently requested users are recomputed in the background.
+    """
+
+    def __init__(self, refresh_rollup=None, cache=None, max_workers=MAX_WORKERS, refresh_interval=REFRESH_INTERVAL_SECONDS):
+        self.refresh_rollup = refresh_rollup or (lambda: sync_rollup(CRED_PATH, COLLECTION_NAME))
+        self.cache = cache or InsightsCache()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.refresh_interval = refresh_interval
+        self.rollup = None
+        self.user_ids = set()
+        self.version = None
+        self.in_flight = {}
+
+    # --- Data ---
+
+    async def refresh(self):
+        """Pulls new data; on a new data version, swaps the rollup and rewarms hot users."""
+        loop = asyncio.get_running_loop()
+        rollup = await loop.run_in_executor(self.executor, self.refresh_rollup)
+        # The version is derived from the data, so a refresh without changes keeps the cache warm
+        version = rollup.meta.get("data_version") or fingerprint(rollup.table.reset_index())
+        if version == self.version:
+            return False
+        hot_users = self.cache.users()
+        self.rollup, self.user_ids, self.version = rollup, set(rollup.users()), version
+        self.cache.drop_versions_except(version)
+        print(f"Data version {version}: {len(self.user_ids)} users; rewarming {len(hot_users)} cached users.")
+        for user_id in hot_users:
+            asyncio.ensure_future(self.insights(user_id))
+        return True
+
+    async def refresh_forever(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                print(f"Refresh failed, serving the previous data version: {e}")
+
+    def _compute(self, rollup, user_id):
+        return json.loads(json.dumps(run_stages_from_rollup(rollup, user_id), default=str))
+
+    async def insights(self, user_id):
+        """All stage results for a user, from the cache or computed in the executor (deduplicated)."""
+        key = (user_id, self.version)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        if key not in self.in_flight:
+            loop = asyncio.get_running_loop()
+            self.in_flight[key] = loop.run_in_executor(self.executor, self._compute, self.rollup, user_id)
+        try:
+            results = await self.in_flight[key]
+        finally:
+            self.in_flight.pop(key, None)
+        self.cache.put(key, results)
+        return results
+
+    # --- HTTP ---
+
+    async def route(self, method, path):
+        """Returns (status, payload) for a request."""
+        if method != "GET":
+            return 405, {"error": "Only GET is supported."}
+        parts = [unquote(part) for part in urlsplit(path).path.strip("/").split("/") if part]
+        if parts == ["health"]:
+            return 200, {
+                "data_version": self.version,
+                "users": len(self.user_ids),
+                "cache_entries": len(self.cache.entries),
+                "cache_hits": self.cache.hits,
+                "cache_misses": self.cache.misses,
+            }
+        if len(parts) not in (2, 3) or parts[0] != "users" or (len(parts) == 3 and parts[2] not in VIEWS):
+            return 404, {"error": f"Unknown path. Use /health or /users/<user_id>/<{'|'.join(VIEWS)}>."}
+        if self.rollup is None:
+            return 503, {"error": "Data is still loading."}
+        user_id = parts[1]
+        if user_id not in self.user_ids:
+            return 404, {"error": f"No transactions found for user '{user_id}'."}
+        results = await self.insights(user_id)
+        return 200, VIEWS[parts[2] if len(parts) == 3 else "insights"](results)
+
+    async def handle_connection(self, reader, writer):
+        """Serves HTTP/1.1 requests (keep-alive) on one connection."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                if len(request_line) > MAX_REQUEST_LINE:
+                    await self._respond(writer, 414, {"error": "Request line too long."}, keep_alive=False)
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                try:
+                    content_length = int(headers.get("content-length", 0) or 0)
+                except ValueError:
+                    content_length = -1
+                if content_length < 0:
+                    await self._respond(writer, 400, {"error": "Invalid Content-Length header."}, keep_alive=False)
+                    break
+                if content_length:
+                    await reader.readexactly(content_length)
+
+                try:
+                    method, path, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    await self._respond(writer, 400, {"error": "Malformed request line."}, keep_alive=False)
+                    break
+                keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+                try:
+                    status, payload = await self.route(method, path)
+                except Exception as e:
+                    print(f"Error serving {path}: {e}")
+                    print(f"Traceback: {traceback.format_exc()}")
+                    status, payload = 500, {"error": f"An unexpected error occurred: {e}"}
+                await self._respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, writer, status, payload, keep_alive):
+        body = json.dumps(payload, default=str).encode()
+        reason = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+                  414: "URI Too Long", 500: "Internal Server Error", 503: "Service Unavailable"}[status]
+        head = (
+            f"HTTP/1.1 {status} {reason}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode() + body)
+        await writer.drain()
+
+    async def serve(self, host=HOST, port=PORT):
+        """Loads the data once, then serves until cancelled while refreshing in the background."""
+        await self.refresh()
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        print(f"Insights service listening on http://{host}:{server.sockets[0].getsockname()[1]}")
+        refresher = asyncio.ensure_future(self.refresh_forever())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            refresher.cancel()
+            self.executor.shutdown(wait=False)
+
+# --- Main Execution ---
+if __name__ == "__main__":
+    port = next((int(arg.split("=", 1)[1]) for arg in sys.argv if arg.startswith("--port=")), PORT)
+    try:
+        asyncio.run(InsightsService().serve(HOST, port))
+    except KeyboardInterrupt:
+        print("Insights service stopped.")
@@ -0,0 +1,281 @@
+from collections import deque
+import pandas as pd
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+
+try:
+    import resource
+except ImportError: # Not available on Windows; the process peak RSS is then reported as None
+    resource = None
+
+# --- Configuration ---
+METRICS_PATH = "ML/results/metrics.jsonl" # One JSON line per stage call plus one run summary line
+PROMETHEUS_PATH = None # e.g. "ML/results/metrics.prom" for the node_exporter textfile collector
+PROFILE_DIR = "ML/results/profiles"
+PROFILE_MODES = ("cprofile", "tracemalloc")
+PROFILE_TOP_N = 30 # Lines kept in a profile report
+MAX_STAGE_RECORDS = 10_000 # Stage records kept in memory; per-stage totals are always complete
+METRIC_PREFIX = "ml_stage"
+
+# Stages are functions wrapped with @instrumented("<stage>"). Each call records wall time, CPU
+# time, the change in resident memory over the call, rows in and out, and counters (e.g.
+# Firestore documents read) bumped while it ran. Records are collected per process; batch
+# worker processes keep their own. The RSS delta is process-wide, so stages running at the same
+# time in other threads (the insights service) add to each other's. The process peak RSS is the
+# high-water mark since the process started, not a peak of the stage.
+
+# --- State ---
+
+_lock = threading.Lock()
+_local = threading.local()
+_run = {
+    "run_id": uuid.uuid4().hex,
+    "started_at": pd.Timestamp.now(tz="UTC").isoformat(),
+    "records": deque(maxlen=MAX_STAGE_RECORDS),
+    "totals": {}, # stage -> aggregated measurements
+    "counters": {}, # counter -> run total
+}
+_profile_lock = threading.Lock() # Guards _profile; cProfile and tracemalloc profile one call at a time
+_profile = {"stage": None, "mode": None, "profiler": None, "snapshot": None, "peak_mb": 0.0, "active": False}
+
+# --- Helper Functions ---
+
+def peak_rss_mb():
+    """High-water resident set size of this process since it started in megabytes, or None if unavailable."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+def current_rss_mb():
+    """Current resident set size of this process in megabytes, or None where /proc is unavailable."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return resident_pages * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2
+
+def count_rows(value):
+    """Rows in a stage's input or output: frame/series length, or the records in a result dict.
+
+    For a tuple (e.g. (frame, count)) the first element is counted.
+    """
+    if isinstance(value, (pd.DataFrame, pd.Series, list)):
+        return len(value)
+    if isinstance(value, tuple):
+        return count_rows(value[0]) if value else 0
+    if isinstance(value, dict):
+        return sum(count_rows(item) for item in value.values())
+    return 0
+
+def add_count(counter, amount=1):
+    """Adds to a counter on every stage currently running in this thread and on the run total."""
+    with _lock:
+        _run["counters"][counter] = _run["counters"].get(counter, 0) + amount
+    for record in getattr(_local, "stack", []):
+        record["counters"][counter] = record["counters"].get(counter, 0) + amount
+
+def enable_profiling(stage, mode="cprofile"):
+    """Profiles every call of one stage with cProfile or tracemalloc; reports are written with the run summary."""
+    if mode not in PROFILE_MODES:
+        raise ValueError(f"Unknown profile mode '{mode}'. Expected one of {PROFILE_MODES}.")
+    with _profile_lock:
+        _profile.update(stage=stage, mode=mode, profiler=cProfile.Profile() if mode == "cprofile" else None,
+                        snapshot=None, peak_mb=0.0, active=False)
+
+def _start_profile(stage):
+    """Starts profiling a call of the profiled stage, unless another call (e.g. in another thread) holds the profiler."""
+    with _profile_lock:
+        if _profile["stage"] != stage or _profile["active"]:
+            return False
+        _profile["active"] = True
+        if _profile["mode"] == "cprofile":
+            _profile["profiler"].enable()
+        elif not tracemalloc.is_tracing():
+            tracemalloc.start()
+    return True
+
+def _stop_profile():
+    with _profile_lock:
+        if _profile["mode"] == "cprofile":
+            _profile["profiler"].disable()
+        else:
+            _profile["snapshot"] = tracemalloc.take_snapshot()
+            _profile["peak_mb"] = max(_profile["peak_mb"], tracemalloc.get_traced_memory()[1] / 1024 ** 2)
+            tracemalloc.stop()
+        _profile["active"] = False
+
+# --- Core Functions ---
+
+def instrumented(stage):
+    """Decorator recording one stage measurement per call of the wrapped function.
+
+    Rows in are counted from the first argument and rows out from the return value.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            stack = _local.__dict__.setdefault("stack", [])
+            record = {
+                "run_id": _run["run_id"],
+                "stage": stage,
+                "depth": len(stack),
+                "rows_in": count_rows(args[0]) if args else 0,
+                "counters": {},
+            }
+            stack.append(record)
+            profiling = _start_profile(stage)
+            rss_start = current_rss_mb()
+            wall_start, cpu_start = time.perf_counter(), time.process_time()
+            status = "ok"
+            try:
+                result = func(*args, **kwargs)
+                record["rows_out"] = count_rows(result)
+                return result
+            except Exception:
+                status = "error"
+                raise
+            finally:
+                record["wall_seconds"] = round(time.perf_counter() - wall_start, 6)
+                record["cpu_seconds"] = round(time.process_time() - cpu_start, 6)
+                if profiling:
+                    _stop_profile()
+                stack.pop()
+                record["status"] = status
+                rss_end = current_rss_mb()
+                record["rss_delta_mb"] = round(rss_end - rss_start, 3) if rss_start is not None and rss_end is not None else None
+                record["process_peak_rss_mb"] = peak_rss_mb()
+                _record(record)
+        return wrapper
+    return decorator
+
+def _record(record):
+    with _lock:
+        _run["records"].append(record)
+        totals = _run["totals"].setdefault(record["stage"], {
+            "calls": 0, "errors": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0,
+            "rows_in": 0, "rows_out": 0, "max_rss_delta_mb": None, "process_peak_rss_mb": None, "counters": {},
+        })
+        totals["calls"] += 1
+        totals["errors"] += record["status"] == "error"
+        totals["wall_seconds"] += record["wall_seconds"]
+        totals["cpu_seconds"] += record["cpu_seconds"]
+        totals["rows_in"] += record["rows_in"]
+        totals["rows_out"] += record.get("rows_out", 0)
+        if record["rss_delta_mb"] is not None:
+            totals["max_rss_delta_mb"] = max(record["rss_delta_mb"], totals["max_rss_delta_mb"] if totals["max_rss_delta_mb"] is not None else float("-inf"))
+        if record["process_peak_rss_mb"] is not None:
+            totals["process_peak_rss_mb"] = max(totals["process_peak_rss_mb"] or 0.0, record["process_peak_rss_mb"])
+        for counter, amount in record["counters"].items():
+            totals["counters"][counter] = totals["counters"].get(counter, 0) + amount
+
+def run_summary():
+    """Per-stage totals and run-level counters of this process so far."""
+    with _lock:
+        return {
+            "run_id": _run["run_id"],
+            "started_at": _run["started_at"],
+            "finished_at": pd.Timestamp.now(tz="UTC").isoformat(),
+            "process_peak_rss_mb": peak_rss_mb(),
+            "counters": dict(_run["counters"]),
+            "stages": {stage: dict(totals, counters=dict(totals["counters"])) for stage, totals in _run["totals"].items()},
+        }
+
+def prometheus_text(summary):
+    """Run summary in the Prometheus text exposition format."""
+    lines = []
+    for metric, help_text, field in [
+        ("calls_total", "Calls of each ML stage.", "calls"),
+        ("errors_total", "Calls of each ML stage that raised.", "errors"),
+        ("wall_seconds_total", "Wall-clock time spent in each ML stage.", "wall_seconds"),
+        ("cpu_seconds_total", "CPU time spent in each ML stage.", "cpu_seconds"),
+        ("rows_in_total", "Rows passed into each ML stage.", "rows_in"),
+        ("rows_out_total", "Rows returned by each ML stage.", "rows_out"),
+        ("max_rss_delta_megabytes", "Largest growth in process RSS over one call of each ML stage.", "max_rss_delta_mb"),
+        ("process_peak_rss_megabytes", "Process peak RSS since start, as of the last call of each ML stage.", "process_peak_rss_mb"),
+    ]:
+        name = f"{METRIC_PREFIX}_{metric}"
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {'counter' if metric.endswith('_total') else 'gauge'}")
+        for stage, totals in summary["stages"].items():
+            if totals[field] is not None:
+                lines.append(f'{name}{{stage="{stage}"}} {totals[field]}')
+    for counter, value in summary["counters"].items():
+        name = f"{METRIC_PREFIX}_{counter}_total"
+        lines.append(f"# TYPE {name} counter")
+        lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+def _write_profile_report():
+    """Writes the report of the profiled stage, if any; returns its path."""
+    if _profile["stage"] is None or (_profile["profiler"] is None and _profile["snapshot"] is None):
+        return None
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    base = os.path.join(PROFILE_DIR, f"{_profile['stage']}_{_run['run_id'][:8]}")
+    if _profile["mode"] == "cprofile":
+        _profile["profiler"].dump_stats(f"{base}.prof")
+        report = io.StringIO()
+        pstats.Stats(_profile["profiler"], stream=report).sort_stats("cumulative").print_stats(PROFILE_TOP_N)
+        path = f"{base}.cprofile.txt"
+        text = report.getvalue()
+    else:
+        stats = _profile["snapshot"].statistics("lineno")[:PROFILE_TOP_N]
+        path = f"{base}.tracemalloc.txt"
+        header = f"Peak traced memory: {_profile['peak_mb']:.2f} MB. Allocations still live when the stage returned:"
+        text = "\n".join([header] + [str(stat) for stat in stats]) + "\n"
+    with open(path, "w") as f:
+        f.write(text)
+    return path
+
+def write_run_summary(metrics_path=METRICS_PATH, prometheus_path=PROMETHEUS_PATH):
+    """Appends stage records and the run summary as JSON lines, optionally writes Prometheus text, prints the summary."""
+    summary = run_summary()
+    with _profile_lock:
+        profile_path = _write_profile_report()
+    if profile_path:
+        summary["profile_report"] = profile_path
+
+    with _lock:
+        records = list(_run["records"])
+        _run["records"].clear()
+    os.makedirs(os.path.dirname(metrics_path) or ".", exist_ok=True)
+    with open(metrics_path, "a") as f:
+        for record in records:
+            f.write(json.dumps(dict(record, type="stage")) + "\n")
+        f.write(json.dumps(dict(summary, type="run_summary")) + "\n")
+
+    if prometheus_path:
+        os.makedirs(os.path.dirname(prometheus_path) or ".", exist_ok=True)
+        with open(f"{prometheus_path}.tmp", "w") as f:
+            f.write(prometheus_text(summary))
+        os.replace(f"{prometheus_path}.tmp", prometheus_path)
+
+    print("Stage metrics:")
+    for stage, totals in summary["stages"].items():
+        rss = f", RSS grew by up to {totals['max_rss_delta_mb']:.1f} MB" if totals["max_rss_delta_mb"] is not None else ""
+        print(f"  {stage}: {totals['calls']} call(s), {totals['wall_seconds']:.3f}s wall, {totals['cpu_seconds']:.3f}s CPU, "
+              f"{totals['rows_in']} rows in, {totals['rows_out']} rows out{rss}")
+    for counter, value in summary["counters"].items():
+        print(f"  {counter}: {value}")
+    if profile_path:
+        print(f"  profile of '{_profile['stage']}' written to {profile_path}")
+    return summary
+
+def configure_from_argv(argv=sys.argv):
+    """Applies --profile=<stage>[:cprofile|tracemalloc] and --prometheus=<path>; returns the Prometheus path."""
+    profile = next((arg.split("=", 1)[1] for arg in argv if arg.startswith("--profile=")), None)
+    if profile:
+        stage, _, mode = profile.partition(":")
+        enable_profiling(stage, mode or "cprofile")
+    return next((arg.split("=", 1)[1] for arg in argv if arg.startswith("--prometheus=")), PROMETHEUS_PATH)
@@ -0,0 +1,177 @@
+from google.cloud.firestore_v1.base_query import FieldFilter
+import pandas as pd
+import asyncio
+import sys
+import threading
+import time
+
+from ingestion import CRED_PATH, COLLECTION_NAME, INGEST_FIELDS, USER_ID_FIELD, get_client, preprocess_transactions
+from snapshot_cache import SNAPSHOT_DIR, UPDATED_AT_FIELD, DELETED_AT_FIELD, TOMBSTONE_SUFFIX, load_snapshot, preprocess_snapshot, sync_snapshot
+from rollup import ROLLUP_DIR, SpendingRollup, sync_rollup
+from instrumentation import add_count, instrumented
+
+# --- Configuration ---
+SERVICE_REFRESH_SECONDS = 1 # How often the insights service picks up live changes (with --serve)
+STATUS_INTERVAL_SECONDS = 60 # How often the listener prints its status when run standalone
+
+# The listener keeps what each expense document contributes to the rollup (user, month,
+# category, amount) so that an edit or delete can remove the previous version's contribution;
+# documents that are not valid expenses contribute nothing and are not kept. Added and modified
+# documents go through preprocess_transactions (the fetch path's rules) and are applied to the
+# rollup in place.
+
+# --- Helper Functions ---
+
+def _preprocess_rows(rows):
+    """Preprocesses raw document rows (dicts of INGEST_FIELDS) exactly as a fresh fetch would."""
+    if not rows:
+        return pd.DataFrame()
+    return preprocess_transactions(pd.DataFrame(rows, columns=INGEST_FIELDS))
+
+def _raw_row(doc_id, data):
+    """Ingested fields of one document, as fetch_documents collects them."""
+    row = {field: data.get(field) for field in INGEST_FIELDS}
+    row["id"] = doc_id
+    return row
+
+def _contributions(expenses):
+    """{doc_id: (user_id, year_month, category, amount)} of preprocessed expense rows."""
+    if expenses.empty:
+        return {}
+    user_ids = expenses[USER_ID_FIELD].astype(object) if USER_ID_FIELD in expenses.columns else [None] * len(expenses)
+    return {
+        str(doc_id): (None if pd.isna(user_id) else user_id, year_month, category, float(amount))
+        for doc_id, user_id, year_month, category, amount
+        in zip(expenses["id"], user_ids, expenses["year_month"], expenses["category"].astype(str), expenses["amount"])
+    }
+
+def _contribution_frame(doc_ids, contributions):
+    """The rows SpendingRollup.remove needs to take the given documents' contributions back out."""
+    records = [(doc_id,) + contributions[doc_id] for doc_id in doc_ids]
+    frame = pd.DataFrame(records, columns=["id", USER_ID_FIELD, "year_month", "category", "amount"])
+    frame["year_month"] = frame["year_month"].astype("period[M]")
+    return frame
+
+# --- Live Rollup ---
+
+class LiveRollup:
+    """A SpendingRollup kept current by Firestore listeners (or any change feed calling apply_changes).
+
+    Changes arrive on listener threads; every change batch is applied under a lock and bumps
+    the rollup's data_version, which readers such as the insights service key their caches on.
+    """
+
+    def __init__(self, rollup=None, contributions=None, snapshot_meta=None):
+        self.rollup = rollup if rollup is not None else SpendingRollup()
+        self.contributions = contributions if contributions is not None else {}
+        self.snapshot_meta = snapshot_meta if snapshot_meta is not None else {}
+        self.lock = threading.Lock()
+        self.watches = []
+        self.version = 0
+        self.base_version = self.rollup.meta.get("data_version") or self.rollup.meta.get("synced_at")
+        self.rollup.meta["data_version"] = f"{self.base_version}#{self.version}"
+
+    @classmethod
+    def bootstrap(cls, cred_path=CRED_PATH, collection_name=COLLECTION_NAME, rollup_dir=ROLLUP_DIR, snapshot_dir=SNAPSHOT_DIR):
+        """Starts from the persisted rollup and snapshot, reading only documents changed since the last sync.
+
+        A missing or unreadable snapshot is rebuilt with a full scan.
+        """
+        rollup = sync_rollup(cred_path, collection_name, rollup_dir)
+        snapshot, meta = load_snapshot(collection_name, snapshot_dir)
+        if snapshot is None:
+            print(f"No usable snapshot of '{collection_name}' in {snapshot_dir}; rebuilding it with a full scan.")
+            snapshot, _, meta = sync_snapshot(cred_path, collection_name, snapshot_dir, full_refresh=True, return_changes=True)
+        return cls(rollup, _contributions(preprocess_snapshot(snapshot)), meta)
+
+    @instrumented("live_apply_changes")
+    def apply_changes(self, upserts=(), deletes=()):
+        """Applies a batch of changes: upserts are (doc_id, data) pairs for added or edited documents,
+        deletes are document IDs. Returns the number of documents applied.
+        """
+        upserts = list(upserts)
+        with self.lock:
+            deletes = [doc_id for doc_id in deletes if doc_id in self.contributions]
+            if not upserts and not deletes:
+                return 0
+            replaced = [doc_id for doc_id, _ in upserts if doc_id in self.contributions] + deletes
+            added = _preprocess_rows([_raw_row(doc_id, data) for doc_id, data in upserts])
+
+            # Documents are only recorded once their contribution has been applied
+            self.rollup.remove(_contribution_frame(replaced, self.contributions))
+            self.rollup.add(added)
+            for doc_id in replaced:
+                del self.contributions[doc_id]
+            self.contributions.update(_contributions(added))
+            self.version += 1
+            self.rollup.meta["data_version"] = f"{self.base_version}#{self.version}"
+            self.rollup.meta["live_updated_at"] = pd.Timestamp.now(tz="UTC").isoformat()
+        return len(upserts) + len(deletes)
+
+    def current(self):
+        """Consistent copy of the rollup for readers on other threads (cells are shared, not copied)."""
+        with self.lock:
+            return SpendingRollup(
+                self.rollup.table,
+                dict(self.rollup.detectors),
+                {user_id: list(flagged) for user_id, flagged in self.rollup.anomalies.items()},
+                dict(self.rollup.meta),
+            )
+
+    # --- Firestore Listeners ---
+
+    def _on_documents(self, _snapshot, changes, _read_time):
+        add_count("firestore_documents_read", len(changes))
+        upserts = [(change.document.id, change.document.to_dict() or {}) for change in changes if change.type.name != "REMOVED"]
+        deletes = [change.document.id for change in changes if change.type.name == "REMOVED"]
+        self._apply_safely(upserts, deletes)
+
+    def _on_tombstones(self, _snapshot, changes, _read_time):
+        add_count("firestore_documents_read", len(changes))
+        self._apply_safely((), [change.document.id for change in changes if change.type.name == "ADDED"])
+
+    def _apply_safely(self, upserts, deletes):
+        # Exceptions on a listener thread would silently stop updates; report them instead
+        try:
+            applied = self.apply_changes(upserts, deletes)
+            if applied:
+                print(f"Applied {applied} live changes (data version {self.rollup.meta['data_version']}).")
+        except Exception as e:
+            print(f"Error applying live changes: {e}")
+
+    def listen(self, cred_path=CRED_PATH, collection_name=COLLECTION_NAME):
+        """Listens for documents changed after the bootstrap watermark and for new tombstones."""
+        db = get_client(cred_path)
+        meta = self.snapshot_meta
+        documents = db.collection(collection_name)
+        tombstones = db.collection(f"{collection_name}{TOMBSTONE_SUFFIX}")
+        if meta.get("watermark"):
+            documents = documents.where(filter=FieldFilter(UPDATED_AT_FIELD, ">", pd.Timestamp(meta["watermark"]).to_pydatetime()))
+        if meta.get("deletions_watermark"):
+            tombstones = tombstones.where(filter=FieldFilter(DELETED_AT_FIELD, ">", pd.Timestamp(meta["deletions_watermark"]).to_pydatetime()))
+        self.watches = [documents.on_snapshot(self._on_documents), tombstones.on_snapshot(self._on_tombstones)]
+        print(f"Listening for changes to '{collection_name}'...")
+
+    def stop(self):
+        for watch in self.watches:
+            watch.unsubscribe()
+        self.watches = []
+
+# --- Main Execution ---
+if __name__ == "__main__":
+    # --serve also runs the insights service on the live rollup (see insights_service)
+    live = LiveRollup.bootstrap(CRED_PATH, COLLECTION_NAME)
+    live.listen(CRED_PATH, COLLECTION_NAME)
+    try:
+        if "--serve" in sys.argv:
+            from insights_service import HOST, PORT, InsightsService
+            port = next((int(arg.split("=", 1)[1]) for arg in sys.argv if arg.startswith("--port=")), PORT)
+            asyncio.run(InsightsService(refresh_rollup=live.current, refresh_interval=SERVICE_REFRESH_SECONDS).serve(HOST, port))
+        else:
+            while True:
+                time.sleep(STATUS_INTERVAL_SECONDS)
+                print(f"Live rollup: {len(live.contributions)} expense documents, {len(live.rollup.table)} cells, data version {live.rollup.meta['data_version']}.")
+    except KeyboardInterrupt:
+        print("Stopping listeners.")
+    finally:
+        live.stop()
@@ -0,0 +1,217 @@
+import bisect
+import json
+import math
+import os
+
+from ingestion import CRED_PATH, COLLECTION_NAME, fetch_and_preprocess_data
+
+# --- Configuration ---
+CHECKPOINT_PATH = "ML/cache/online_anomalies.json"
+IQR_THRESHOLD = 1.5 # Same multiplier as detect_anomalies_iqr
+MIN_POINTS = 5 # Same minimum group size as detect_anomalies_iqr
+EXACT_WARMUP = 200 # Values kept exactly per category before switching to P² sketches
+# Tolerance against detect_anomalies_iqr on the same history: exact up to EXACT_WARMUP values; after
+# that each bound is within 25% of the IQR just past the warmup, 15% at a thousand values, 6% at three
+# thousand and 3% at ten thousand, measured on gamma, lognormal, uniform and bimodal amounts
+# (tests/test_online_anomalies.py).
+
+# --- Quantile Sketch ---
+
+def exact_quantile(sorted_values, p):
+    """Quantile of a sorted list with linear interpolation (np.quantile's default), without NumPy overhead."""
+    position = p * (len(sorted_values) - 1)
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+class P2Quantile:
+    """P² streaming estimator of one quantile (Jain & Chlamtac, 1985): five markers, O(1) update and memory."""
+
+    def __init__(self, p, heights, positions, desired):
+        self.p = p
+        self.heights = heights
+        self.positions = positions
+        self.desired = desired
+        self.increments = [0.0, p / 2, p, (1 + p) / 2, 1.0]
+
+    @classmethod
+    def from_sorted(cls, p, values):
+        """Seeds the five markers from at least five sorted observations."""
+        count = len(values)
+        desired = [1 + (count - 1) * step for step in (0.0, p / 2, p, (1 + p) / 2, 1.0)]
+        positions = [1]
+        for target in desired[1:4]:
+            positions.append(min(max(int(round(target)), positions[-1] + 1), count - (4 - len(positions))))
+        positions.append(count)
+        heights = [float(values[position - 1]) for position in positions]
+        return cls(p, heights, positions, desired)
+
+    def update(self, x):
+        """Adds one observation."""
+        q, n = self.heights, self.positions
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        # Move the middle markers towards their desired positions
+        for i in (1, 2, 3):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                step = 1 if d > 0 else -1
+                candidate = self._parabolic(i, step)
+                if q[i - 1] < candidate < q[i + 1]:
+                    q[i] = candidate
+                else:
+                    q[i] = q[i] + step * (q[i + step] - q[i]) / (n[i + step] - n[i])
+                n[i] += step
+
+    def _parabolic(self, i, step):
+        q, n = self.heights, self.positions
+        return q[i] + step / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + step) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+            + (n[i + 1] - n[i] - step) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+        )
+
+    def value(self):
+        """Current estimate of the quantile."""
+        return self.heights[2]
+
+    def to_dict(self):
+        return {"p": self.p, "heights": self.heights, "positions": self.positions, "desired": self.desired}
+
+    @classmethod
+    def from_dict(cls, state):
+        return cls(state["p"], list(state["heights"]), list(state["positions"]), list(state["desired"]))
+
+# --- Online Detector ---
+
+class OnlineIQRDetector:
+    """Per-category IQR anomaly scoring for transactions as they arrive.
+
+    Each category keeps its amounts exactly (sorted) until EXACT_WARMUP values, then switches to P²
+    sketches for Q1 and Q3, so scoring and updating cost constant time and memory per category.
+    """
+
+    def __init__(self, threshold=IQR_THRESHOLD, min_points=MIN_POINTS, warmup=EXACT_WARMUP):
+        self.threshold = threshold
+        self.min_points = min_points
+        self.warmup = warmup
+        self.groups = {}
+
+    def bounds(self, category):
+        """Current (lower, upper) IQR bounds for a category, or None below min_points observations."""
+        group = self.groups.get(category)
+        if group is None or group["count"] < self.min_points:
+            return None
+        if group["buffer"] is not None:
+            Q1, Q3 = exact_quantile(group["buffer"], 0.25), exact_quantile(group["buffer"], 0.75)
+        else:
+            Q1, Q3 = group["q1"].value(), group["q3"].value()
+        IQR = Q3 - Q1
+        return Q1 - self.threshold * IQR, Q3 + self.threshold * IQR
+
+    def score(self, category, amount):
+        """Scores a transaction against the category's current bounds without recording it."""
+        current_bounds = self.bounds(category)
+        if current_bounds is None:
+            return {"is_anomaly": False, "category": category, "amount": amount, "anomaly_reason": None}
+        lower_bound, upper_bound = current_bounds
+        is_anomaly = amount < lower_bound or amount > upper_bound
+        reason = None
+        if is_anomaly:
+            reason = f"Amount {amount:.2f} outside IQR bounds [{lower_bound:.2f}, {upper_bound:.2f}] for category '{category}'"
+        return {"is_anomaly": is_anomaly, "category": category, "amount": amount, "anomaly_reason": reason}
+
+    def update(self, category, amount):
+        """Records a transaction amount for its category."""
+        amount = float(amount)
+        if math.isnan(amount):
+            return
+        group = self.groups.setdefault(category, {"count": 0, "buffer": [], "q1": None, "q3": None})
+        group["count"] += 1
+        if group["buffer"] is None:
+            group["q1"].update(amount)
+            group["q3"].update(amount)
+            return
+        bisect.insort(group["buffer"], amount)
+        if len(group["buffer"]) > self.warmup:
+            values = group["buffer"]
+            group["q1"] = P2Quantile.from_sorted(0.25, values)
+            group["q3"] = P2Quantile.from_sorted(0.75, values)
+            group["buffer"] = None
+
+    def score_and_update(self, category, amount):
+        """Scores a new transaction against the history, then adds it to the history."""
+        result = self.score(category, amount)
+        self.update(category, amount)
+        return result
+
+    def warm_start(self, df, group_by_col="category", value_col="amount"):
+        """Feeds historical transactions (in date order if the frame has one) into the detector."""
+        if "date" in df.columns:
+            df = df.sort_values("date", kind="stable")
+        for category, amount in zip(df[group_by_col].astype(str), df[value_col]):
+            self.update(category, amount)
+        return self
+
+    # --- Checkpointing ---
+
+    def to_dict(self):
+        groups = {}
+        for category, group in self.groups.items():
+            groups[category] = {
+                "count": group["count"],
+                "buffer": group["buffer"],
+                "q1": group["q1"].to_dict() if group["q1"] is not None else None,
+                "q3": group["q3"].to_dict() if group["q3"] is not None else None,
+            }
+        return {"threshold": self.threshold, "min_points": self.min_points, "warmup": self.warmup, "groups": groups}
+
+    @classmethod
+    def from_dict(cls, state):
+        detector = cls(state["threshold"], state["min_points"], state["warmup"])
+        for category, group in state["groups"].items():
+            detector.groups[category] = {
+                "count": group["count"],
+                "buffer": sorted(group["buffer"]) if group["buffer"] is not None else None,
+                "q1": P2Quantile.from_dict(group["q1"]) if group["q1"] is not None else None,
+                "q3": P2Quantile.from_dict(group["q3"]) if group["q3"] is not None else None,
+            }
+        return detector
+
+    def save(self, path=CHECKPOINT_PATH):
+        """Writes the sketch state to disk atomically."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(self.to_dict(), f)
+        os.replace(f"{path}.tmp", path)
+
+    @classmethod
+    def load(cls, path=CHECKPOINT_PATH):
+        """Restores a detector from a checkpoint, or returns an empty one if there is none."""
+        if not os.path.exists(path):
+            return cls()
+        with open(path, "r") as f:
+            return cls.from_dict(json.load(f))
+
+# --- Main Execution ---
+if __name__ == "__main__":
+    print("Warming up the online anomaly detector from transaction history...")
+    df_processed = fetch_and_preprocess_data(CRED_PATH, COLLECTION_NAME)
+    detector = OnlineIQRDetector()
+    if not df_processed.empty:
+        detector.warm_start(df_processed)
+    print(f"Saving detector checkpoint for {len(detector.groups)} categories to {CHECKPOINT_PATH}...")
+    detector.save(CHECKPOINT_PATH)
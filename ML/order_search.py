@@ -0,0 +1,220 @@
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import pandas as pd
+import contextlib
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+import warnings
+from statsmodels.tsa.arima.model import ARIMA
+from statsmodels.tsa.stattools import kpss
+from statsmodels.tools.sm_exceptions import ConvergenceWarning, InterpolationWarning
+
+try:
+    import fcntl
+except ImportError: # Not available on Windows; cache updates are then not serialized between processes
+    fcntl = None
+
+warnings.simplefilter("ignore", ConvergenceWarning)
+warnings.simplefilter("ignore", InterpolationWarning) # KPSS p-values outside the lookup table
+warnings.simplefilter("ignore", UserWarning)
+
+# --- Configuration ---
+# The search constants are part of the forecast result cache key (FORECAST_CACHE_CONFIG in expense_forecasting)
+ORDER_CACHE_PATH = "ML/cache/arima_orders.json"
+MAX_P = 3 # Largest AR order searched
+MAX_Q = 3 # Largest MA order searched
+MAX_D = 2 # Largest differencing order chosen by the KPSS test
+SEASONAL_PERIOD = 12
+MIN_MONTHS_FOR_SEASONAL = 36 # Seasonal terms are only searched with three years of history
+CRITERION = "aic" # "aic" or "bic"
+SEARCH_TIME_BUDGET = 60.0 # Seconds per series search; the best order found so far is kept
+MIN_IMPROVEMENT = 2.0 # Stop once a whole complexity level improves the criterion by less than this
+MAX_WORKERS = os.cpu_count() or 1
+ORDER_MAX_AGE_DAYS = 30 # Cached orders are re-searched after this many days
+ORDER_MAX_NEW_MONTHS = 6 # ...or once the series has grown by this many months
+
+# --- Helper Functions ---
+
+def choose_differencing(monthly, max_d=MAX_D, alpha=0.05):
+    """Smallest d for which the KPSS test does not reject stationarity.
+
+    Information criteria are not comparable across different d, so d is fixed before the search.
+    """
+    values = monthly.astype(float)
+    for d in range(max_d + 1):
+        if d:
+            values = values.diff().dropna() # d-th order difference, not a lag-d one
+        if len(values) < 10 or values.std() == 0:
+            return d
+        try:
+            p_value = kpss(values, regression="c", nlags="auto")[1]
+        except Exception:
+            return d
+        if p_value >= alpha:
+            return d
+    return max_d
+
+def candidate_orders(n_obs, d, seasonal=True, max_p=MAX_P, max_q=MAX_Q):
+    """(order, seasonal_order) candidates grouped by complexity level p+q+P+Q, simplest first."""
+    seasonal_terms = [(0, 0)]
+    if seasonal and n_obs >= MIN_MONTHS_FOR_SEASONAL:
+        seasonal_terms = [(0, 0), (1, 0), (0, 1), (1, 1)]
+
+    levels = {}
+    for p in range(max_p + 1):
+        for q in range(max_q + 1):
+            for P, Q in seasonal_terms:
+                seasonal_order = (P, 0, Q, SEASONAL_PERIOD) if (P or Q) else (0, 0, 0, 0)
+                levels.setdefault(p + q + P + Q, []).append(((p, d, q), seasonal_order))
+    return [levels[level] for level in sorted(levels)]
+
+def score_candidate(monthly, order, seasonal_order, criterion=CRITERION):
+    """Fits one candidate and returns its information criterion, or None if the fit fails."""
+    try:
+        model_fit = ARIMA(monthly, order=order, seasonal_order=seasonal_order, freq="ME").fit()
+        score = getattr(model_fit, criterion)
+        return None if pd.isna(score) else float(score)
+    except Exception:
+        return None
+
+def _score_level_sequential(monthly, level, criterion, deadline):
+    scores = []
+    for order, seasonal_order in level:
+        if time.monotonic() >= deadline:
+            return scores, True
+        scores.append((order, seasonal_order, score_candidate(monthly, order, seasonal_order, criterion)))
+    return scores, False
+
+def _score_level_parallel(executor, monthly, level, criterion, deadline):
+    futures = {
+        executor.submit(score_candidate, monthly, order, seasonal_order, criterion): (order, seasonal_order)
+        for order, seasonal_order in level
+    }
+    scores = []
+    pending = set(futures)
+    while pending:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            for future in pending:
+                future.cancel()
+            return scores, True
+        done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+        for future in done:
+            order, seasonal_order = futures[future]
+            scores.append((order, seasonal_order, future.result()))
+    return scores, False
+
+# --- Order Search ---
+
+def search_order(monthly, criterion=CRITERION, seasonal=True, time_budget=SEARCH_TIME_BUDGET, max_workers=MAX_WORKERS):
+    """Searches ARIMA orders by information criterion, one complexity level at a time.
+
+    Candidates of a level are fitted in parallel, or one after another when this already runs
+    inside a worker process (e.g. a batch_engine or forecast_engine worker), so pools are never
+    nested. The search stops when a level fails to improve the best score by MIN_IMPROVEMENT
+    (early termination) or when the time budget runs out. The budget is best-effort: it is checked
+    between fits, so candidates already being fitted are not interrupted and the search (or, in
+    parallel, its abandoned worker processes) can run past it by up to one fit.
+    Returns the chosen order with its score and search statistics.
+    """
+    if multiprocessing.parent_process() is not None:
+        max_workers = 1
+    deadline = time.monotonic() + time_budget
+    d = choose_differencing(monthly)
+    levels = candidate_orders(len(monthly), d, seasonal)
+
+    best = None
+    scored = 0
+    timed_out = False
+    executor = ProcessPoolExecutor(max_workers=max_workers) if max_workers > 1 else None
+    try:
+        for level in levels:
+            if executor is not None:
+                scores, timed_out = _score_level_parallel(executor, monthly, level, criterion, deadline)
+            else:
+                scores, timed_out = _score_level_sequential(monthly, level, criterion, deadline)
+            scored += len(scores)
+
+            previous_best = best[2] if best is not None else None
+            for candidate in scores:
+                if candidate[2] is not None and (best is None or candidate[2] < best[2]):
+                    best = candidate
+            if timed_out:
+                break
+            if previous_best is not None and best[2] > previous_best - MIN_IMPROVEMENT:
+                break
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    if best is None:
+        return None
+    order, seasonal_order, score = best
+    return {
+        "order": list(order),
+        "seasonal_order": list(seasonal_order),
+        "criterion": criterion,
+        "score": score,
+        "candidates_scored": scored,
+        "timed_out": timed_out,
+        "n_obs": len(monthly),
+        "searched_at": pd.Timestamp.now().strftime("%Y-%m-%d"),
+    }
+
+def order_is_fresh(entry, n_obs, criterion=CRITERION):
+    """Whether a cached order can be reused instead of searching again.
+
+    A series that got shorter is not the series the order was searched for, so it is stale too.
+    """
+    if entry is None or entry.get("criterion") != criterion:
+        return False
+    age = pd.Timestamp.now() - pd.Timestamp(entry["searched_at"])
+    return age.days < ORDER_MAX_AGE_DAYS and 0 <= n_obs - entry["n_obs"] < ORDER_MAX_NEW_MONTHS
+
+def select_order(monthly, cached_entry=None, criterion=CRITERION, max_workers=MAX_WORKERS):
+    """Returns (order entry, searched) reusing cached_entry while it is fresh; None if every fit failed."""
+    if order_is_fresh(cached_entry, len(monthly), criterion):
+        return cached_entry, False
+    return search_order(monthly, criterion, max_workers=max_workers), True
+
+def load_order_cache(path=ORDER_CACHE_PATH):
+    """Loads chosen orders keyed by series ID, or an empty cache."""
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"Warning: Could not load ARIMA order cache {path}: {e}")
+        return {}
+
+@contextlib.contextmanager
+def _cache_lock(path):
+    """Exclusive lock serializing read-merge-write cycles of the cache file across processes."""
+    with open(f"{path}.lock", "w") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def save_order_cache(entries, path=ORDER_CACHE_PATH):
+    """Merges searched orders (series ID -> entry) into the cache file atomically.
+
+    Concurrent writers (e.g. batch workers) each merge under a file lock into the current file
+    and write through their own temporary file, so no update is lost and no write is torn.
+    """
+    if not entries:
+        return
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    with _cache_lock(path):
+        cache = load_order_cache(path)
+        cache.update(entries)
+        with tempfile.NamedTemporaryFile("w", dir=directory, suffix=".tmp", delete=False) as f:
+            json.dump(cache, f, indent=2)
+        os.replace(f.name, path)
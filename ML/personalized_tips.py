@@ -1,37 +1,62 @@
 import json
-import os
 import random
+import sys
+
+from result_store import RESULT_FORMAT, find_result, read_results, write_results
+from instrumentation import configure_from_argv, instrumented, write_run_summary
 
 # --- Configuration ---
 SPENDING_ANALYSIS_FILE = "ML/spending_analysis_results.json"
 FORECAST_FILE = "ML/expense_forecast_results.json"
 SAVINGS_SUGGESTIONS_FILE = "ML/savings_suggestions_results.json"
 OUTPUT_FILE = "ML/personalized_tips_results.json"
+TIPS_SEED = 0 # Base seed for choosing among equally relevant tips; the same inputs always give the same tips
 
 # --- Helper Function ---
 def load_json_data(filepath):
-    """Loads data from a JSON file, returning None if file not found or invalid."""
-    if not os.path.exists(filepath):
+    """Loads a result file, returning None if file not found or invalid.
+
+    Reads whichever variant of the result exists (JSON, msgpack or parquet, see result_store);
+    the newest one wins if several do.
+    """
+    found = find_result(filepath)
+    if found is None:
         print(f"Warning: Input file not found: {filepath}")
         return None
+    filepath = found
     try:
-        with open(filepath, "r") as f:
-            data = json.load(f)
+        data = read_results(filepath)
         # Check for top-level error keys
         if isinstance(data, dict) and "error" in data:
              print(f"Warning: Input file {filepath} contains an error: {data['error']}")
              return None
         return data
-    except json.JSONDecodeError:
+    except (json.JSONDecodeError, ValueError):
         print(f"Warning: Could not decode JSON from file: {filepath}")
         return None
     except Exception as e:
         print(f"Warning: Error loading file {filepath}: {e}")
         return None
 
+def usable_result(results):
+    """Mirrors load_json_data for in-memory results: stage results carrying a top-level error are ignored."""
+    if isinstance(results, dict) and "error" in results:
+        return None
+    return results
+
+def tips_rng(seed=TIPS_SEED, user_id=None):
+    """Random generator seeded from the base seed and the user, stable across processes and runs."""
+    return random.Random(f"{seed}:{user_id}" if user_id is not None else seed)
+
 # --- Tip Generation Logic ---
-def generate_tips(spending_data, forecast_data, savings_data):
-    """Generates personalized tips based on analysis results."""
+@instrumented("generate_tips")
+def generate_tips(spending_data, forecast_data, savings_data, seed=TIPS_SEED, user_id=None):
+    """Generates personalized tips based on analysis results.
+
+    Takes the in-memory results of the three stages (or None); random choices are seeded
+    from seed and user_id, so the same inputs always give the same tips.
+    """
+    rng = tips_rng(seed, user_id)
     tips = []
 
     # --- Tips based on Spending Patterns & Anomalies ---
@@ -52,7 +77,7 @@ def generate_tips(spending_data, forecast_data, savings_data):
         anomalies = spending_data["anomalies"]["detected_anomalies"]
         if anomalies:
             # Select one anomaly to highlight to avoid overwhelming the user
-            anomaly = random.choice(anomalies)
+            anomaly = rng.choice(anomalies)
             tips.append({
                 "type": "anomaly_detected",
                 "severity": "warning",
@@ -127,8 +152,27 @@ def generate_tips(spending_data, forecast_data, savings_data):
 
     return {"personalized_tips": tips}
 
+def generate_tips_batch(results_by_user, seed=TIPS_SEED):
+    """Generates tips for many users in one call.
+
+    results_by_user maps user IDs to dicts with the "spending_analysis", "forecast" and "savings"
+    stage results (as returned by pipeline.run_stages); results carrying an error are skipped like
+    missing files. Returns {user_id: tips}, each seeded per user.
+    """
+    return {
+        user_id: generate_tips(
+            usable_result(results.get("spending_analysis")),
+            usable_result(results.get("forecast")),
+            usable_result(results.get("savings")),
+            seed,
+            user_id,
+        )
+        for user_id, results in results_by_user.items()
+    }
+
 # --- Main Execution ---
 if __name__ == "__main__":
+    prometheus_path = configure_from_argv() # --profile=<stage>[:tracemalloc], --prometheus=<path>
     print("Loading analysis results...")
     spending_results = load_json_data(SPENDING_ANALYSIS_FILE)
     forecast_results = load_json_data(FORECAST_FILE)
@@ -137,12 +181,13 @@ if __name__ == "__main__":
     print("Generating personalized tips...")
     final_tips = generate_tips(spending_results, forecast_results, savings_results)
 
-    # Output results as JSON
+    # Output results as JSON (or another format with --format=, see result_store)
+    result_format = next((arg.split("=", 1)[1] for arg in sys.argv if arg.startswith("--format=")), RESULT_FORMAT)
     print(f"Saving personalized tips to {OUTPUT_FILE}...")
     try:
-        with open(OUTPUT_FILE, "w") as f:
-            json.dump(final_tips, f, indent=2, default=str)
+        write_results(final_tips, OUTPUT_FILE, result_format)
         print("Personalized tips saved successfully.")
     except Exception as e:
         print(f"Error saving results to JSON: {e}")
 
+    write_run_summary(prometheus_path=prometheus_path)
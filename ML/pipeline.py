@@ -0,0 +1,150 @@
+import os
+import sys
+import traceback
+
+from ingestion import CRED_PATH, COLLECTION_NAME, fetch_and_preprocess_data, fetch_and_preprocess_chunked, parse_date_range
+from snapshot_cache import fetch_and_preprocess_incremental
+from spending_analysis import analyze_spending_cells, detect_anomalies_iqr
+from expense_forecasting import forecast_expenses_cells
+from savings_suggestions import suggest_savings_cells
+from personalized_tips import TIPS_SEED, generate_tips, usable_result
+from rollup import aggregate_cells, sync_rollup
+from result_store import RESULT_FORMAT, write_results
+from data_sources import source_from_argv
+from instrumentation import configure_from_argv, write_run_summary
+from result_cache import enable_from_argv
+
+# --- Configuration ---
+SPENDING_ANALYSIS_FILE = "ML/spending_analysis_results.json"
+FORECAST_FILE = "ML/expense_forecast_results.json"
+SAVINGS_SUGGESTIONS_FILE = "ML/savings_suggestions_results.json"
+TIPS_FILE = "ML/personalized_tips_results.json"
+
+# --- Helper Functions ---
+
+def save_results(results, output_path, fmt=RESULT_FORMAT):
+    """Writes one stage's results, as JSON matching the standalone scripts' output by default."""
+    print(f"Saving results to {output_path}...")
+    try:
+        write_results(results, output_path, fmt)
+        print("Results saved successfully.")
+    except Exception as e:
+        print(f"Error saving results to JSON: {e}")
+
+# --- Pipeline ---
+
+def _error_results(message):
+    """Results of a run that produced no analysis; the tips stage still runs with no inputs."""
+    error = {"error": message}
+    return {
+        "spending_analysis": dict(error),
+        "forecast": dict(error),
+        "savings": dict(error),
+        "tips": generate_tips(None, None, None),
+    }
+
+def run_stages_on_cells(cells, anomalies, savings_results=None, user_id=None):
+    """Runs every analysis stage on (year_month, category) cells plus precomputed anomalies.
+
+    savings_results may be precomputed for many users at once (see suggest_savings_batch).
+    Tips are generated in-process from the stage results, seeded per user_id.
+    """
+    print("Analyzing spending patterns...")
+    spending_results = {
+        "spending_patterns": analyze_spending_cells(cells),
+        "anomalies": anomalies,
+    }
+
+    print("Forecasting future expenses...")
+    forecast_results = forecast_expenses_cells(cells, series_id=user_id)
+
+    if savings_results is None:
+        print("Generating savings suggestions...")
+        savings_results = suggest_savings_cells(cells)
+
+    print("Generating personalized tips...")
+    tips_results = generate_tips(usable_result(spending_results), usable_result(forecast_results), usable_result(savings_results), TIPS_SEED, user_id)
+
+    return {
+        "spending_analysis": spending_results,
+        "forecast": forecast_results,
+        "savings": savings_results,
+        "tips": tips_results,
+    }
+
+def run_stages(df_processed, savings_results=None, user_id=None):
+    """Runs every analysis stage and the tips stage on one preprocessed DataFrame.
+
+    The transactions are aggregated into cells once and every stage except anomaly
+    detection answers from those.
+    """
+    if df_processed.empty:
+        return _error_results("No valid expense data found for analysis.")
+
+    print("Detecting anomalies...")
+    anomalies = detect_anomalies_iqr(df_processed)
+    return run_stages_on_cells(aggregate_cells(df_processed), anomalies, savings_results, user_id)
+
+def run_stages_from_rollup(rollup, user_id=None):
+    """Runs every stage from a SpendingRollup without touching transactions.
+
+    Anomalies are the rollup's online flags (each transaction scored against the user's
+    history when it arrived) rather than a batch IQR pass.
+    """
+    cells = rollup.cells(user_id)
+    if cells.empty:
+        return _error_results("No valid expense data found for analysis.")
+    return run_stages_on_cells(cells, rollup.detected_anomalies(user_id), user_id=user_id)
+
+def run_pipeline(cred_path=CRED_PATH, collection_name=COLLECTION_NAME, incremental=False, chunked=False, use_rollup=False, source=None,
+                 date_range=None):
+    """Fetches the collection once and runs all ML stages on the shared DataFrame.
+
+    With incremental=True the fetch goes through the local snapshot cache and only
+    reads documents changed since the previous sync. With chunked=True the collection
+    is paged through so raw-document memory stays bounded by the page size. With
+    use_rollup=True only the changes are applied to the persisted rollup and the
+    stages answer from it. A data source (see data_sources) replaces Firestore for
+    the full and chunked fetches; the incremental and rollup modes need Firestore.
+    date_range limits the full and chunked fetches to expenses in an inclusive (start, end) range.
+    """
+    try:
+        print("Starting data fetching and preprocessing...")
+        if use_rollup:
+            return run_stages_from_rollup(sync_rollup(cred_path, collection_name))
+        if incremental:
+            df_processed = fetch_and_preprocess_incremental(cred_path, collection_name)
+        elif chunked:
+            df_processed = fetch_and_preprocess_chunked(cred_path, collection_name, source=source, date_range=date_range)
+        else:
+            df_processed = fetch_and_preprocess_data(cred_path, collection_name, source=source, date_range=date_range)
+        return run_stages(df_processed)
+    except FileNotFoundError as e:
+        print(f"Error: {e}")
+        message = str(e)
+    except ValueError as e:
+        print(f"Data Error: {e}")
+        message = f"Data Error: {e}"
+    except Exception as e:
+        print(f"An unexpected error occurred: {e}")
+        print(f"Traceback: {traceback.format_exc()}")
+        message = f"An unexpected error occurred: {e}"
+
+    return _error_results(message)
+
+# --- Main Execution ---
+if __name__ == "__main__":
+    prometheus_path = configure_from_argv() # --profile=<stage>[:tracemalloc], --prometheus=<path>
+    enable_from_argv() # Reuses stored stage results for unchanged data; --no-result-cache recomputes everything
+    print(f"Current working directory: {os.getcwd()}")
+    results = run_pipeline(CRED_PATH, COLLECTION_NAME, incremental="--incremental" in sys.argv, chunked="--chunked" in sys.argv,
+                           use_rollup="--rollup" in sys.argv, source=source_from_argv(sys.argv),
+                           date_range=parse_date_range(next((arg.split("=", 1)[1] for arg in sys.argv if arg.startswith("--date-range=")), None)))
+
+    result_format = next((arg.split("=", 1)[1] for arg in sys.argv if arg.startswith("--format=")), RESULT_FORMAT)
+    save_results(results["spending_analysis"], SPENDING_ANALYSIS_FILE, result_format)
+    save_results(results["forecast"], FORECAST_FILE, result_format)
+    save_results(results["savings"], SAVINGS_SUGGESTIONS_FILE, result_format)
+    save_results(results["tips"], TIPS_FILE, result_format)
+
+    write_run_summary(prometheus_path=prometheus_path)
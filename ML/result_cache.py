@@ -0,0 +1,196 @@
+import pandas as pd
+import contextlib
+import functools
+import hashlib
+import importlib
+import inspect
+import os
+import pickle
+import sys
+import threading
+
+from instrumentation import add_count
+
+# --- Configuration ---
+RESULT_CACHE_ENABLED = False # Off for library callers; the scheduled entry points turn it on (see enable_from_argv)
+RESULT_CACHE_DIR = "ML/cache/results"
+RESULT_CACHE_MAX_BYTES = 512 * 1024 ** 2 # Least recently used results are evicted beyond this size
+RESULT_CACHE_EVICT_TO = 0.9 # Eviction trims the cache to this fraction of the limit, so it runs rarely
+RESULT_CACHE_VERSION = 1 # Bump when a cached stage's code changes its output, to invalidate every entry
+
+# Stage results are content-addressed: the key hashes the stage, the fingerprint of its input
+# frame (a user's or partition's preprocessed transactions or cells), its other arguments and
+# the config constants it reads, including those of the modules it calls into. A user whose data
+# did not change since the last run gets the stored result without the stage running. Entries
+# are pickled files whose modification time is bumped on every hit; eviction removes the oldest.
+
+# --- Helper Functions ---
+
+def fingerprint(frame):
+    """Content hash of a DataFrame: column names, dtypes and values in row order (the index is ignored)."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr([(str(column), str(dtype)) for column, dtype in frame.dtypes.items()]).encode())
+    digest.update(pd.util.hash_pandas_object(frame, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+def _config_value(func, name):
+    """A constant of the decorated function's module ("NAME") or of another module ("module.NAME"), read now."""
+    module_name, _, attribute = name.rpartition(".")
+    namespace = vars(importlib.import_module(module_name)) if module_name else func.__globals__
+    return namespace[attribute]
+
+def _entry_path(directory, key):
+    return os.path.join(directory, key[:2], f"{key}.pkl")
+
+# --- Result Cache ---
+
+class ResultCache:
+    """Size-bounded LRU store of stage results on local disk, safe to share between processes."""
+
+    def __init__(self, directory=RESULT_CACHE_DIR, max_bytes=RESULT_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.estimated_bytes = None # Size at the last scan plus bytes written since, per process
+
+    def get(self, key):
+        """The stored result for a key, or None on a miss."""
+        path = _entry_path(self.directory, key)
+        try:
+            with open(path, "rb") as f:
+                result = pickle.load(f)
+            os.utime(path) # Marks the entry as recently used
+            return result
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Discarding unreadable cached result {path}: {e}")
+            with contextlib.suppress(OSError):
+                os.remove(path)
+            return None
+
+    def put(self, key, result):
+        path = _entry_path(self.directory, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        staging = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(staging, "wb") as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        size = os.path.getsize(staging)
+        os.replace(staging, path)
+
+        with self.lock:
+            if self.estimated_bytes is None:
+                self.estimated_bytes = self._scan_bytes()
+            else:
+                self.estimated_bytes += size
+            if self.estimated_bytes > self.max_bytes:
+                self.evict()
+
+    def _entries(self):
+        """(mtime, size, path) of every stored result."""
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".pkl"):
+                    path = os.path.join(root, name)
+                    with contextlib.suppress(OSError): # Removed by another process meanwhile
+                        stat = os.stat(path)
+                        entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _scan_bytes(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self):
+        """Removes least recently used results until the cache is below RESULT_CACHE_EVICT_TO of its limit."""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * RESULT_CACHE_EVICT_TO
+        removed = 0
+        for _, size, path in entries:
+            if total <= target:
+                break
+            with contextlib.suppress(OSError):
+                os.remove(path)
+                removed += 1
+            total -= size
+        self.estimated_bytes = total
+        if removed:
+            add_count("result_cache_evictions", removed)
+
+    def clear(self):
+        for _, _, path in self._entries():
+            with contextlib.suppress(OSError):
+                os.remove(path)
+        self.estimated_bytes = 0
+
+_cache = ResultCache()
+
+def get_cache():
+    return _cache
+
+def enable_from_argv(argv=sys.argv):
+    """Turns the cache on for a scheduled run unless --no-result-cache is given; returns whether it is on."""
+    global RESULT_CACHE_ENABLED
+    RESULT_CACHE_ENABLED = "--no-result-cache" not in argv
+    return RESULT_CACHE_ENABLED
+
+@contextlib.contextmanager
+def bypass():
+    """Runs stages without reading or writing the cache (e.g. when timing them)."""
+    global RESULT_CACHE_ENABLED
+    enabled, RESULT_CACHE_ENABLED = RESULT_CACHE_ENABLED, False
+    try:
+        yield
+    finally:
+        RESULT_CACHE_ENABLED = enabled
+
+# --- Core Functions ---
+
+def cached_stage(stage, config=(), key_extra=None):
+    """Decorator serving a stage's result from the cache when its input and configuration are unchanged.
+
+    The first argument must be a DataFrame; it is fingerprinted. config names the constants the
+    result depends on, read at call time: "NAME" in the decorated function's module or
+    "module.NAME" in a module it calls into. key_extra(arguments) may add values the
+    result depends on that are not arguments (e.g. the current month). The wrapper's
+    cache_key(*args, **kwargs) returns the key a call would use.
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        def cache_key(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            arguments = dict(bound.arguments)
+            frame = arguments.pop(next(iter(signature.parameters)))
+            parts = [
+                stage,
+                RESULT_CACHE_VERSION,
+                fingerprint(frame),
+                sorted((name, repr(value)) for name, value in arguments.items()),
+                [(name, repr(_config_value(func, name))) for name in config],
+                repr(key_extra(bound.arguments)) if key_extra else None,
+            ]
+            return hashlib.blake2b(repr(parts).encode(), digest_size=20).hexdigest()
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not RESULT_CACHE_ENABLED:
+                return func(*args, **kwargs)
+            key = cache_key(*args, **kwargs)
+            result = _cache.get(key)
+            if result is not None:
+                add_count("result_cache_hits")
+                return result
+            add_count("result_cache_misses")
+            result = func(*args, **kwargs)
+            try:
+                _cache.put(key, result)
+            except OSError as e:
+                print(f"Could not cache the {stage} result: {e}")
+            return result
+
+        wrapper.cache_key = cache_key
+        return wrapper
+    return decorator
@@ -0,0 +1,171 @@
+import pandas as pd
+import numpy as np
+import json
+import os
+import shutil
+
+try:
+    import orjson
+except ImportError: # Optional; the "orjson" format falls back to compact stdlib JSON without it
+    orjson = None
+try:
+    import msgpack
+except ImportError: # Optional; only needed for the "msgpack" format
+    msgpack = None
+
+# --- Configuration ---
+RESULT_FORMAT = "json" # "json" (indented, as before), "orjson" (compact JSON), "msgpack" or "parquet"
+RESULT_FORMATS = ("json", "orjson", "msgpack", "parquet")
+FORMAT_EXTENSIONS = {"json": ".json", "orjson": ".json", "msgpack": ".msgpack", "parquet": ".parquet"}
+PARQUET_MIN_ROWS = 2 # Shorter record lists stay inline in the parquet format's document
+TABLE_MARKER = "__table__" # Placeholder for a record list stored as a Parquet file
+DOCUMENT_NAME = "document.json" # Nested (non-tabular) part of a parquet-format result
+DOCUMENT_VERSION = 2 # Tables are named by index; document.json maps each to its key path
+
+# Results are nested dicts whose bulky parts are lists of flat records (monthly_spending,
+# spending_by_category, detected_anomalies, forecasts...). The parquet format stores each
+# such list as a Parquet file inside a "<name>.parquet" directory and the rest as JSON. Table
+# files are named table_<n> rather than after their key path: keys include free-text category
+# names (e.g. "Food/Drinks" or "../x") that are not safe file names.
+
+# --- Helper Functions ---
+
+def _to_serializable(value):
+    """Fallback for values the encoders do not handle natively, mirroring json.dump(default=str)."""
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+def result_path(base_path, fmt=RESULT_FORMAT):
+    """Path a result is written to in a format: base_path with the format's extension."""
+    stem, _ = os.path.splitext(base_path)
+    return stem + FORMAT_EXTENSIONS[fmt]
+
+def _is_table(value):
+    """Whether a value is a list of flat records worth storing as a Parquet table."""
+    return (
+        isinstance(value, list)
+        and len(value) >= PARQUET_MIN_ROWS
+        and all(isinstance(item, dict) for item in value)
+        and all(not isinstance(field, (dict, list)) for item in value for field in item.values())
+    )
+
+def _split_tables(value, tables, path=()):
+    """Replaces every record list in a nested result with a table placeholder.
+
+    Collects {table name: (key path, records)}.
+    """
+    if _is_table(value):
+        name = f"table_{len(tables)}"
+        tables[name] = (list(path), value)
+        return {TABLE_MARKER: name}
+    if isinstance(value, dict):
+        return {key: _split_tables(item, tables, path + (str(key),)) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_split_tables(item, tables, path + (str(i),)) for i, item in enumerate(value)]
+    return value
+
+def _join_tables(value, directory):
+    """Inverse of _split_tables: loads each table placeholder back into a list of records."""
+    if isinstance(value, dict):
+        if set(value) == {TABLE_MARKER}:
+            name = str(value[TABLE_MARKER])
+            if os.path.basename(name) != name or name in ("", ".", ".."):
+                raise ValueError(f"Invalid table name '{name}' in {os.path.join(directory, DOCUMENT_NAME)}.")
+            table = pd.read_parquet(os.path.join(directory, f"{name}.parquet"))
+            table = table.astype(object).where(table.notna(), None)
+            return table.to_dict(orient="records")
+        return {key: _join_tables(item, directory) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_join_tables(item, directory) for item in value]
+    return value
+
+def _table_frame(records):
+    """Record list as a DataFrame; mixed-type columns are stored as strings like default=str would."""
+    frame = pd.DataFrame.from_records(records)
+    for column in frame.select_dtypes(include="object").columns:
+        kinds = set(frame[column].dropna().map(type))
+        if not (kinds <= {str} or kinds <= {bool}):
+            frame[column] = frame[column].map(str).where(frame[column].notna(), None)
+    return frame
+
+# --- Writers ---
+
+def _write_json(results, path):
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2, default=str)
+
+def _write_orjson(results, path):
+    if orjson is None:
+        with open(path, "w") as f:
+            json.dump(results, f, separators=(",", ":"), default=str)
+        return
+    with open(path, "wb") as f:
+        f.write(orjson.dumps(results, default=_to_serializable, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS))
+
+def _write_msgpack(results, path):
+    if msgpack is None:
+        raise ImportError("The 'msgpack' result format requires the msgpack package.")
+    with open(path, "wb") as f:
+        f.write(msgpack.packb(results, default=_to_serializable, use_bin_type=True))
+
+def _write_parquet(results, path):
+    tables = {}
+    document = _split_tables(results, tables)
+    staging = f"{path}.tmp"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    for name, (_, records) in tables.items():
+        _table_frame(records).to_parquet(os.path.join(staging, f"{name}.parquet"), index=False)
+    with open(os.path.join(staging, DOCUMENT_NAME), "w") as f:
+        json.dump({
+            "version": DOCUMENT_VERSION,
+            "tables": {name: key_path for name, (key_path, _) in tables.items()},
+            "result": document,
+        }, f, default=str)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(staging, path)
+
+WRITERS = {"json": _write_json, "orjson": _write_orjson, "msgpack": _write_msgpack, "parquet": _write_parquet}
+
+def write_results(results, base_path, fmt=RESULT_FORMAT):
+    """Writes a result dict in the chosen format; returns the path actually written."""
+    if fmt not in WRITERS:
+        raise ValueError(f"Unknown result format '{fmt}'. Expected one of {RESULT_FORMATS}.")
+    path = result_path(base_path, fmt)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    WRITERS[fmt](results, path)
+    return path
+
+# --- Readers ---
+
+def read_results(path):
+    """Reads a result written by write_results in any format, detected from the path."""
+    if os.path.isdir(path):
+        with open(os.path.join(path, DOCUMENT_NAME), "r") as f:
+            document = json.load(f)
+        if isinstance(document, dict) and document.get("version") == DOCUMENT_VERSION and "result" in document:
+            document = document["result"]
+        # Earlier directories hold the result itself, with tables named after their key path
+        return _join_tables(document, path)
+    if path.endswith(".msgpack"):
+        if msgpack is None:
+            raise ImportError(f"Reading {path} requires the msgpack package.")
+        with open(path, "rb") as f:
+            return msgpack.unpackb(f.read(), raw=False, strict_map_key=False)
+    with open(path, "rb") as f:
+        data = f.read()
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass # json.dump writes NaN/Infinity literals that orjson rejects
+    return json.loads(data)
+
+def find_result(base_path):
+    """The newest existing variant of a result (any format) for a base path, or None."""
+    candidates = {result_path(base_path, fmt) for fmt in RESULT_FORMATS}
+    existing = [path for path in candidates if os.path.exists(path)]
+    if not existing:
+        return None
+    return max(existing, key=os.path.getmtime)
@@ -0,0 +1,223 @@
+import pandas as pd
+import json
+import os
+import sys
+
+from ingestion import CRED_PATH, COLLECTION_NAME, USER_ID_FIELD
+from online_anomalies import OnlineIQRDetector
+from snapshot_cache import sync_snapshot, preprocess_snapshot
+from instrumentation import instrumented
+
+# --- Configuration ---
+ROLLUP_DIR = "ML/cache"
+CELL_KEYS = ["year_month", "category"]
+UNASSIGNED_USER_ID = "__unassigned__" # Bucket for transactions without a userId; Firestore reserves __.*__ IDs, so no real user has it
+ROLLUP_VERSION = 2 # Bumped when the persisted layout or keys change; older rollups are rebuilt
+MAX_ANOMALIES_PER_USER = 100 # Most recent flagged transactions kept per user
+ANOMALY_FIELDS = ["id", USER_ID_FIELD, "date", "amount", "category", "year_month"]
+
+# A "cells" frame is the unit every analysis stage can answer from: one row per
+# (year_month, category) with the expense sum in "amount" and the transaction count in
+# "count". Its size grows with months × categories, not with transactions.
+
+# --- Helper Functions ---
+
+@instrumented("aggregate_cells")
+def aggregate_cells(df, by_user=False):
+    """Aggregates preprocessed transactions into cells with a single groupby.
+
+    With by_user the cells are also keyed by user (missing user IDs go to UNASSIGNED_USER_ID).
+    """
+    keys = [df[key] for key in CELL_KEYS]
+    if by_user:
+        user_ids = df[USER_ID_FIELD].astype(str).where(df[USER_ID_FIELD].notna(), UNASSIGNED_USER_ID)
+        keys = [user_ids.rename(USER_ID_FIELD)] + keys
+    cells = df.groupby(keys, observed=True)["amount"].agg(amount="sum", count="size")
+    return cells.reset_index()
+
+def _anomaly_record(row, reason):
+    """Transaction fields kept for a flagged transaction, in JSON-ready form."""
+    record = {field: row[field] for field in ANOMALY_FIELDS if field in row}
+    if "date" in record:
+        record["date"] = record["date"].strftime("%Y-%m-%d")
+    if "year_month" in record:
+        record["year_month"] = str(record["year_month"])
+    record["amount"] = float(record["amount"])
+    record["anomaly_reason"] = reason
+    return record
+
+# --- Rollup ---
+
+class SpendingRollup:
+    """Materialized (user, year_month, category) → sum/count rollup with per-user quantile sketches.
+
+    Built once from the transaction history, then kept current with add()/remove() as
+    transactions arrive, change or are deleted, and persisted between runs. Per-user
+    OnlineIQRDetector sketches score each added transaction against that user's history
+    before recording it; flagged transactions are kept as the rollup's anomalies.
+    """
+
+    def __init__(self, table=None, detectors=None, anomalies=None, meta=None):
+        index = pd.MultiIndex.from_arrays([[], pd.PeriodIndex([], freq="M"), []], names=[USER_ID_FIELD] + CELL_KEYS)
+        self.table = table if table is not None else pd.DataFrame({"amount": pd.Series(dtype="float64"), "count": pd.Series(dtype="int64")}, index=index)
+        self.detectors = detectors if detectors is not None else {}
+        self.anomalies = anomalies if anomalies is not None else {}
+        self.meta = meta if meta is not None else {}
+
+    @classmethod
+    def from_frame(cls, df):
+        """Builds the rollup from preprocessed transactions."""
+        rollup = cls()
+        if not df.empty:
+            rollup.add(df)
+        return rollup
+
+    # --- Incremental Updates ---
+
+    def _user_keys(self, df):
+        if USER_ID_FIELD not in df.columns:
+            return pd.Series(UNASSIGNED_USER_ID, index=df.index)
+        return df[USER_ID_FIELD].astype(str).where(df[USER_ID_FIELD].notna(), UNASSIGNED_USER_ID)
+
+    def _apply_cells(self, df, sign):
+        frame = df.assign(**{USER_ID_FIELD: self._user_keys(df)})
+        delta = aggregate_cells(frame, by_user=True)
+        delta["category"] = delta["category"].astype(str)
+        delta = delta.set_index([USER_ID_FIELD] + CELL_KEYS)
+        table = self.table.add(sign * delta, fill_value=0)
+        table = table[table["count"] > 0]
+        table["count"] = table["count"].round().astype("int64")
+        self.table = table.sort_index()
+
+    def add(self, df):
+        """Adds new preprocessed transactions: cell sums/counts, sketches and anomaly flags."""
+        if df.empty:
+            return self
+        self._apply_cells(df, 1)
+
+        if "date" in df.columns:
+            df = df.sort_values("date", kind="stable")
+        for user_id, row in zip(self._user_keys(df), df.to_dict(orient="records")):
+            detector = self.detectors.setdefault(user_id, OnlineIQRDetector())
+            category = str(row["category"])
+            result = detector.score_and_update(category, row["amount"])
+            if result["is_anomaly"]:
+                flagged = self.anomalies.setdefault(user_id, [])
+                flagged.append(_anomaly_record(row, result["anomaly_reason"]))
+                del flagged[:-MAX_ANOMALIES_PER_USER]
+        return self
+
+    def remove(self, df):
+        """Removes deleted (or the previous version of edited) preprocessed transactions.
+
+        Cell sums and counts are exact. Quantile sketches cannot forget values, so bounds keep
+        the removed amounts until the rollup is rebuilt; their flags are dropped.
+        """
+        if df.empty:
+            return self
+        self._apply_cells(df, -1)
+        if "id" in df.columns:
+            removed_ids = set(df["id"].astype(str))
+            for user_id, flagged in self.anomalies.items():
+                self.anomalies[user_id] = [a for a in flagged if str(a.get("id")) not in removed_ids]
+        return self
+
+    # --- Queries ---
+
+    def users(self):
+        """User IDs present in the rollup."""
+        return self.table.index.get_level_values(USER_ID_FIELD).unique().tolist()
+
+    def cells(self, user_id=None):
+        """Cells frame for one user, or summed across all users when user_id is None."""
+        if user_id is None:
+            table = self.table.groupby(level=CELL_KEYS).sum()
+        elif user_id in self.users():
+            table = self.table.xs(user_id, level=USER_ID_FIELD)
+        else:
+            table = self.table.iloc[:0].droplevel(USER_ID_FIELD)
+        return table.reset_index()
+
+    def detected_anomalies(self, user_id=None):
+        """Flagged transactions in detect_anomalies_iqr's output shape (per-user bounds)."""
+        if user_id is not None:
+            return {"detected_anomalies": list(self.anomalies.get(user_id, []))}
+        return {"detected_anomalies": [a for user in sorted(self.anomalies) for a in self.anomalies[user]]}
+
+    # --- Persistence ---
+
+    def save(self, name=COLLECTION_NAME, rollup_dir=ROLLUP_DIR):
+        """Writes the cells (Parquet) and the sketches, anomalies and metadata (JSON) atomically."""
+        os.makedirs(rollup_dir, exist_ok=True)
+        data_path, state_path = rollup_paths(name, rollup_dir)
+        table = self.table.reset_index()
+        table["year_month"] = table["year_month"].astype(str)
+        table.to_parquet(f"{data_path}.tmp", index=False)
+        state = {
+            "version": ROLLUP_VERSION,
+            "meta": self.meta,
+            "detectors": {user_id: detector.to_dict() for user_id, detector in self.detectors.items()},
+            "anomalies": self.anomalies,
+        }
+        with open(f"{state_path}.tmp", "w") as f:
+            json.dump(state, f, default=str)
+        os.replace(f"{data_path}.tmp", data_path)
+        os.replace(f"{state_path}.tmp", state_path)
+
+    @classmethod
+    def load(cls, name=COLLECTION_NAME, rollup_dir=ROLLUP_DIR):
+        """Loads a persisted rollup, or returns None if there is none (or it is unreadable)."""
+        data_path, state_path = rollup_paths(name, rollup_dir)
+        if not (os.path.exists(data_path) and os.path.exists(state_path)):
+            return None
+        try:
+            table = pd.read_parquet(data_path)
+            table["year_month"] = pd.PeriodIndex(table["year_month"], freq="M")
+            table = table.set_index([USER_ID_FIELD] + CELL_KEYS)
+            with open(state_path, "r") as f:
+                state = json.load(f)
+        except Exception as e:
+            print(f"Warning: Could not load rollup for '{name}', rebuilding: {e}")
+            return None
+        if state.get("version") != ROLLUP_VERSION:
+            print(f"Rollup for '{name}' was written by an older version, rebuilding.")
+            return None
+        detectors = {user_id: OnlineIQRDetector.from_dict(detector) for user_id, detector in state["detectors"].items()}
+        return cls(table, detectors, state["anomalies"], state["meta"])
+
+def rollup_paths(name, rollup_dir=ROLLUP_DIR):
+    """Returns the (parquet, state) paths of a persisted rollup."""
+    base = os.path.join(rollup_dir, f"{name}_rollup")
+    return f"{base}.parquet", f"{base}.json"
+
+# --- Core Functions ---
+
+def sync_rollup(cred_path, collection_name, rollup_dir=ROLLUP_DIR, full_refresh=False):
+    """Brings the persisted rollup up to date through the incremental snapshot sync.
+
+    Only documents added, changed or deleted since the last sync are applied. The rollup
+    is rebuilt from the full snapshot on a cold start or when it missed a sync.
+    """
+    rollup = None if full_refresh else SpendingRollup.load(collection_name, rollup_dir)
+    df, changes, meta = sync_snapshot(cred_path, collection_name, full_refresh=full_refresh, return_changes=True)
+
+    in_step = rollup is not None and changes is not None and rollup.meta.get("synced_at") == changes["previous_synced_at"]
+    if in_step:
+        print(f"Updating rollup: {len(changes['added'])} added/changed and {len(changes['removed'])} removed documents.")
+        rollup.remove(preprocess_snapshot(changes["removed"]))
+        rollup.add(preprocess_snapshot(changes["added"]))
+    else:
+        print("Building rollup from the full snapshot...")
+        rollup = SpendingRollup.from_frame(preprocess_snapshot(df))
+
+    # A sync without changes keeps the data version, and the rollup is not rewritten
+    if not in_step or rollup.meta.get("data_version") != meta["data_version"]:
+        rollup.meta["synced_at"] = meta["synced_at"]
+        rollup.meta["data_version"] = meta["data_version"]
+        rollup.save(collection_name, rollup_dir)
+    return rollup
+
+# --- Main Execution ---
+if __name__ == "__main__":
+    rollup = sync_rollup(CRED_PATH, COLLECTION_NAME, full_refresh="--full-refresh" in sys.argv)
+    print(f"Rollup holds {len(rollup.table)} cells for {len(rollup.users())} users.")
@@ -1,12 +1,16 @@
-import firebase_admin
-from firebase_admin import credentials, firestore
 import pandas as pd
 import numpy as np
 from datetime import datetime
 import json
 import os
+import sys
 import warnings
 
+from ingestion import USER_ID_FIELD, fetch_and_preprocess_data
+from rollup import UNASSIGNED_USER_ID, aggregate_cells
+from instrumentation import configure_from_argv, instrumented, write_run_summary
+from result_cache import cached_stage, enable_from_argv
+
 # Suppress warnings if needed (e.g., future warnings from pandas)
 warnings.simplefilter("ignore", FutureWarning)
 
@@ -17,190 +21,251 @@ COLLECTION_NAME = "transactions"
 TOP_N_CATEGORIES = 5 # Number of top spending categories to highlight
 COMPARISON_MONTHS = 3 # Number of previous months to average for comparison
 INCREASE_THRESHOLD = 0.15 # Percentage increase threshold to flag (15%)
+BACKFILL_OUTPUT_PATH = "ML/results/savings_backfill.json"
 # Define potentially discretionary categories (example list, can be customized)
 DISCRETIONARY_CATEGORIES = [
     "Restaurants", "Fast Food", "Entertainment", "Shopping", "Coffee Shops",
     "Hobbies", "Travel", "Gifts & Donations", "Personal Care", "Clothing"
 ]
 
-# --- Helper Functions (Copied/Adapted) ---
-
-def initialize_firebase(cred_path):
-    """Initializes Firebase Admin SDK if not already initialized."""
-    if not os.path.exists(cred_path):
-        raise FileNotFoundError(f"Credentials file not found at {cred_path}")
-    try:
-        firebase_admin.get_app()
-    except ValueError:
-        cred = credentials.Certificate(cred_path)
-        firebase_admin.initialize_app(cred)
-
-def safe_float_conversion(value):
-    try:
-        return float(value)
-    except (ValueError, TypeError):
-        return np.nan
-
-def safe_date_conversion(value):
-    try:
-        return pd.to_datetime(value, format="%m/%d/%Y", errors="coerce")
-    except (ValueError, TypeError):
-        return pd.NaT
-
-# --- Data Fetching and Preprocessing (Copied/Adapted) ---
-
-def fetch_and_preprocess_data(cred_path, collection_name):
-    """Fetches data from Firestore, preprocesses it, and returns a DataFrame."""
-    initialize_firebase(cred_path)
-    db = firestore.client()
-    docs = db.collection(collection_name).stream()
-    data = [doc.to_dict() for doc in docs]
+# --- Helper Functions ---
 
-    if not data:
-        print("No documents found.")
-        return pd.DataFrame()
+def _group_records(frame, keys):
+    """Splits a frame's records into {key tuple: [record, ...]} keeping the frame's order."""
+    groups = {}
+    for record in frame.to_dict(orient="records"):
+        groups.setdefault(tuple(record[key] for key in keys), []).append(record)
+    return groups
 
-    df = pd.DataFrame(data)
-    print(f"Fetched {len(df)} documents.")
+def _any_by_user(user_codes, n_users, mask):
+    """Per-user logical OR of a per-row mask (1-D) or per-row-and-month mask (2-D)."""
+    result = np.zeros((n_users,) + mask.shape[1:], dtype=bool)
+    np.logical_or.at(result, user_codes, mask)
+    return result
 
-    required_cols = ["isExpense", "amount", "date", "category"]
-    if not all(col in df.columns for col in required_cols):
-        missing = [col for col in required_cols if col not in df.columns]
-        raise ValueError(f"Missing required columns: {missing}")
+def _window_totals(values, positions, months=COMPARISON_MONTHS):
+    """Rolling sums of the `months` columns before each position, for every row at once."""
+    windows = np.lib.stride_tricks.sliding_window_view(values, months, axis=1)
+    return windows[:, positions - months].sum(axis=-1)
 
-    df["isExpense"] = df["isExpense"].astype(str).str.lower().map({"true": True, "false": False, "1": True, "0": False}).fillna(False)
-    df_expenses = df[df["isExpense"] == True].copy()
-    print(f"Filtered down to {len(df_expenses)} expense transactions.")
+def _top_details(records):
+    return [{"category": r["category"], "amount": r["amount"]} for r in records]
 
-    if df_expenses.empty:
-        print("No expense transactions found.")
-        return pd.DataFrame()
-
-    df_expenses["amount"] = df_expenses["amount"].apply(safe_float_conversion)
-    df_expenses["date"] = df_expenses["date"].apply(safe_date_conversion)
-    df_expenses.dropna(subset=["amount", "date", "category"], inplace=True)
-    df_expenses["category"] = df_expenses["category"].astype(str)
-    df_expenses.sort_values("date", inplace=True)
-    df_expenses["year_month"] = df_expenses["date"].dt.to_period("M")
-
-    print(f"Preprocessing complete. {len(df_expenses)} valid expense transactions remaining.")
-    return df_expenses
+def _as_of_month(as_of=None):
+    """The month an as-of date falls in; suggestions cover the last full month before it."""
+    return (pd.Timestamp.now() if as_of is None else pd.Timestamp(as_of)).to_period("M")
 
 # --- Savings Suggestion Functions ---
 
-def suggest_savings(df):
-    """Generates savings suggestions based on spending patterns."""
+def suggest_savings(df, by_user=False, as_of=None):
+    """Generates savings suggestions based on spending patterns.
+
+    as_of (default: now) sets the date the suggestions are generated for; only data up to
+    its month is used. With by_user, returns {user_id: suggestions} for every user in df
+    from a single pass.
+    """
     if df.empty:
         return {"error": "No data available for savings suggestions."}
+    if by_user:
+        return suggest_savings_batch(aggregate_cells(df, by_user=True), as_of)
+    return suggest_savings_cells(aggregate_cells(df), as_of)
+
+@instrumented("suggest_savings")
+@cached_stage("suggest_savings", config=("TOP_N_CATEGORIES", "COMPARISON_MONTHS", "INCREASE_THRESHOLD", "DISCRETIONARY_CATEGORIES"),
+              key_extra=lambda arguments: _as_of_month(arguments["as_of"])) # as_of=None means the current month
+def suggest_savings_cells(cells, as_of=None):
+    """Generates savings suggestions from (year_month, category) cells (see rollup)."""
+    if cells.empty:
+        return {"error": "No data available for savings suggestions."}
+    results = suggest_savings_batch(cells.assign(**{USER_ID_FIELD: UNASSIGNED_USER_ID}), as_of)
+    return results.get(UNASSIGNED_USER_ID, {"error": "No data available for savings suggestions."})
+
+@instrumented("suggest_savings_batch")
+def suggest_savings_batch(cells, as_of=None):
+    """Generates savings suggestions for every user in user-keyed cells at once; returns {user_id: result}."""
+    last_month_period = _as_of_month(as_of) - 1
+    return backfill_savings(cells, last_month_period, last_month_period).get(last_month_period.strftime("%Y-%m"), {})
+
+@instrumented("backfill_savings")
+def backfill_savings(cells, first_month, last_month):
+    """Savings suggestions for every user and every month in [first_month, last_month] in one pass.
+
+    Returns {"YYYY-MM": {user_id: result}} keyed by the month the suggestions cover; each month's
+    result equals suggest_savings_batch with as_of in the following month. The whole history is
+    pivoted once into (user, category) × month matrices; the comparison windows are rolling sums
+    over that matrix and every rule is a vectorized mask over rows × target months.
+    """
+    if cells.empty:
+        return {}
+    targets = pd.period_range(pd.Period(first_month, freq="M"), pd.Period(last_month, freq="M"), freq="M")
+    if targets.empty:
+        return {}
+
+    # One pivot covering the comparison window of the first target up to the month after the last
+    months = pd.period_range(
+        min(cells["year_month"].min(), targets[0] - COMPARISON_MONTHS),
+        max(cells["year_month"].max(), targets[-1] + 1),
+        freq="M",
+    )
+    pivot = (
+        cells.groupby([USER_ID_FIELD, "category", "year_month"], observed=True)[["amount", "count"]].sum()
+        .unstack("year_month", fill_value=0)
+    )
+    sums = pivot["amount"].reindex(columns=months, fill_value=0).to_numpy(dtype="float64")
+    counts = pivot["count"].reindex(columns=months, fill_value=0).to_numpy()
+    row_users = pivot.index.get_level_values(USER_ID_FIELD)
+    row_categories = pivot.index.get_level_values("category").astype(str)
+    user_codes, users = pd.factorize(row_users)
+
+    # Everything below is (rows × target months)
+    positions = months.get_indexer(targets)
+    present = counts > 0
+    user_present = _any_by_user(user_codes, len(users), present)
+    cumulative_sums = np.cumsum(sums, axis=1)
+    cumulative_present = np.cumsum(present, axis=1) > 0
+
+    in_last_month = present[:, positions]
+    last_month_counts = counts[:, positions]
+    last_amounts = np.where(in_last_month, sums[:, positions], 0.0)
+    # Data visible as of the month after each target (the month the suggestions are generated in)
+    overall_amounts = cumulative_sums[:, positions + 1]
+    in_overall = cumulative_present[:, positions + 1]
+    user_visible = _any_by_user(user_codes, len(users), in_overall)
+    user_has_last_month = user_present[:, positions]
+
+    in_previous = _window_totals(present, positions) > 0
+    # The previous average is over the months in which the user had any expense, like mean() over the unstacked months
+    previous_months = _window_totals(user_present, positions)[user_codes]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        previous_avg = np.where(in_previous, _window_totals(sums, positions) / previous_months, 0.0)
+        pct_change = (last_amounts - previous_avg) / previous_avg
+    # Handle division by zero or NaN if avg was 0
+    pct_change = np.where(np.isfinite(pct_change), pct_change, 0.0)
+
+    # Long format, one record per (target month, user, category)
+    n_rows = len(row_users)
+    rows = pd.DataFrame({
+        "month": np.repeat(targets.strftime("%Y-%m"), n_rows),
+        USER_ID_FIELD: np.tile(np.asarray(row_users, dtype=object), len(targets)),
+        "category": np.tile(np.asarray(row_categories, dtype=object), len(targets)),
+        "amount": last_amounts.ravel(order="F"),
+        "previous_avg": previous_avg.ravel(order="F"),
+        "pct_change": pct_change.ravel(order="F"),
+        "last_month_count": last_month_counts.ravel(order="F"),
+    })
+    keys = ["month", USER_ID_FIELD]
+
+    # 1. Top Spending Categories (Last Month)
+    top_rows = rows[in_last_month.ravel(order="F")].sort_values(keys + ["amount"], ascending=[True, True, False], kind="stable")
+    top_by_user = _group_records(top_rows.groupby(keys, sort=False).head(TOP_N_CATEGORIES), keys)
+
+    # 2. Significant increases vs. the previous average (only users with both last month and earlier data)
+    increases = user_has_last_month[user_codes] & (previous_months > 0) & (pct_change > INCREASE_THRESHOLD) & (last_amounts > 0) # Ensure increase is meaningful
+    increase_rows = rows[increases.ravel(order="F")].sort_values(keys + ["pct_change"], ascending=[True, True, False], kind="stable")
+    increases_by_user = _group_records(increase_rows, keys)
+
+    # 3. Frequent Small Purchases (Example for 'Fast Food')
+    fast_food = (row_categories == "Fast Food")[:, np.newaxis] & (last_month_counts > 5) # Example threshold
+    fast_food_by_user = _group_records(rows[fast_food.ravel(order="F")], keys)
+
+    # Users without last-month data fall back to their overall top categories
+    fallback = (in_overall & ~user_has_last_month[user_codes]).ravel(order="F")
+    overall_rows = rows[fallback].assign(amount=overall_amounts.ravel(order="F")[fallback])
+    overall_rows = overall_rows.sort_values(keys + ["amount"], ascending=[True, True, False], kind="stable")
+    overall_by_user = _group_records(overall_rows.groupby(keys, sort=False).head(TOP_N_CATEGORIES), keys)
 
+    results = {}
+    for t, period in enumerate(targets):
+        month = period.strftime("%Y-%m")
+        month_results = results.setdefault(month, {})
+        for u in np.flatnonzero(user_visible[:, t]):
+            user_id = users[u]
+            key = (month, user_id)
+            month_results[user_id] = {"savings_suggestions": _build_suggestions(
+                period,
+                top_by_user.get(key),
+                overall_by_user.get(key, []),
+                increases_by_user.get(key, []),
+                fast_food_by_user.get(key, []),
+            )}
+    return results
+
+def _build_suggestions(last_month_period, top_categories, overall_top, increases, fast_food):
+    """Turns one user's flagged rows for one month into the suggestion records."""
     suggestions = []
-    now = pd.Timestamp.now()
-    current_month_period = now.to_period("M")
-    last_month_period = current_month_period - 1
-
-    # Ensure we have data for the last completed month
-    if last_month_period not in df["year_month"].unique():
+    if top_categories is None:
         suggestions.append({
             "type": "info",
-            "message": f"Insufficient data for the most recent full month {last_month_period.strftime('%Y-%m')} to generate detailed savings suggestions." # Corrected f-string
+            "message": f"Insufficient data for the most recent full month {last_month_period.strftime('%Y-%m')} to generate detailed savings suggestions."
         })
-        # Still provide overall top categories if possible
-        if not df.empty:
-            total_spending = df["amount"].sum()
-            category_spending = df.groupby("category")["amount"].sum().sort_values(ascending=False)
-            top_categories = category_spending.head(TOP_N_CATEGORIES)
-            suggestions.append({
-                "type": "top_categories_overall",
-                "message": f"Your overall top {TOP_N_CATEGORIES} spending categories are: {', '.join(top_categories.index.tolist())}. Reviewing these might reveal savings opportunities.",
-                "details": top_categories.reset_index().to_dict(orient="records")
-            })
-        return {"savings_suggestions": suggestions}
-
-    # 1. Identify Top Spending Categories (Last Month)
-    last_month_df = df[df["year_month"] == last_month_period]
-    if not last_month_df.empty:
-        last_month_total = last_month_df["amount"].sum()
-        category_spending_last_month = last_month_df.groupby("category")["amount"].sum().sort_values(ascending=False)
-        top_categories_last_month = category_spending_last_month.head(TOP_N_CATEGORIES)
+        suggestions.append({
+            "type": "top_categories_overall",
+            "message": f"Your overall top {TOP_N_CATEGORIES} spending categories are: {', '.join(r['category'] for r in overall_top)}. Reviewing these might reveal savings opportunities.",
+            "details": _top_details(overall_top)
+        })
+        return suggestions
+
+    suggestions.append({
+        "type": "top_categories_last_month",
+        "message": f"In {last_month_period.strftime('%B %Y')}, your top {len(top_categories)} spending categories were: {', '.join(r['category'] for r in top_categories)}. Consider reviewing these areas.",
+        "details": _top_details(top_categories)
+    })
 
+    # Highlight discretionary spending within top categories
+    top_discretionary = [r for r in top_categories if r["category"] in DISCRETIONARY_CATEGORIES]
+    if top_discretionary:
         suggestions.append({
-            "type": "top_categories_last_month",
-            "message": f"In {last_month_period.strftime('%B %Y')}, your top {len(top_categories_last_month)} spending categories were: {', '.join(top_categories_last_month.index.tolist())}. Consider reviewing these areas.", # Corrected f-string
-            "details": top_categories_last_month.reset_index().to_dict(orient="records")
+            "type": "top_discretionary",
+            "message": f"Among your top spending areas last month, these are often considered discretionary: {', '.join(r['category'] for r in top_discretionary)}. Reducing spending here could lead to savings.",
+            "details": _top_details(top_discretionary)
         })
 
-        # Highlight discretionary spending within top categories
-        top_discretionary = top_categories_last_month[top_categories_last_month.index.isin(DISCRETIONARY_CATEGORIES)]
-        if not top_discretionary.empty:
-             suggestions.append({
-                "type": "top_discretionary",
-                "message": f"Among your top spending areas last month, these are often considered discretionary: {', '.join(top_discretionary.index.tolist())}. Reducing spending here could lead to savings.",
-                "details": top_discretionary.reset_index().to_dict(orient="records")
-            })
-
-    # 2. Compare Last Month vs. Previous Average
-    comparison_start_period = last_month_period - COMPARISON_MONTHS
-    comparison_df = df[(df["year_month"] >= comparison_start_period) & (df["year_month"] < last_month_period)]
-
-    if not comparison_df.empty and not last_month_df.empty:
-        avg_monthly_spending_prev = comparison_df.groupby(["year_month", "category"])["amount"].sum().unstack(fill_value=0).mean()
-        category_spending_last_month_series = last_month_df.groupby("category")["amount"].sum()
-
-        comparison = pd.DataFrame({
-            "last_month": category_spending_last_month_series,
-            "previous_avg": avg_monthly_spending_prev
-        }).fillna(0)
-        comparison["change"] = comparison["last_month"] - comparison["previous_avg"]
-        comparison["pct_change"] = (comparison["change"] / comparison["previous_avg"])
-        # Handle division by zero or NaN if avg was 0
-        comparison["pct_change"].replace([np.inf, -np.inf], np.nan, inplace=True)
-        comparison["pct_change"].fillna(0, inplace=True)
-
-        # Identify significant increases
-        significant_increases = comparison[(comparison["pct_change"] > INCREASE_THRESHOLD) & (comparison["last_month"] > 0)] # Ensure increase is meaningful
-        significant_increases = significant_increases.sort_values("pct_change", ascending=False)
-
-        if not significant_increases.empty:
-            for category, row in significant_increases.iterrows():
-                suggestions.append({
-                    "type": "spending_increase",
-                    "category": category,
-                    "message": f"Spending in \"{category}\" increased by {row['pct_change']:.0%} last month compared to the previous {COMPARISON_MONTHS}-month average (spent {row['last_month']:.2f} vs avg {row['previous_avg']:.2f}).",
-                    "last_month_amount": row["last_month"],
-                    "previous_avg_amount": row["previous_avg"],
-                    "percentage_increase": row["pct_change"]
-                })
-
-    # 3. (Optional) Identify Frequent Small Purchases (Example for 'Fast Food')
-    # This requires more granular analysis, potentially looking at transaction counts
-    fast_food_last_month = last_month_df[last_month_df["category"] == "Fast Food"]
-    if len(fast_food_last_month) > 5: # Example threshold
-        avg_amount = fast_food_last_month["amount"].mean()
-        total_amount = fast_food_last_month["amount"].sum()
+    for row in increases:
+        suggestions.append({
+            "type": "spending_increase",
+            "category": row["category"],
+            "message": f"Spending in \"{row['category']}\" increased by {row['pct_change']:.0%} last month compared to the previous {COMPARISON_MONTHS}-month average (spent {row['amount']:.2f} vs avg {row['previous_avg']:.2f}).",
+            "last_month_amount": row["amount"],
+            "previous_avg_amount": row["previous_avg"],
+            "percentage_increase": row["pct_change"]
+        })
+
+    for row in fast_food:
+        purchase_count = int(row["last_month_count"])
         suggestions.append({
             "type": "frequent_small_purchases",
             "category": "Fast Food",
-            "message": f"You made {len(fast_food_last_month)} purchases in \"Fast Food\" last month, totaling {total_amount:.2f}. Even small amounts add up.",
-            "count": len(fast_food_last_month),
-            "total_amount": total_amount,
-            "average_amount": avg_amount
+            "message": f"You made {purchase_count} purchases in \"Fast Food\" last month, totaling {row['amount']:.2f}. Even small amounts add up.",
+            "count": purchase_count,
+            "total_amount": row["amount"],
+            "average_amount": row["amount"] / purchase_count
         })
-
-    if not suggestions:
-         suggestions.append({"type": "info", "message": "No specific savings suggestions identified based on recent spending patterns."}) 
-
-    return {"savings_suggestions": suggestions}
+    return suggestions
 
 # --- Main Execution ---
 if __name__ == "__main__":
+    prometheus_path = configure_from_argv() # --profile=<stage>[:tracemalloc], --prometheus=<path>
+    enable_from_argv() # Reuses stored stage results for unchanged data; --no-result-cache recomputes everything
+    # --as-of=YYYY-MM-DD regenerates suggestions for a past date; --backfill=YYYY-MM:YYYY-MM
+    # writes the suggestions for every month in the range to BACKFILL_OUTPUT_PATH instead
+    as_of = next((arg.split("=", 1)[1] for arg in sys.argv if arg.startswith("--as-of=")), None)
+    backfill = next((arg.split("=", 1)[1] for arg in sys.argv if arg.startswith("--backfill=")), None)
     results = {}
     try:
         print("Starting data fetching and preprocessing for savings suggestions...")
         df_processed = fetch_and_preprocess_data(CRED_PATH, COLLECTION_NAME)
 
-        if not df_processed.empty:
+        if not df_processed.empty and backfill:
+            first_month, last_month = backfill.split(":")
+            print(f"Backfilling savings suggestions for {first_month} to {last_month}...")
+            results = {
+                month: month_results[UNASSIGNED_USER_ID]
+                for month, month_results in backfill_savings(aggregate_cells(df_processed).assign(**{USER_ID_FIELD: UNASSIGNED_USER_ID}), first_month, last_month).items()
+                if UNASSIGNED_USER_ID in month_results
+            }
+        elif not df_processed.empty:
             print("Generating savings suggestions...")
-            savings_results = suggest_savings(df_processed)
+            savings_results = suggest_savings(df_processed, as_of=as_of)
             results = savings_results
         else:
             results["error"] = "No valid expense data found for savings suggestions."
@@ -216,7 +281,8 @@ if __name__ == "__main__":
         results["error"] = f"An unexpected error occurred: {e}"
 
     # Output results as JSON
-    output_path = "ML/savings_suggestions_results.json"
+    output_path = BACKFILL_OUTPUT_PATH if backfill else "ML/savings_suggestions_results.json"
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
     print(f"\nSaving savings suggestions results to {output_path}...")
     try:
         with open(output_path, "w") as f:
@@ -225,3 +291,4 @@ if __name__ == "__main__":
     except Exception as e:
         print(f"Error saving results to JSON: {e}")
 
+    write_run_summary(prometheus_path=prometheus_path)
@@ -0,0 +1,247 @@
+from google.cloud.firestore_v1.base_query import FieldFilter
+import pandas as pd
+import glob
+import json
+import os
+
+from ingestion import CRED_PATH, COLLECTION_NAME, INGEST_FIELDS, SERVER_SIDE_FILTERS, get_client, preprocess_transactions
+from instrumentation import add_count, instrumented
+
+# --- Configuration ---
+SNAPSHOT_DIR = "ML/cache"
+UPDATED_AT_FIELD = "updatedAt" # Server timestamp written by the app on every add/update
+DELETED_AT_FIELD = "deletedAt" # Server timestamp on tombstones written by the app on delete
+TOMBSTONE_SUFFIX = "_deletions" # Tombstones live in "<collection>_deletions", keyed by the deleted document ID
+VALUE_FIELDS = [field for field in INGEST_FIELDS if field != "id"]
+SNAPSHOT_COLUMNS = ["id"] + VALUE_FIELDS + [UPDATED_AT_FIELD]
+DELETED_COLUMN = "deleted" # Marks tombstoned IDs in a delta file
+MAX_DELTA_FILES = 20 # Warm syncs append a delta file; past this many they are compacted into the snapshot
+FULL_REFRESH_DAYS = 7 # A warm sync becomes a full scan once the last one is older than this
+
+# Warm syncs only see documents whose updatedAt moved past the watermark and deletions that left
+# a tombstone. Documents written without updatedAt (older app versions, console edits, other
+# clients) and deletions without a tombstone are invisible to them, so the snapshot drifts until
+# the next full scan; FULL_REFRESH_DAYS bounds how long. A warm sync writes only its changes as a
+# delta file next to the snapshot instead of rewriting the whole parquet; load_snapshot applies
+# the deltas in order, and a full scan or MAX_DELTA_FILES deltas rewrite the snapshot in one piece.
+
+# --- Helper Functions ---
+
+def snapshot_paths(collection_name, snapshot_dir=SNAPSHOT_DIR):
+    """Returns the (parquet, metadata) paths of a collection's local snapshot."""
+    base = os.path.join(snapshot_dir, collection_name)
+    return f"{base}.parquet", f"{base}.meta.json"
+
+def _to_storable(value):
+    """Normalizes a raw Firestore value so mixed-type columns can be stored in Parquet."""
+    if value is None or (isinstance(value, float) and pd.isna(value)):
+        return None
+    if hasattr(value, "strftime"): # Firestore Timestamp / datetime stored in a string field
+        return value.strftime("%m/%d/%Y")
+    return str(value)
+
+def docs_to_frame(docs):
+    """Converts Firestore snapshots into the raw columns kept in the local snapshot."""
+    rows = []
+    for doc in docs:
+        doc_data = doc.to_dict()
+        row = {col: doc_data.get(col) for col in VALUE_FIELDS}
+        row["id"] = doc.id
+        row[UPDATED_AT_FIELD] = doc_data.get(UPDATED_AT_FIELD)
+        rows.append(row)
+    add_count("firestore_documents_read", len(rows))
+
+    df = pd.DataFrame(rows, columns=SNAPSHOT_COLUMNS)
+    for col in VALUE_FIELDS:
+        df[col] = df[col].map(_to_storable).astype("string")
+    df["id"] = df["id"].astype("string")
+    df[UPDATED_AT_FIELD] = pd.to_datetime(df[UPDATED_AT_FIELD], utc=True, errors="coerce")
+    return df
+
+def apply_changes(df, changed, deleted_ids):
+    """Changed rows replace their cached version (or are appended); deleted IDs are dropped."""
+    if not changed.empty:
+        df = pd.concat([df, changed], ignore_index=True).drop_duplicates(subset="id", keep="last")
+    if len(deleted_ids):
+        df = df[~df["id"].isin(deleted_ids)]
+    return df.reset_index(drop=True)
+
+def load_snapshot(collection_name, snapshot_dir=SNAPSHOT_DIR):
+    """Loads the cached raw frame, with its delta files applied, and its sync metadata, or (None, None) on a cold start."""
+    data_path, meta_path = snapshot_paths(collection_name, snapshot_dir)
+    if not (os.path.exists(data_path) and os.path.exists(meta_path)):
+        return None, None
+    try:
+        with open(meta_path, "r") as f:
+            meta = json.load(f)
+        df = pd.read_parquet(data_path)
+        for name in meta.get("deltas", []):
+            delta = pd.read_parquet(os.path.join(snapshot_dir, name))
+            deleted = delta[DELETED_COLUMN].fillna(False).astype(bool)
+            df = apply_changes(df, delta.loc[~deleted, SNAPSHOT_COLUMNS], delta.loc[deleted, "id"])
+        return df, meta
+    except Exception as e:
+        print(f"Warning: Could not load snapshot for '{collection_name}', falling back to a full scan: {e}")
+        return None, None
+
+def _delta_pattern(collection_name):
+    return f"{collection_name}.delta-*.parquet"
+
+def _save_meta(meta, meta_path):
+    with open(f"{meta_path}.tmp", "w") as f:
+        json.dump(meta, f, indent=2)
+    os.replace(f"{meta_path}.tmp", meta_path)
+
+def save_snapshot(df, meta, collection_name, snapshot_dir=SNAPSHOT_DIR):
+    """Persists the whole raw frame and metadata, dropping any delta files.
+
+    Writes to temp files first so a crash never leaves a torn snapshot.
+    """
+    os.makedirs(snapshot_dir, exist_ok=True)
+    data_path, meta_path = snapshot_paths(collection_name, snapshot_dir)
+    meta["deltas"] = []
+    df.to_parquet(f"{data_path}.tmp", index=False)
+    os.replace(f"{data_path}.tmp", data_path)
+    _save_meta(meta, meta_path)
+    for path in glob.glob(os.path.join(snapshot_dir, _delta_pattern(collection_name))):
+        os.remove(path)
+
+def save_delta(changed, deleted_ids, meta, collection_name, snapshot_dir=SNAPSHOT_DIR):
+    """Persists one sync's changes as a delta file and lists it in the metadata.
+
+    The metadata is replaced last, so a crash before it leaves an unlisted delta that is ignored.
+    """
+    _, meta_path = snapshot_paths(collection_name, snapshot_dir)
+    name = _delta_pattern(collection_name).replace("*", pd.Timestamp(meta["synced_at"]).strftime("%Y%m%dT%H%M%S%f"))
+    tombstoned = pd.DataFrame({col: pd.Series([None] * len(deleted_ids), dtype="string") for col in VALUE_FIELDS})
+    tombstoned.insert(0, "id", pd.Series(deleted_ids, dtype="string"))
+    tombstoned[UPDATED_AT_FIELD] = pd.Series(pd.NaT, index=tombstoned.index, dtype=changed[UPDATED_AT_FIELD].dtype)
+    delta = pd.concat([changed.assign(**{DELETED_COLUMN: False}), tombstoned.assign(**{DELETED_COLUMN: True})], ignore_index=True)
+    path = os.path.join(snapshot_dir, name)
+    delta.to_parquet(f"{path}.tmp", index=False)
+    os.replace(f"{path}.tmp", path)
+    meta["deltas"] = meta.get("deltas", []) + [name]
+    _save_meta(meta, meta_path)
+
+def full_refresh_due(meta, now):
+    """Whether the last full scan (unknown for older snapshots) is more than FULL_REFRESH_DAYS old."""
+    last_full = meta.get("full_refreshed_at")
+    return last_full is None or pd.Timestamp(last_full) < now - pd.Timedelta(days=FULL_REFRESH_DAYS)
+
+def _projected(query, fields):
+    """Query reading only the given fields (the document ID always comes along)."""
+    return query.select(fields) if SERVER_SIDE_FILTERS else query
+
+def snapshot_version(meta):
+    """Data version of a snapshot: it only changes when a sync brings changes (or on a full refresh)."""
+    return f"{meta['watermark']}|{meta['deletions_watermark']}|{meta['row_count']}"
+
+def _watermark(series, fallback):
+    """Latest non-null timestamp in a column, or the fallback when the column is empty."""
+    latest = series.max() if len(series) else pd.NaT
+    return fallback if pd.isna(latest) else latest
+
+# --- Core Functions ---
+
+@instrumented("snapshot_sync")
+def sync_snapshot(cred_path, collection_name, snapshot_dir=SNAPSHOT_DIR, full_refresh=False, return_changes=False):
+    """Brings the local snapshot up to date and returns the raw (unpreprocessed) transaction frame.
+
+    A cold start (or full_refresh, or a last full scan older than FULL_REFRESH_DAYS) streams the
+    whole collection. A warm run only reads documents whose updatedAt is past the stored
+    watermark plus tombstones written since the last sync, so its read cost is proportional to
+    the number of changes, and stores them as a delta file.
+    With return_changes, returns (df, changes, meta) where changes holds the raw "added" rows,
+    the "removed" cached rows they replace or that were deleted, and "previous_synced_at";
+    changes is None after a cold start.
+    """
+    db = get_client(cred_path)
+    sync_started = pd.Timestamp.now(tz="UTC")
+    tombstones = db.collection(f"{collection_name}{TOMBSTONE_SUFFIX}")
+
+    cached, meta = (None, None) if full_refresh else load_snapshot(collection_name, snapshot_dir)
+    if meta is not None and full_refresh_due(meta, sync_started):
+        print(f"Last full scan of '{collection_name}' is over {FULL_REFRESH_DAYS} days old; refreshing the snapshot.")
+        cached, meta = None, None
+    changes = None
+    unchanged = False
+    delta = None
+
+    if cached is None:
+        print(f"Cold start: streaming the full '{collection_name}' collection...")
+        df = docs_to_frame(_projected(db.collection(collection_name), VALUE_FIELDS + [UPDATED_AT_FIELD]).stream())
+        print(f"Fetched {len(df)} documents.")
+        meta = {
+            "collection": collection_name,
+            "watermark": _watermark(df[UPDATED_AT_FIELD], sync_started).isoformat(),
+            # Anything deleted before this full scan is already absent from it
+            "deletions_watermark": sync_started.isoformat(),
+            "full_refreshed_at": sync_started.isoformat(),
+        }
+    else:
+        watermark = pd.Timestamp(meta["watermark"])
+        deletions_watermark = pd.Timestamp(meta["deletions_watermark"])
+
+        changed_query = db.collection(collection_name).where(filter=FieldFilter(UPDATED_AT_FIELD, ">", watermark.to_pydatetime()))
+        changed = docs_to_frame(_projected(changed_query, VALUE_FIELDS + [UPDATED_AT_FIELD]).stream())
+
+        deleted_ids = []
+        latest_deletion = deletions_watermark
+        deleted_query = tombstones.where(filter=FieldFilter(DELETED_AT_FIELD, ">", deletions_watermark.to_pydatetime()))
+        for doc in _projected(deleted_query, [DELETED_AT_FIELD]).stream():
+            deleted_ids.append(doc.id)
+            deleted_at = doc.to_dict().get(DELETED_AT_FIELD)
+            if deleted_at is not None:
+                latest_deletion = max(latest_deletion, pd.Timestamp(deleted_at))
+        add_count("firestore_documents_read", len(deleted_ids))
+        print(f"Incremental sync: {len(changed)} added/changed and {len(deleted_ids)} deleted documents since {watermark.isoformat()}.")
+        unchanged = changed.empty and not deleted_ids
+        if return_changes:
+            replaced = cached["id"].isin(changed["id"]) | cached["id"].isin(deleted_ids)
+            changes = {"added": changed, "removed": cached[replaced], "previous_synced_at": meta.get("synced_at")}
+
+        df = apply_changes(cached, changed, deleted_ids)
+        if len(meta.get("deltas", [])) < MAX_DELTA_FILES:
+            delta = (changed, deleted_ids)
+
+        meta["watermark"] = _watermark(changed[UPDATED_AT_FIELD], watermark).isoformat()
+        meta["deletions_watermark"] = latest_deletion.isoformat()
+
+    if unchanged and "data_version" in meta:
+        # Nothing to write: the snapshot, its watermarks and its synced_at stay as they are
+        print("Snapshot is up to date.")
+    else:
+        meta["synced_at"] = sync_started.isoformat()
+        meta["row_count"] = len(df)
+        meta["data_version"] = snapshot_version(meta)
+        if unchanged:
+            # Metadata from before data versions: record the version without writing an empty delta
+            _save_meta(meta, snapshot_paths(collection_name, snapshot_dir)[1])
+        elif delta is not None:
+            save_delta(*delta, meta, collection_name, snapshot_dir)
+        else:
+            save_snapshot(df, meta, collection_name, snapshot_dir)
+    if return_changes:
+        return df, changes, meta
+    return df
+
+def preprocess_snapshot(df):
+    """Preprocesses raw snapshot rows exactly as a fresh fetch would be."""
+    if df.empty:
+        return pd.DataFrame()
+    # Work on plain object columns so preprocessing behaves exactly as on a fresh fetch
+    raw = df.drop(columns=[UPDATED_AT_FIELD]).astype(object)
+    raw = raw.where(raw.notna(), None)
+    return preprocess_transactions(raw)
+
+def fetch_and_preprocess_incremental(cred_path, collection_name, snapshot_dir=SNAPSHOT_DIR, full_refresh=False):
+    """Incremental counterpart of fetch_and_preprocess_data backed by the local snapshot."""
+    df = sync_snapshot(cred_path, collection_name, snapshot_dir, full_refresh)
+    if df.empty:
+        print("No documents found in the collection.")
+        return pd.DataFrame()
+    return preprocess_snapshot(df)
+
+# --- Main Execution ---
+if __name__ == "__main__":
+    fetch_and_preprocess_incremental(CRED_PATH, COLLECTION_NAME)
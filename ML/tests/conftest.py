@@ -0,0 +1,36 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+# The ML modules import each other as top-level modules, as when the scripts run from ML/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ingestion
+from data_sources import SyntheticSource
+from ingestion import preprocess_transactions
+from fake_firestore import FakeFirestore
+
+FAKE_CREDENTIALS = "fake-credentials.json"
+
+SOURCE = SyntheticSource(rows=3000, users=3, seed=7, start="2022-01-01", end="2024-12-31")
+
+@pytest.fixture
+def raw_rows():
+    """Synthetic documents as the app stores them: three users over three years."""
+    columns = SOURCE.fetch_columns()
+    return [dict(zip(columns, values)) for values in zip(*[column.tolist() for column in columns.values()])]
+
+@pytest.fixture
+def transactions():
+    """Preprocessed synthetic transactions: three users over three years."""
+    return preprocess_transactions(pd.DataFrame(SOURCE.fetch_columns()))
+
+@pytest.fixture
+def firestore(monkeypatch, tmp_path):
+    """A fake Firestore client served for FAKE_CREDENTIALS; runs in tmp_path so ML/cache stays clean."""
+    db = FakeFirestore()
+    monkeypatch.setitem(ingestion._clients, FAKE_CREDENTIALS, db)
+    monkeypatch.chdir(tmp_path)
+    return db
@@ -0,0 +1,95 @@
+"""In-memory stand-in for the parts of the Firestore client the ML modules use."""
+
+class FakeDocument:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data)
+
+_OPERATORS = {
+    "==": lambda value, target: value == target,
+    "<": lambda value, target: value < target,
+    "<=": lambda value, target: value <= target,
+    ">": lambda value, target: value > target,
+    ">=": lambda value, target: value >= target,
+    "in": lambda value, target: value in target,
+}
+
+class FakeQuery:
+    """Supports where(filter=FieldFilter), select, order_by (document ID only), limit, start_after and stream."""
+
+    def __init__(self, store, filters=(), fields=None, ordered=False, limit=None, after=None):
+        self.store = store
+        self.filters = list(filters)
+        self.fields = fields
+        self.ordered = ordered
+        self.limit_count = limit
+        self.after = after
+
+    def _with(self, **changes):
+        state = {"filters": self.filters, "fields": self.fields, "ordered": self.ordered, "limit": self.limit_count, "after": self.after}
+        state.update(changes)
+        return FakeQuery(self.store, **state)
+
+    def where(self, filter=None):
+        return self._with(filters=self.filters + [filter])
+
+    def select(self, fields):
+        return self._with(fields=list(fields))
+
+    def order_by(self, _field, **_kwargs):
+        return self._with(ordered=True)
+
+    def limit(self, count):
+        return self._with(limit=count)
+
+    def start_after(self, document):
+        return self._with(after=document.id)
+
+    def _matches(self, data):
+        for condition in self.filters:
+            value = data.get(condition.field_path)
+            if value is None or not _OPERATORS[condition.op_string](value, condition.value):
+                return False
+        return True
+
+    def stream(self):
+        doc_ids = sorted(self.store) if self.ordered else list(self.store)
+        if self.after is not None:
+            doc_ids = [doc_id for doc_id in doc_ids if doc_id > self.after]
+        returned = 0
+        for doc_id in doc_ids:
+            data = self.store[doc_id]
+            if not self._matches(data):
+                continue
+            if self.limit_count is not None and returned >= self.limit_count:
+                break
+            returned += 1
+            self.store.reads += 1
+            if self.fields is not None:
+                data = {field: data[field] for field in self.fields if field in data}
+            yield FakeDocument(doc_id, data)
+
+class FakeCollection(dict):
+    """Documents by ID; counts the documents streamed out of it."""
+    reads = 0
+
+class FakeFirestore:
+    def __init__(self):
+        self.collections = {}
+
+    def collection(self, name):
+        return FakeQuery(self.collections.setdefault(name, FakeCollection()))
+
+    def documents(self, name):
+        """The stored documents of a collection, for tests to edit directly."""
+        return self.collections.setdefault(name, FakeCollection())
+
+    def load(self, name, rows, **fields):
+        """Stores rows (dicts with an "id") as documents, with extra fields added to each."""
+        documents = self.documents(name)
+        for row in rows:
+            data = dict(row, **fields)
+            documents[str(data.pop("id"))] = data
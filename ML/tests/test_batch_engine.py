@@ -0,0 +1,32 @@
+import json
+
+import pandas as pd
+
+import batch_engine
+from batch_engine import analyze_users, partition_by_user, user_results_path
+from ingestion import USER_ID_FIELD
+from result_store import read_results
+from rollup import UNASSIGNED_USER_ID, aggregate_cells
+from savings_suggestions import suggest_savings_cells
+
+def test_missing_user_ids_get_their_own_partition(transactions):
+    users = transactions[USER_ID_FIELD].astype(object)
+    df = transactions.assign(**{USER_ID_FIELD: pd.Categorical(users.where(users != "user0", None))})
+    partitions = dict(partition_by_user(df))
+    assert set(partitions) == {"user1", "user2", UNASSIGNED_USER_ID}
+    assert len(partitions[UNASSIGNED_USER_ID]) == (transactions[USER_ID_FIELD] == "user0").sum()
+
+def test_failed_batch_savings_fall_back_to_per_user(transactions, monkeypatch, tmp_path):
+    def failing_batch(cells, *args, **kwargs):
+        raise RuntimeError("batch pass broke")
+    monkeypatch.setattr(batch_engine, "suggest_savings_batch", failing_batch)
+
+    partitions = list(partition_by_user(transactions))
+    statuses, savings_error = analyze_users(partitions, str(tmp_path), "json")
+
+    assert savings_error == "RuntimeError: batch pass broke"
+    assert [error for _, error in statuses] == [None] * len(partitions)
+    for user_id, user_df in partitions:
+        results = read_results(user_results_path(user_id, str(tmp_path)))
+        expected = suggest_savings_cells(aggregate_cells(user_df))
+        assert results["savings"] == json.loads(json.dumps(expected, default=str))
@@ -0,0 +1,18 @@
+import pandas as pd
+import pytest
+
+from expense_forecasting import monthly_totals, monthly_totals_from_cells, to_month_end_series
+from rollup import aggregate_cells
+
+pytestmark = pytest.mark.filterwarnings("error::FutureWarning") # e.g. the deprecated "M" month-end alias
+
+def test_gaps_are_filled_on_month_ends():
+    totals = pd.Series([10.0, 5.0], index=pd.PeriodIndex(["2024-01", "2024-04"], freq="M"))
+    series = to_month_end_series(totals)
+    assert series.tolist() == [10.0, 0.0, 0.0, 5.0]
+    assert series.index.freqstr == "ME"
+    assert series.index[-1] == pd.Timestamp("2024-04-30")
+
+def test_cells_match_transactions(transactions):
+    pd.testing.assert_series_equal(monthly_totals_from_cells(aggregate_cells(transactions)), monthly_totals(transactions),
+                                   check_names=False, check_exact=False)
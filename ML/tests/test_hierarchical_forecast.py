@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import expense_forecasting
+from expense_forecasting import forecast_expenses_cells
+from hierarchical_forecast import forecast_hierarchy
+from rollup import aggregate_cells
+
+STEPS = 6
+
+@pytest.fixture
+def cells(transactions):
+    return aggregate_cells(transactions)
+
+def forecast_sum(records):
+    return np.array([record["predicted_amount"] for record in records])
+
+@pytest.mark.parametrize("method", ["mint", "bottom_up"])
+def test_categories_sum_to_the_reconciled_total(cells, method):
+    hierarchy = forecast_hierarchy(cells, STEPS, method)
+    total = forecast_sum(hierarchy["total"])
+    categories = sum(forecast_sum(records) for records in hierarchy["categories"].values())
+    assert len(total) == STEPS
+    np.testing.assert_allclose(categories, total, rtol=1e-9)
+    assert set(hierarchy["categories"]) == set(cells["category"].astype(str))
+
+def test_category_named_total_keeps_its_own_forecast(cells):
+    renamed = cells.assign(category=cells["category"].astype(str).replace({"Groceries": "total"}))
+    hierarchy = forecast_hierarchy(renamed, STEPS)
+    assert "total" in hierarchy["categories"]
+    total = forecast_sum(hierarchy["total"])
+    np.testing.assert_allclose(sum(forecast_sum(records) for records in hierarchy["categories"].values()), total, rtol=1e-9)
+    assert (forecast_sum(hierarchy["categories"]["total"]) < total).all()
+
+def test_hierarchy_is_opt_in_and_keeps_the_model_total(cells):
+    assert expense_forecasting.HIERARCHICAL_FORECAST is None
+    plain = forecast_expenses_cells(cells)
+    assert "hierarchical_forecast" not in plain
+
+    with_hierarchy = forecast_expenses_cells(cells, hierarchical="mint")
+    assert with_hierarchy["forecast"] == plain["forecast"]
+    assert with_hierarchy["hierarchical_forecast"]["base_total"] == plain["forecast"]
+
+def test_no_hierarchy_on_an_insufficient_data_error(cells):
+    recent = cells[cells["year_month"] >= cells["year_month"].max() - 5]
+    result = forecast_expenses_cells(recent, hierarchical="mint")
+    assert set(result) == {"error"}
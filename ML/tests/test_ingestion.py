@@ -0,0 +1,96 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ingestion import preprocess_transactions
+
+# --- Reference: the per-row preprocessing the vectorized version replaced ---
+
+def reference_float(value):
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return np.nan
+
+def reference_date(value):
+    try:
+        return pd.to_datetime(value, format="%m/%d/%Y", errors="coerce")
+    except (ValueError, TypeError):
+        return pd.NaT
+
+def reference_preprocess(df):
+    df = df.copy()
+    is_expense = df["isExpense"].astype(str).str.lower().map({"true": True, "false": False, "1": True, "0": False})
+    df_expenses = df[is_expense == True].copy()
+    print(f"Filtered down to {len(df_expenses)} expense transactions.")
+    if df_expenses.empty:
+        return pd.DataFrame()
+    df_expenses["amount"] = df_expenses["amount"].apply(reference_float)
+    df_expenses["date"] = df_expenses["date"].apply(reference_date)
+    original_len = len(df_expenses)
+    df_expenses.dropna(subset=["amount", "date", "category"], inplace=True)
+    if len(df_expenses) < original_len:
+        print(f"Dropped {original_len - len(df_expenses)} rows due to missing/invalid amount, date, or category.")
+    df_expenses["category"] = df_expenses["category"].astype(str)
+    df_expenses.sort_values("date", inplace=True)
+    df_expenses["year"] = df_expenses["date"].dt.year
+    df_expenses["month"] = df_expenses["date"].dt.month
+    df_expenses["year_month"] = df_expenses["date"].dt.to_period("M")
+    return df_expenses
+
+def assert_same_expenses(result, expected):
+    """Same rows, order and values in the columns both versions produce (the current frame drops
+    isExpense, year and month and stores category as a categorical and amount as AMOUNT_DTYPE)."""
+    columns = [col for col in result.columns if col in expected.columns]
+    assert set(columns) >= {"id", "amount", "date", "category", "year_month"}
+    result = result[columns].astype({"category": str, "amount": "float64"})
+    pd.testing.assert_frame_equal(result, expected[columns], check_dtype=False)
+    assert result["date"].dtype == expected["date"].dtype
+
+# --- Messy input ---
+
+IS_EXPENSE = [True, False, "true", "TRUE", "True", "1", "0", 1, 0, "yes", None, np.nan, "false", 1.0]
+AMOUNTS = ["12.50", 3, 7.25, None, "abc", "", " 42 ", "1_000", True, np.nan, "1e3", "-5", "NaN"]
+DATES = ["01/15/2024", "2/3/2024", "12/31/2023", "2024-01-15", "13/01/2024", "02/30/2024", None, "",
+         datetime.datetime(2024, 3, 9), pd.Timestamp("2024-04-01"), 20240101]
+CATEGORIES = ["Food", "Rent", None, 5, "Food"]
+
+def messy_frame(rows, seed):
+    rng = np.random.default_rng(seed)
+    pick = lambda values: [values[i] for i in rng.integers(len(values), size=rows)]
+    return pd.DataFrame({
+        "id": [f"doc{i}" for i in range(rows)],
+        "isExpense": pick(IS_EXPENSE),
+        "amount": pick(AMOUNTS),
+        "date": pick(DATES),
+        "category": pick(CATEGORIES),
+    })
+
+@pytest.mark.parametrize("seed", range(5))
+def test_matches_per_row_preprocessing(seed, capsys):
+    df = messy_frame(400, seed)
+    expected = reference_preprocess(df)
+    expected_log = capsys.readouterr().out
+    result = preprocess_transactions(df.copy())
+    log = capsys.readouterr().out
+
+    assert_same_expenses(result, expected)
+    for line in expected_log.splitlines():
+        assert line in log # Same filtered and dropped row counts
+
+def test_uniform_columns_match_per_row_preprocessing(capsys):
+    df = pd.DataFrame({
+        "id": ["a", "b", "c", "d"],
+        "isExpense": [True, True, False, True],
+        "amount": [1.5, np.nan, 3.0, 4.0],
+        "date": ["01/01/2024", "01/02/2024", "01/03/2024", "bad"],
+        "category": ["Food", "Food", "Food", "Food"],
+    })
+    expected = reference_preprocess(df)
+    assert_same_expenses(preprocess_transactions(df.copy()), expected)
+
+def test_no_expenses():
+    df = pd.DataFrame({"id": ["a"], "isExpense": ["no"], "amount": ["1"], "date": ["01/01/2024"], "category": ["Food"]})
+    assert preprocess_transactions(df).empty
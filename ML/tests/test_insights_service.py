@@ -0,0 +1,104 @@
+import asyncio
+
+import pandas as pd
+import pytest
+
+from insights_service import InsightsService
+from rollup import SpendingRollup
+
+class FakeRefresh:
+    """Stands in for the Firestore sync: returns a rollup rebuilt from the current transactions."""
+
+    def __init__(self, df):
+        self.df = df
+
+    def __call__(self):
+        return SpendingRollup.from_frame(self.df)
+
+@pytest.fixture
+def service(transactions):
+    service = InsightsService(refresh_rollup=FakeRefresh(transactions), max_workers=1)
+    computed = []
+    compute = service._compute
+    service._compute = lambda rollup, user_id: computed.append(user_id) or compute(rollup, user_id)
+    service.computed = computed
+    yield service
+    service.executor.shutdown(wait=True)
+
+def test_second_request_is_a_cache_hit(service):
+    async def scenario():
+        await service.refresh()
+        first = await service.insights("user0")
+        second = await service.insights("user0")
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert first == second
+    assert service.computed == ["user0"]
+    assert (service.cache.hits, service.cache.misses) == (1, 1)
+
+def test_refresh_without_changes_keeps_cached_insights(service):
+    async def scenario():
+        assert await service.refresh()
+        version = service.version
+        await service.insights("user1")
+        assert not await service.refresh() # A new rollup object with the same data
+        assert service.version == version
+        await service.insights("user1")
+
+    asyncio.run(scenario())
+    assert service.computed == ["user1"]
+    assert service.cache.hits == 1
+
+def test_data_change_invalidates_cached_insights(service, transactions):
+    extra = transactions[transactions["userId"] == "user2"].tail(1).assign(amount=5000.0, id="extra")
+
+    async def scenario():
+        await service.refresh()
+        before = await service.insights("user2")
+        version = service.version
+        service.refresh_rollup.df = pd.concat([transactions, extra], ignore_index=True)
+        assert await service.refresh()
+        assert service.version != version
+        after = await service.insights("user2")
+        return before, after
+
+    before, after = asyncio.run(scenario())
+    assert service.computed == ["user2", "user2"] # The rewarm and the request share one computation
+    assert before["spending_analysis"] != after["spending_analysis"]
+    assert all(version == service.version for _, version in service.cache.entries)
+
+def test_routes(service):
+    async def scenario():
+        await service.refresh()
+        return {
+            path: await service.route("GET", path)
+            for path in ["/users/user0/savings", "/users/nobody/insights", "/users/user0/nope", "/users", "/health"]
+        }
+
+    responses = asyncio.run(scenario())
+    assert responses["/users/user0/savings"][0] == 200
+    assert responses["/users/nobody/insights"][0] == 404
+    assert "nobody" in responses["/users/nobody/insights"][1]["error"]
+    assert responses["/users/user0/nope"][0] == 404
+    assert responses["/users"][0] == 404
+    assert responses["/health"][1]["users"] == 3
+
+def test_requests_before_the_first_refresh_are_unavailable(service):
+    assert asyncio.run(service.route("GET", "/users/user0/insights"))[0] == 503
+
+@pytest.mark.parametrize("content_length", ["abc", "-5"])
+def test_invalid_content_length_is_a_bad_request(service, content_length):
+    async def scenario():
+        server = await asyncio.start_server(service.handle_connection, "127.0.0.1", 0)
+        async with server:
+            reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname()[:2])
+            writer.write(f"GET /health HTTP/1.1\r\nContent-Length: {content_length}\r\n\r\n".encode())
+            await writer.drain()
+            response = await reader.read()
+            writer.close()
+            return response
+
+    response = asyncio.run(scenario())
+    assert response.startswith(b"HTTP/1.1 400 Bad Request\r\n")
+    assert b"Content-Length header" in response
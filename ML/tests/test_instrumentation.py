@@ -0,0 +1,50 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+import numpy as np
+import pytest
+
+import instrumentation
+from instrumentation import current_rss_mb, enable_profiling, instrumented
+
+@pytest.fixture
+def run(monkeypatch):
+    """A fresh run and profiler state, so stages recorded by other tests do not leak in."""
+    monkeypatch.setitem(instrumentation._run, "records", instrumentation.deque(maxlen=instrumentation.MAX_STAGE_RECORDS))
+    monkeypatch.setitem(instrumentation._run, "totals", {})
+    monkeypatch.setitem(instrumentation._run, "counters", {})
+    monkeypatch.setattr(instrumentation, "_profile", dict(instrumentation._profile, stage=None, active=False))
+    return instrumentation._run
+
+@pytest.mark.skipif(current_rss_mb() is None, reason="needs /proc/self/statm")
+def test_rss_delta_is_measured_over_the_stage(run):
+    @instrumented("allocate")
+    def allocate(megabytes):
+        block = np.ones(megabytes * 1024 ** 2 // 8)
+        return [block]
+
+    kept = allocate(64)
+    record = run["records"][-1]
+    assert 48 <= record["rss_delta_mb"] <= 96
+    assert record["process_peak_rss_mb"] >= record["rss_delta_mb"]
+    assert run["totals"]["allocate"]["max_rss_delta_mb"] == record["rss_delta_mb"]
+    del kept
+
+def test_profiled_stage_in_concurrent_threads(run, tmp_path, monkeypatch):
+    monkeypatch.setattr(instrumentation, "PROFILE_DIR", str(tmp_path / "profiles"))
+    barrier = threading.Barrier(4)
+
+    @instrumented("profiled")
+    def profiled(values):
+        barrier.wait(timeout=10) # Every call is inside the stage at the same time
+        return sorted(values)
+
+    for mode in instrumentation.PROFILE_MODES:
+        enable_profiling("profiled", mode)
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(profiled, [[3, 1, 2]] * 4))
+        assert results == [[1, 2, 3]] * 4
+        assert not instrumentation._profile["active"]
+        assert instrumentation._write_profile_report() is not None
+    assert run["totals"]["profiled"]["calls"] == 8
+    assert run["totals"]["profiled"]["errors"] == 0
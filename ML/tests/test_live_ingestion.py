@@ -0,0 +1,56 @@
+import datetime
+
+import pandas as pd
+import pytest
+
+from conftest import FAKE_CREDENTIALS
+from ingestion import preprocess_transactions
+from live_ingestion import LiveRollup
+from rollup import SpendingRollup
+
+COLLECTION = "transactions"
+SYNCED = datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc)
+
+def assert_same_cells(live, documents):
+    rows = [dict(data, id=doc_id) for doc_id, data in documents.items()]
+    expected = SpendingRollup.from_frame(preprocess_transactions(pd.DataFrame(rows)))
+    pd.testing.assert_frame_equal(live.rollup.table, expected.table, check_exact=False)
+
+@pytest.fixture
+def live(firestore, raw_rows, tmp_path):
+    firestore.load(COLLECTION, raw_rows, updatedAt=SYNCED)
+    # The snapshot directory differs from the one sync_rollup writes to, so no snapshot is found
+    return LiveRollup.bootstrap(FAKE_CREDENTIALS, COLLECTION, str(tmp_path / "rollup"), str(tmp_path / "elsewhere"))
+
+def test_bootstrap_without_a_snapshot_rebuilds_it(live, firestore, transactions, tmp_path):
+    assert (tmp_path / "elsewhere" / f"{COLLECTION}.parquet").exists()
+    assert len(live.contributions) == len(transactions)
+    assert all(len(contribution) == 4 for contribution in live.contributions.values()) # No raw rows are kept
+    assert_same_cells(live, firestore.documents(COLLECTION))
+
+def test_changes_match_a_rebuild(live, firestore):
+    documents = firestore.documents(COLLECTION)
+    expense_ids = list(live.contributions)
+    other_id = next(doc_id for doc_id in documents if doc_id not in live.contributions) # Not an expense
+    version = live.rollup.meta["data_version"]
+
+    edits = {
+        expense_ids[0]: dict(documents[expense_ids[0]], amount=999.0),
+        expense_ids[1]: dict(documents[expense_ids[1]], category="Moved"),
+        expense_ids[2]: dict(documents[expense_ids[2]], isExpense=False),
+        other_id: dict(documents[other_id], isExpense=True),
+        "brand-new": dict(documents[expense_ids[3]], userId="someone-new"),
+    }
+    deleted = [expense_ids[4], "never-existed"]
+    assert live.apply_changes(edits.items(), deleted) == 6
+
+    documents.update(edits)
+    del documents[expense_ids[4]]
+    assert_same_cells(live, documents)
+    assert expense_ids[2] not in live.contributions and other_id in live.contributions
+    assert live.rollup.meta["data_version"] != version
+
+def test_unknown_deletes_are_ignored(live):
+    version = live.rollup.meta["data_version"]
+    assert live.apply_changes((), ["never-existed"]) == 0
+    assert live.rollup.meta["data_version"] == version
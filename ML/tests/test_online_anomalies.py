@@ -0,0 +1,74 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from online_anomalies import EXACT_WARMUP, IQR_THRESHOLD, OnlineIQRDetector
+from spending_analysis import detect_anomalies_iqr
+
+# Largest bound error, as a fraction of the IQR, stated in online_anomalies for each history length
+SKETCH_TOLERANCE = {EXACT_WARMUP + 50: 0.25, 1000: 0.15, 3000: 0.06, 10000: 0.03}
+
+def amounts(distribution, n, rng):
+    if distribution == "gamma":
+        return rng.gamma(2.0, 30.0, n)
+    if distribution == "lognormal":
+        return rng.lognormal(3.0, 0.8, n)
+    if distribution == "uniform":
+        return rng.uniform(5.0, 200.0, n)
+    return np.where(rng.random(n) < 0.6, rng.normal(40.0, 5.0, n), rng.normal(150.0, 20.0, n))
+
+def batch_bounds(values):
+    Q1, Q3 = np.quantile(values, [0.25, 0.75])
+    return Q1 - IQR_THRESHOLD * (Q3 - Q1), Q3 + IQR_THRESHOLD * (Q3 - Q1)
+
+def test_warmup_matches_batch_detection():
+    rng = np.random.default_rng(0)
+    sizes = {"Food": EXACT_WARMUP, "Rent": 40, "Travel": 5, "Gifts": 4}
+    df = pd.DataFrame({
+        "category": np.repeat(list(sizes), list(sizes.values())),
+        "amount": np.concatenate([np.append(rng.gamma(2.0, 30.0, size - 1), 900.0) for size in sizes.values()]),
+    })
+    detector = OnlineIQRDetector().warm_start(df)
+
+    online = {(row.category, row.amount) for row in df.itertuples() if detector.score(row.category, row.amount)["is_anomaly"]}
+    batch = {(record["category"], record["amount"]) for record in detect_anomalies_iqr(df)["detected_anomalies"]}
+    assert online == batch
+    assert ("Food", 900.0) in online
+    assert not any(category == "Gifts" for category, _ in online) # Below the minimum group size
+    for category in ["Food", "Rent", "Travel"]:
+        assert detector.bounds(category) == pytest.approx(batch_bounds(df.loc[df["category"] == category, "amount"]), rel=1e-12)
+
+@pytest.mark.parametrize("distribution", ["gamma", "lognormal", "uniform", "bimodal"])
+def test_sketch_bounds_within_stated_tolerance(distribution):
+    for seed in range(5):
+        values = amounts(distribution, max(SKETCH_TOLERANCE), np.random.default_rng(seed))
+        detector = OnlineIQRDetector()
+        for count, amount in enumerate(values, start=1):
+            detector.update(distribution, amount)
+            if count in SKETCH_TOLERANCE:
+                lower, upper = batch_bounds(values[:count])
+                IQR = (upper - lower) / (1 + 2 * IQR_THRESHOLD)
+                online_lower, online_upper = detector.bounds(distribution)
+                assert abs(online_lower - lower) <= SKETCH_TOLERANCE[count] * IQR, (seed, count)
+                assert abs(online_upper - upper) <= SKETCH_TOLERANCE[count] * IQR, (seed, count)
+
+def test_checkpoint_round_trip_is_exact(tmp_path):
+    rng = np.random.default_rng(1)
+    detector = OnlineIQRDetector()
+    for category, n in [("Food", 3 * EXACT_WARMUP), ("Rent", EXACT_WARMUP // 2), ("Gifts", 3)]:
+        for amount in rng.lognormal(3.0, 0.8, n):
+            detector.update(category, amount)
+
+    restored = OnlineIQRDetector.from_dict(json.loads(json.dumps(detector.to_dict())))
+    path = str(tmp_path / "detector.json")
+    detector.save(path)
+    loaded = OnlineIQRDetector.load(path)
+    assert restored.to_dict() == detector.to_dict() == loaded.to_dict()
+
+    # Restored detectors keep evolving identically, across the switch from exact values to sketches
+    for amount in rng.lognormal(3.0, 0.8, 2 * EXACT_WARMUP):
+        for category in ["Food", "Rent"]:
+            assert restored.score_and_update(category, amount) == detector.score_and_update(category, amount)
+    assert restored.to_dict() == detector.to_dict()
@@ -0,0 +1,33 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from order_search import choose_differencing
+
+MONTHS = pd.date_range("2020-01-31", periods=48, freq="ME")
+
+@pytest.fixture(autouse=True)
+def quiet_kpss():
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore") # KPSS warns when its p-value is outside the lookup table
+        yield
+
+def test_quadratic_needs_second_order_differencing():
+    t = np.arange(len(MONTHS), dtype=float)
+    assert choose_differencing(pd.Series(t ** 2, index=MONTHS)) == 2
+    noise = np.random.default_rng(0).normal(0, 5, len(MONTHS))
+    assert choose_differencing(pd.Series(3 * t ** 2 + noise, index=MONTHS)) == 2
+
+def test_linear_trend_needs_first_order_differencing():
+    t = np.arange(len(MONTHS), dtype=float)
+    noise = np.random.default_rng(1).normal(0, 1, len(MONTHS))
+    assert choose_differencing(pd.Series(5 * t + noise, index=MONTHS)) == 1
+
+def test_stationary_series_is_not_differenced():
+    assert choose_differencing(pd.Series(np.random.default_rng(2).normal(100, 5, len(MONTHS)), index=MONTHS)) == 0
+
+def test_max_d_caps_the_order():
+    t = np.arange(len(MONTHS), dtype=float)
+    assert choose_differencing(pd.Series(t ** 2, index=MONTHS), max_d=1) == 1
@@ -0,0 +1,58 @@
+import json
+import os
+
+import pandas as pd
+import pytest
+
+import result_store
+from pipeline import run_stages
+from result_store import find_result, read_results, write_results
+
+def as_json(results):
+    return json.loads(json.dumps(results, default=str))
+
+@pytest.fixture
+def results(transactions):
+    """Pipeline results, with category names that are not safe as file names."""
+    unsafe = transactions.assign(category=transactions["category"].astype(str).replace({"Groceries": "Food/Drinks", "Utilities": "../x"}))
+    results = as_json(run_stages(unsafe))
+    monthly = results["spending_analysis"]["spending_patterns"]["monthly_spending"]
+    results["by_category"] = {"Food/Drinks": monthly, "../x": monthly} # Keyed by category, as per-category forecasts are
+    return results
+
+FORMATS = ["json", "orjson", "parquet"] + (["msgpack"] if result_store.msgpack is not None else [])
+
+@pytest.mark.parametrize("fmt", FORMATS)
+def test_round_trip(results, tmp_path, fmt):
+    path = write_results(results, str(tmp_path / "out" / "results.json"), fmt)
+    assert read_results(path) == results
+    assert find_result(str(tmp_path / "out" / "results.json")) == path
+
+def test_parquet_tables_stay_inside_the_result_directory(results, tmp_path):
+    path = write_results(results, str(tmp_path / "results.json"), "parquet")
+    assert sorted(os.listdir(tmp_path)) == ["results.parquet"]
+    files = set(os.listdir(path))
+    with open(os.path.join(path, result_store.DOCUMENT_NAME)) as f:
+        document = json.load(f)
+    assert files == {result_store.DOCUMENT_NAME} | {f"{name}.parquet" for name in document["tables"]}
+    assert all(name.startswith("table_") for name in document["tables"])
+    assert ["spending_analysis", "spending_patterns", "spending_by_category"] in document["tables"].values()
+
+def test_reads_directories_written_before_tables_were_indexed(tmp_path):
+    path = tmp_path / "legacy.parquet"
+    path.mkdir()
+    records = [{"month": "2024-01", "amount": 1.5}, {"month": "2024-02", "amount": 2.5}]
+    pd.DataFrame(records).to_parquet(path / "forecast.parquet", index=False)
+    (path / result_store.DOCUMENT_NAME).write_text(json.dumps({"forecast": {result_store.TABLE_MARKER: "forecast"}, "note": "x"}))
+    assert read_results(str(path)) == {"forecast": records, "note": "x"}
+
+def test_rejects_table_names_outside_the_directory(tmp_path):
+    path = tmp_path / "bad.parquet"
+    path.mkdir()
+    (path / result_store.DOCUMENT_NAME).write_text(json.dumps({"t": {result_store.TABLE_MARKER: "../outside"}}))
+    with pytest.raises(ValueError):
+        read_results(str(path))
+
+def test_unknown_format(results, tmp_path):
+    with pytest.raises(ValueError):
+        write_results(results, str(tmp_path / "results.json"), "xml")
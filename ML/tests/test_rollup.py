@@ -0,0 +1,51 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+from ingestion import USER_ID_FIELD
+from rollup import UNASSIGNED_USER_ID, SpendingRollup, aggregate_cells, rollup_paths
+
+def test_add_and_remove_match_a_rebuild(transactions):
+    half = len(transactions) // 2
+    removed = transactions.sample(frac=0.2, random_state=3)
+    rollup = SpendingRollup.from_frame(transactions.iloc[:half])
+    rollup.add(transactions.iloc[half:]).remove(removed)
+
+    expected = SpendingRollup.from_frame(transactions.drop(index=removed.index))
+    pd.testing.assert_frame_equal(rollup.table, expected.table, check_exact=False)
+    removed_ids = set(removed["id"].astype(str))
+    assert not any(str(a["id"]) in removed_ids for a in rollup.detected_anomalies()["detected_anomalies"])
+
+def test_cells_match_aggregate_cells(transactions):
+    rollup = SpendingRollup.from_frame(transactions)
+    user_df = transactions[transactions[USER_ID_FIELD] == "user1"]
+    expected = aggregate_cells(user_df).assign(category=lambda cells: cells["category"].astype(str))
+    pd.testing.assert_frame_equal(rollup.cells("user1"), expected, check_exact=False, check_dtype=False)
+    assert rollup.cells("nobody").empty
+
+def test_missing_user_ids_are_unassigned(transactions):
+    users = transactions[USER_ID_FIELD].astype(object)
+    df = transactions.assign(**{USER_ID_FIELD: users.where(users != "user0", np.nan)})
+    assert set(SpendingRollup.from_frame(df).users()) == {"user1", "user2", UNASSIGNED_USER_ID}
+
+def test_save_and_load_round_trip(transactions, tmp_path):
+    rollup = SpendingRollup.from_frame(transactions)
+    rollup.meta["data_version"] = "v1"
+    rollup.save("transactions", str(tmp_path))
+
+    loaded = SpendingRollup.load("transactions", str(tmp_path))
+    pd.testing.assert_frame_equal(loaded.table, rollup.table)
+    assert {user: d.to_dict() for user, d in loaded.detectors.items()} == {user: d.to_dict() for user, d in rollup.detectors.items()}
+    assert json.loads(json.dumps(loaded.anomalies)) == json.loads(json.dumps(rollup.anomalies, default=str))
+    assert loaded.meta == rollup.meta
+
+def test_rollups_from_an_older_version_are_rebuilt(transactions, tmp_path):
+    SpendingRollup.from_frame(transactions).save("transactions", str(tmp_path))
+    _, state_path = rollup_paths("transactions", str(tmp_path))
+    with open(state_path, "r") as f:
+        state = json.load(f)
+    del state["version"]
+    with open(state_path, "w") as f:
+        json.dump(state, f)
+    assert SpendingRollup.load("transactions", str(tmp_path)) is None
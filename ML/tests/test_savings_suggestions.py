@@ -0,0 +1,168 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ingestion import USER_ID_FIELD
+from rollup import aggregate_cells
+from savings_suggestions import (COMPARISON_MONTHS, DISCRETIONARY_CATEGORIES, INCREASE_THRESHOLD, TOP_N_CATEGORIES,
+                                 backfill_savings, suggest_savings_batch, suggest_savings_cells)
+
+# --- Reference: the per-user filter-and-loop version the vectorized pass replaced ---
+
+def reference_suggest_savings_cells(cells, as_of):
+    """The original suggest_savings_cells with "now" set to as_of and only data up to its month."""
+    last_month_period = pd.Timestamp(as_of).to_period("M") - 1
+    cells = cells[cells["year_month"] <= last_month_period + 1]
+    if cells.empty:
+        return {"error": "No data available for savings suggestions."}
+    suggestions = []
+
+    if last_month_period not in cells["year_month"].unique():
+        suggestions.append({
+            "type": "info",
+            "message": f"Insufficient data for the most recent full month {last_month_period.strftime('%Y-%m')} to generate detailed savings suggestions."
+        })
+        category_spending = cells.groupby("category", observed=True)["amount"].sum().sort_values(ascending=False)
+        top_categories = category_spending.head(TOP_N_CATEGORIES)
+        suggestions.append({
+            "type": "top_categories_overall",
+            "message": f"Your overall top {TOP_N_CATEGORIES} spending categories are: {', '.join(top_categories.index.tolist())}. Reviewing these might reveal savings opportunities.",
+            "details": top_categories.reset_index().to_dict(orient="records")
+        })
+        return {"savings_suggestions": suggestions}
+
+    last_month_df = cells[cells["year_month"] == last_month_period]
+    category_spending_last_month = last_month_df.groupby("category", observed=True)["amount"].sum().sort_values(ascending=False)
+    top_categories_last_month = category_spending_last_month.head(TOP_N_CATEGORIES)
+    suggestions.append({
+        "type": "top_categories_last_month",
+        "message": f"In {last_month_period.strftime('%B %Y')}, your top {len(top_categories_last_month)} spending categories were: {', '.join(top_categories_last_month.index.tolist())}. Consider reviewing these areas.",
+        "details": top_categories_last_month.reset_index().to_dict(orient="records")
+    })
+    top_discretionary = top_categories_last_month[top_categories_last_month.index.isin(DISCRETIONARY_CATEGORIES)]
+    if not top_discretionary.empty:
+        suggestions.append({
+            "type": "top_discretionary",
+            "message": f"Among your top spending areas last month, these are often considered discretionary: {', '.join(top_discretionary.index.tolist())}. Reducing spending here could lead to savings.",
+            "details": top_discretionary.reset_index().to_dict(orient="records")
+        })
+
+    comparison_start_period = last_month_period - COMPARISON_MONTHS
+    comparison_df = cells[(cells["year_month"] >= comparison_start_period) & (cells["year_month"] < last_month_period)]
+    if not comparison_df.empty:
+        avg_monthly_spending_prev = comparison_df.groupby(["year_month", "category"], observed=True)["amount"].sum().unstack(fill_value=0).mean()
+        comparison = pd.DataFrame({
+            "last_month": last_month_df.groupby("category", observed=True)["amount"].sum(),
+            "previous_avg": avg_monthly_spending_prev
+        }).fillna(0)
+        comparison["change"] = comparison["last_month"] - comparison["previous_avg"]
+        comparison["pct_change"] = (comparison["change"] / comparison["previous_avg"]).replace([np.inf, -np.inf], np.nan).fillna(0)
+        significant_increases = comparison[(comparison["pct_change"] > INCREASE_THRESHOLD) & (comparison["last_month"] > 0)]
+        for category, row in significant_increases.sort_values("pct_change", ascending=False).iterrows():
+            suggestions.append({
+                "type": "spending_increase",
+                "category": category,
+                "message": f"Spending in \"{category}\" increased by {row['pct_change']:.0%} last month compared to the previous {COMPARISON_MONTHS}-month average (spent {row['last_month']:.2f} vs avg {row['previous_avg']:.2f}).",
+                "last_month_amount": row["last_month"],
+                "previous_avg_amount": row["previous_avg"],
+                "percentage_increase": row["pct_change"]
+            })
+
+    fast_food_last_month = last_month_df[last_month_df["category"] == "Fast Food"]
+    purchase_count = int(fast_food_last_month["count"].sum())
+    if purchase_count > 5:
+        total_amount = fast_food_last_month["amount"].sum()
+        suggestions.append({
+            "type": "frequent_small_purchases",
+            "category": "Fast Food",
+            "message": f"You made {purchase_count} purchases in \"Fast Food\" last month, totaling {total_amount:.2f}. Even small amounts add up.",
+            "count": purchase_count,
+            "total_amount": total_amount,
+            "average_amount": total_amount / purchase_count
+        })
+
+    if not suggestions:
+        suggestions.append({"type": "info", "message": "No specific savings suggestions identified based on recent spending patterns."})
+    return {"savings_suggestions": suggestions}
+
+def as_json(result):
+    return json.loads(json.dumps(result, default=float))
+
+def assert_same(result, expected):
+    """Equal up to float rounding in the amounts (the vectorized sums add in a different order)."""
+    _assert_same(as_json(result), as_json(expected))
+
+def _assert_same(result, expected):
+    if isinstance(expected, dict):
+        assert result.keys() == expected.keys()
+        for key in expected:
+            _assert_same(result[key], expected[key])
+    elif isinstance(expected, list):
+        assert len(result) == len(expected)
+        for r, e in zip(result, expected):
+            _assert_same(r, e)
+    elif isinstance(expected, float):
+        assert result == pytest.approx(expected, rel=1e-9, abs=1e-9)
+    else:
+        assert result == expected
+
+# --- Input ---
+
+def cell_rows(user_id, rows):
+    return pd.DataFrame(
+        [(user_id, pd.Period(month, freq="M"), category, float(amount), count) for month, category, amount, count in rows],
+        columns=[USER_ID_FIELD, "year_month", "category", "amount", "count"],
+    )
+
+@pytest.fixture
+def cells(transactions):
+    """Synthetic user cells plus hand-made users covering the edge cases of every rule."""
+    edge_cases = [
+        # Frequent Fast Food, a category new last month and a large increase
+        cell_rows("dense", [("2024-03", "Fast Food", 40, 4), ("2024-04", "Fast Food", 50, 5), ("2024-05", "Fast Food", 120, 9),
+                            ("2024-03", "Travel", 100, 1), ("2024-05", "Travel", 400, 2), ("2024-05", "Gifts", 30, 1)]),
+        cell_rows("new", [("2024-05", "Groceries", 80, 3)]), # Nothing before the last month
+        cell_rows("lapsed", [("2022-06", "Shopping", 70, 1), ("2022-07", "Groceries", 20, 2)]), # Falls back to overall top
+        cell_rows("future", [("2026-01", "Groceries", 10, 1)]), # No data up to any as_of below
+        cell_rows("single", [(month, "Rent", 1000, 1) for month in ["2024-01", "2024-02", "2024-03", "2024-04", "2024-05"]]),
+    ]
+    return pd.concat([aggregate_cells(transactions, by_user=True)] + edge_cases, ignore_index=True)
+
+AS_OF = ["2022-02-15", "2022-08-01", "2023-07-31", "2024-06-10", "2025-01-01"]
+
+@pytest.mark.parametrize("as_of", AS_OF)
+def test_single_user_matches_reference(cells, as_of):
+    for user_id, user_cells in cells.groupby(USER_ID_FIELD):
+        user_cells = user_cells.drop(columns=USER_ID_FIELD).reset_index(drop=True)
+        assert_same(suggest_savings_cells(user_cells, as_of), reference_suggest_savings_cells(user_cells, as_of))
+
+@pytest.mark.parametrize("as_of", AS_OF)
+def test_batch_matches_reference_per_user(cells, as_of):
+    expected = {}
+    for user_id, user_cells in cells.groupby(USER_ID_FIELD):
+        result = reference_suggest_savings_cells(user_cells.drop(columns=USER_ID_FIELD), as_of)
+        if "error" not in result: # Users without data up to as_of are left out of a batch
+            expected[user_id] = result
+    assert_same(suggest_savings_batch(cells, as_of), expected)
+
+def test_edge_cases_are_exercised(cells):
+    types = {user_id: [s["type"] for s in result["savings_suggestions"]] for user_id, result in suggest_savings_batch(cells, "2024-06-10").items()}
+    assert "frequent_small_purchases" in types["dense"]
+    assert "spending_increase" in types["dense"]
+    assert "spending_increase" not in types["new"]
+    assert "top_categories_overall" in types["lapsed"]
+    assert "future" not in types
+
+def test_backfill_matches_monthly_batches(cells):
+    backfill = backfill_savings(cells, "2022-01", "2024-12")
+    assert len(backfill) == 36
+    for month, results in backfill.items():
+        assert_same(results, suggest_savings_batch(cells, (pd.Period(month, freq="M") + 1).to_timestamp()))
+
+def test_empty_cells():
+    empty = cell_rows("nobody", [])
+    assert "error" in suggest_savings_cells(empty.drop(columns=USER_ID_FIELD))
+    assert suggest_savings_batch(empty) == {}
+    assert backfill_savings(empty, "2024-01", "2024-03") == {}
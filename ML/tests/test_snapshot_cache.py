@@ -0,0 +1,124 @@
+import datetime
+import glob
+import json
+import os
+
+import pandas as pd
+import pytest
+
+import snapshot_cache
+from conftest import FAKE_CREDENTIALS
+from snapshot_cache import (DELETED_AT_FIELD, SNAPSHOT_COLUMNS, TOMBSTONE_SUFFIX, UPDATED_AT_FIELD, docs_to_frame,
+                            load_snapshot, snapshot_paths, sync_snapshot)
+
+COLLECTION = "transactions"
+SYNCED = datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc)
+
+def full_scan(firestore):
+    return docs_to_frame(firestore.collection(COLLECTION).stream())
+
+def assert_same_rows(df, expected):
+    df, expected = (frame.sort_values("id").reset_index(drop=True)[SNAPSHOT_COLUMNS] for frame in (df, expected))
+    pd.testing.assert_frame_equal(df, expected, check_dtype=False)
+
+def delta_files(snapshot_dir):
+    return glob.glob(os.path.join(snapshot_dir, f"{COLLECTION}.delta-*.parquet"))
+
+def read_meta(snapshot_dir):
+    with open(snapshot_paths(COLLECTION, snapshot_dir)[1], "r") as f:
+        return json.load(f)
+
+def write_meta(snapshot_dir, meta):
+    with open(snapshot_paths(COLLECTION, snapshot_dir)[1], "w") as f:
+        json.dump(meta, f)
+
+@pytest.fixture
+def snapshot_dir(firestore, raw_rows, tmp_path):
+    """A snapshot of the synthetic collection taken by a cold-start sync."""
+    firestore.load(COLLECTION, raw_rows, updatedAt=SYNCED)
+    snapshot_dir = str(tmp_path / "cache")
+    sync_snapshot(FAKE_CREDENTIALS, COLLECTION, snapshot_dir)
+    return snapshot_dir
+
+class Changes:
+    """Edits, adds and deletes (with a tombstone) documents the way the app does."""
+
+    def __init__(self, firestore):
+        self.documents = firestore.documents(COLLECTION)
+        self.tombstones = firestore.documents(f"{COLLECTION}{TOMBSTONE_SUFFIX}")
+        self.ids = sorted(self.documents)
+        self.step = 0
+
+    def __call__(self):
+        self.step += 1
+        updated_at = SYNCED + datetime.timedelta(minutes=self.step)
+        edited, deleted = self.ids[self.step], self.ids[-self.step]
+        self.documents[edited] = dict(self.documents[edited], amount=str(1000 + self.step), **{UPDATED_AT_FIELD: updated_at})
+        self.documents[f"new-{self.step}"] = dict(self.documents[self.ids[0]], **{UPDATED_AT_FIELD: updated_at})
+        del self.documents[deleted]
+        self.tombstones[deleted] = {DELETED_AT_FIELD: datetime.datetime.now(datetime.timezone.utc)}
+        return edited, deleted
+
+def test_warm_sync_writes_a_delta(firestore, snapshot_dir):
+    edited, deleted = Changes(firestore)()
+    df = sync_snapshot(FAKE_CREDENTIALS, COLLECTION, snapshot_dir)
+
+    assert len(delta_files(snapshot_dir)) == 1
+    assert read_meta(snapshot_dir)["deltas"] == [os.path.basename(path) for path in delta_files(snapshot_dir)]
+    assert_same_rows(df, full_scan(firestore))
+    assert_same_rows(load_snapshot(COLLECTION, snapshot_dir)[0], full_scan(firestore))
+    assert df.loc[df["id"] == edited, "amount"].tolist() == ["1001"]
+
+def test_tombstones_delete_cached_rows(firestore, snapshot_dir):
+    _, deleted = Changes(firestore)()
+    firestore.documents(f"{COLLECTION}{TOMBSTONE_SUFFIX}")["never-existed"] = {
+        DELETED_AT_FIELD: datetime.datetime.now(datetime.timezone.utc)
+    }
+    df = sync_snapshot(FAKE_CREDENTIALS, COLLECTION, snapshot_dir)
+
+    assert deleted not in set(df["id"])
+    assert deleted not in set(load_snapshot(COLLECTION, snapshot_dir)[0]["id"])
+    assert_same_rows(df, full_scan(firestore))
+
+def test_deltas_are_compacted_after_max_delta_files(firestore, snapshot_dir, monkeypatch):
+    monkeypatch.setattr(snapshot_cache, "MAX_DELTA_FILES", 3)
+    change = Changes(firestore)
+    for expected_deltas in [1, 2, 3, 0, 1]:
+        change()
+        df = sync_snapshot(FAKE_CREDENTIALS, COLLECTION, snapshot_dir)
+        assert len(delta_files(snapshot_dir)) == len(read_meta(snapshot_dir)["deltas"]) == expected_deltas
+        assert_same_rows(df, full_scan(firestore))
+        assert_same_rows(load_snapshot(COLLECTION, snapshot_dir)[0], full_scan(firestore))
+
+def test_full_refresh_picks_up_edits_without_updated_at(firestore, snapshot_dir):
+    Changes(firestore)()
+    sync_snapshot(FAKE_CREDENTIALS, COLLECTION, snapshot_dir)
+    documents = firestore.documents(COLLECTION)
+    silent = sorted(documents)[-1]
+    documents[silent] = dict(documents[silent], amount="77777") # updatedAt not bumped
+
+    df = sync_snapshot(FAKE_CREDENTIALS, COLLECTION, snapshot_dir)
+    assert df.loc[df["id"] == silent, "amount"].tolist() != ["77777"]
+
+    meta = read_meta(snapshot_dir)
+    last_full = pd.Timestamp.now(tz="UTC") - pd.Timedelta(days=snapshot_cache.FULL_REFRESH_DAYS + 1)
+    write_meta(snapshot_dir, dict(meta, full_refreshed_at=last_full.isoformat()))
+    df = sync_snapshot(FAKE_CREDENTIALS, COLLECTION, snapshot_dir)
+
+    assert df.loc[df["id"] == silent, "amount"].tolist() == ["77777"]
+    assert delta_files(snapshot_dir) == [] and read_meta(snapshot_dir)["deltas"] == []
+    assert pd.Timestamp(read_meta(snapshot_dir)["full_refreshed_at"]) > last_full
+    assert_same_rows(df, full_scan(firestore))
+
+def test_unchanged_sync_writes_no_delta(firestore, snapshot_dir):
+    meta = read_meta(snapshot_dir)
+    sync_snapshot(FAKE_CREDENTIALS, COLLECTION, snapshot_dir)
+    assert read_meta(snapshot_dir) == meta
+
+    # Metadata written before data versions existed gets one, still without an empty delta
+    del meta["data_version"]
+    write_meta(snapshot_dir, meta)
+    for _ in range(3):
+        sync_snapshot(FAKE_CREDENTIALS, COLLECTION, snapshot_dir)
+    assert "data_version" in read_meta(snapshot_dir)
+    assert delta_files(snapshot_dir) == [] and read_meta(snapshot_dir)["deltas"] == []
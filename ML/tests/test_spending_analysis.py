@@ -0,0 +1,74 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from spending_analysis import detect_anomalies_iqr
+
+# --- Reference: the per-group loop the vectorized detection replaced ---
+
+def reference_detect_anomalies_iqr(df, group_by_col="category", value_col="amount", threshold=1.5):
+    if df.empty or group_by_col not in df.columns or value_col not in df.columns:
+        return {"error": "Insufficient data or invalid columns for anomaly detection."}
+
+    anomalies = []
+    for name, group in df.groupby(group_by_col, observed=True):
+        if len(group) < 5:
+            continue
+        Q1 = group[value_col].quantile(0.25)
+        Q3 = group[value_col].quantile(0.75)
+        IQR = Q3 - Q1
+        lower_bound = Q1 - threshold * IQR
+        upper_bound = Q3 + threshold * IQR
+        for _, row in group[(group[value_col] < lower_bound) | (group[value_col] > upper_bound)].iterrows():
+            anomaly_info = row.to_dict()
+            anomaly_info["anomaly_reason"] = f"Amount {row[value_col]:.2f} outside IQR bounds [{lower_bound:.2f}, {upper_bound:.2f}] for category '{name}'"
+            if "date" in anomaly_info and isinstance(anomaly_info["date"], pd.Timestamp):
+                anomaly_info["date"] = anomaly_info["date"].strftime("%Y-%m-%d")
+            if "year_month" in anomaly_info and isinstance(anomaly_info["year_month"], pd.Period):
+                anomaly_info["year_month"] = str(anomaly_info["year_month"])
+            anomalies.append(anomaly_info)
+    return {"detected_anomalies": anomalies}
+
+def as_json(result):
+    return json.loads(json.dumps(result, default=str))
+
+# --- Input ---
+
+@pytest.fixture
+def with_outliers(transactions):
+    """Synthetic expenses plus outliers, a category of exactly five and one of four transactions."""
+    rng = np.random.default_rng(3)
+    df = transactions.copy()
+    spikes = df.sample(25, random_state=3).index
+    df.loc[spikes, "amount"] = df.loc[spikes, "amount"] * rng.uniform(5, 20, len(spikes))
+    tiny = df.head(9).copy()
+    tiny["category"] = ["Five"] * 5 + ["Four"] * 4
+    tiny["amount"] = [10.0, 11.0, 12.0, 13.0, 500.0, 10.0, 11.0, 12.0, 900.0]
+    tiny["id"] = [f"tiny{i}" for i in range(9)]
+    df = pd.concat([df.astype({"category": str}), tiny], ignore_index=True)
+    return df.sample(frac=1.0, random_state=4) # Groups are interleaved, not contiguous
+
+@pytest.mark.parametrize("group_by_col", ["category", "userId"])
+@pytest.mark.parametrize("threshold", [1.5, 0.5])
+def test_matches_per_group_loop(with_outliers, group_by_col, threshold):
+    expected = reference_detect_anomalies_iqr(with_outliers, group_by_col, threshold=threshold)
+    result = detect_anomalies_iqr(with_outliers, group_by_col, threshold=threshold)
+    assert as_json(result) == as_json(expected)
+    assert expected["detected_anomalies"]
+
+def test_categorical_groups_match_per_group_loop(with_outliers):
+    df = with_outliers.astype({"category": "category"})
+    assert as_json(detect_anomalies_iqr(df)) == as_json(reference_detect_anomalies_iqr(df))
+
+def test_minimum_group_size(with_outliers):
+    flagged = {record["id"] for record in detect_anomalies_iqr(with_outliers)["detected_anomalies"]}
+    assert "tiny4" in flagged # 500 in a group of five
+    assert "tiny8" not in flagged # 900 in a group of four is never scored
+
+def test_no_anomalies_and_invalid_input(transactions):
+    uniform = transactions.assign(amount=10.0)
+    assert detect_anomalies_iqr(uniform) == reference_detect_anomalies_iqr(uniform) == {"detected_anomalies": []}
+    assert "error" in detect_anomalies_iqr(transactions, group_by_col="missing")
+    assert "error" in detect_anomalies_iqr(pd.DataFrame())
@@ -27,6 +27,8 @@ class Transaction {
       'date': DateFormat(
         'MM/dd/yyyy',
       ).format(date), // Store date as String in 'MM/dd/yyyy' format
+      // Sortable copy of the date for range queries (see SORTABLE_DATE_FIELD in ML/ingestion.py)
+      'dateKey': DateFormat('yyyy-MM-dd').format(date),
       'description': description,
       'amount': amount, // Store amount as double
       'category': category,
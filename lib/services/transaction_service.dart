@@ -12,7 +12,11 @@ class TransactionService {
 
   // Add a new transaction
   Future<void> addTransaction(Transaction transaction) {
-    return _db.collection('transactions').add(transaction.toJson());
+    return _db.collection('transactions').add({
+      ...transaction.toJson(),
+      // Watermark used by the ML snapshot sync to pull only changed documents
+      'updatedAt': FieldValue.serverTimestamp(),
+    });
   }
 
   // Update an existing transaction
@@ -20,11 +24,19 @@ class TransactionService {
     return _db
         .collection('transactions')
         .doc(transaction.id)
-        .update(transaction.toJson());
+        .update({
+          ...transaction.toJson(),
+          'updatedAt': FieldValue.serverTimestamp(),
+        });
   }
 
-  // Delete a transaction
+  // Delete a transaction and leave a tombstone so the ML snapshot sync can drop it
   Future<void> deleteTransaction(String id) {
-    return _db.collection('transactions').doc(id).delete();
+    final batch = _db.batch();
+    batch.delete(_db.collection('transactions').doc(id));
+    batch.set(_db.collection('transactions_deletions').doc(id), {
+      'deletedAt': FieldValue.serverTimestamp(),
+    });
+    return batch.commit();
   }
 }